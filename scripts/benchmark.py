@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+'''
+Benchmark the pipeline on simulated populations of increasing size.
+
+For each population size, a pedigree is simulated with `simulate.py` (and kept in the work
+directory for later runs), and the following stages are timed:
+
+    ged2csv:            Convert the Gedcom file to CSV (`ged2csv.py`).
+    csv2dict:           Read the CSV into a genealogy store, with no binary cache.
+    csv2dict_cache:     Read the genealogy store from the binary cache.
+    gen:                Construct a `Gen` object of the probands.
+    gen_batch:          Construct a `Gen` object of the probands, with `batch=True`.
+    lineage:            Reconstruct the lineage of each proband separately (`lineage`).
+    calc_depth:         Calculate the generational depth of each proband (`calc_depth`).
+
+The probands are the youngest individuals of the population. Each stage runs in a fresh
+process forked from the benchmark, so that its peak memory (maximum resident set size) can be
+measured. Its input is prepared in the same process before the stage is timed.
+
+The results can be saved as a baseline (JSON), and compared with a baseline from an earlier
+run. A stage is flagged as a regression if its wall time or peak memory exceeds the baseline by
+more than the tolerance, and the benchmark then exits with status 1.
+
+Usage:
+    python benchmark.py --sizes 10000 100000 1000000 --save_baseline baseline.json
+    python benchmark.py --sizes 10000 100000 1000000 --baseline baseline.json
+'''
+
+from simulate import simulate, write_ged, write_csv
+from ged2csv import ged2csv
+from lineages import Gen, csv2dict, lineage
+from utils import calc_depth
+from profiling import peak_rss
+import numpy as np
+import multiprocessing
+import argparse, json, os, sys, time
+
+STAGES = ('ged2csv', 'csv2dict', 'csv2dict_cache', 'gen', 'gen_batch', 'lineage', 'calc_depth')
+
+# Differences from the baseline smaller than these are not flagged, as they are noise.
+MIN_TIME = 0.1  # Seconds.
+MIN_MEMORY = 20.0  # MB.
+
+
+def population(n, seed, workdir):
+    '''
+    Paths to the Gedcom file and the CSV of a simulated population, simulating it if needed.
+
+    Returns:
+    Tuple (ged, csv) of paths.
+    '''
+    ged = os.path.join(workdir, 'sim_%d_seed%d.ged' % (n, seed))
+    csv = os.path.join(workdir, 'sim_%d_seed%d.csv' % (n, seed))
+    if not (os.path.isfile(ged) and os.path.isfile(csv)):
+        ped = simulate(n, seed=seed)
+        write_ged(ped, ged)
+        write_csv(ped, csv)
+    return ged, csv
+
+
+def _probands(csv, k):
+    '''IDs of the `k` youngest individuals in a genealogy CSV. Also builds the binary cache.'''
+    store = csv2dict(csv, cache=True)
+    youngest = np.argsort(-np.nan_to_num(store.birth_year, nan=-1), kind='stable')[:k]
+    return store.ind[youngest].tolist()
+
+
+def _run_stage(task):
+    '''Prepare and time a single stage, see top of file. Runs in a separate process.'''
+    stage, ged, csv, probands = task
+
+    # Prepare the input of the stage.
+    if stage == 'lineage':
+        store = csv2dict(csv, cache=True)
+    elif stage == 'calc_depth':
+        gen = Gen(csv, probands)
+    out = csv + '.benchmark.csv'
+
+    wall = time.perf_counter()
+    cpu = time.process_time()
+
+    if stage == 'ged2csv':
+        ged2csv(ged, out)
+    elif stage == 'csv2dict':
+        csv2dict(csv)
+    elif stage == 'csv2dict_cache':
+        csv2dict(csv, cache=True)
+    elif stage == 'gen':
+        Gen(csv, probands)
+    elif stage == 'gen_batch':
+        Gen(csv, probands, batch=True)
+    elif stage == 'lineage':
+        for ind in probands:
+            lineage(ind, store, dict())
+    elif stage == 'calc_depth':
+        for ind in probands:
+            calc_depth(ind, gen)
+
+    wall = time.perf_counter() - wall
+    cpu = time.process_time() - cpu
+
+    if os.path.isfile(out):
+        os.remove(out)
+
+    return {'wall': wall, 'cpu': cpu, 'peak_rss_mb': peak_rss()}
+
+
+def benchmark(sizes, stages=STAGES, probands=1000, seed=0, workdir='.'):
+    '''
+    Run the benchmark, see top of file.
+
+    Input:
+        sizes:      List of integers, population sizes.
+        stages:     List of strings, stages to run, see `STAGES` [all].
+        probands:   Integer, number of probands [1000].
+        seed:       Integer, seed of the simulations [0].
+        workdir:    String, directory to keep the simulated populations in ['.'].
+
+    Returns:
+    Dictionary, the results of each stage by "[size]/[stage]", each a dictionary with wall time
+    and CPU time in seconds, and peak memory in MB.
+    '''
+    # Fork fresh processes, so that each stage starts with the small memory of the benchmark.
+    context = multiprocessing.get_context('fork')
+
+    results = dict()
+    for n in sizes:
+        ged, csv = population(n, seed, workdir)
+
+        with context.Pool(1) as pool:
+            inds = pool.apply(_probands, (csv, probands))
+
+        for stage in stages:
+            with context.Pool(1) as pool:
+                results['%d/%s' % (n, stage)] = pool.apply(_run_stage, ((stage, ged, csv, inds),))
+
+    return results
+
+
+def regressions(results, baseline, tolerance):
+    '''
+    Compare results with a baseline, see `benchmark`.
+
+    Returns:
+    List of strings, a description of each regression.
+    '''
+    found = list()
+    for key, res in sorted(results.items()):
+        if key not in baseline:
+            continue
+        base = baseline[key]
+        if res['wall'] > base['wall'] * (1 + tolerance) and res['wall'] - base['wall'] > MIN_TIME:
+            found.append('%s: wall time %.2f s, baseline %.2f s' % (key, res['wall'], base['wall']))
+        if (res['peak_rss_mb'] > base['peak_rss_mb'] * (1 + tolerance)
+                and res['peak_rss_mb'] - base['peak_rss_mb'] > MIN_MEMORY):
+            found.append('%s: peak memory %.0f MB, baseline %.0f MB' % (key, res['peak_rss_mb'], base['peak_rss_mb']))
+    return found
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+
+    # Arguments for parser.
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000], help='Population sizes.')
+    parser.add_argument('--stages', type=str, nargs='+', default=list(STAGES), choices=STAGES, help='Stages to run.')
+    parser.add_argument('--probands', type=int, default=1000, help='Number of probands.')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the simulations.')
+    parser.add_argument('--workdir', type=str, default='.', help='Directory to keep simulated populations in.')
+    parser.add_argument('--baseline', type=str, help='JSON with baseline results to compare with.')
+    parser.add_argument('--save_baseline', type=str, help='Path to write the results to, as JSON.')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='Allowed relative increase from the baseline.')
+
+    # Parse input arguments.
+    args = parser.parse_args()
+
+    results = benchmark(args.sizes, args.stages, args.probands, args.seed, args.workdir)
+
+    print('%-24s %10s %10s %12s' % ('stage', 'wall (s)', 'cpu (s)', 'peak (MB)'))
+    for n in args.sizes:
+        for stage in args.stages:
+            res = results['%d/%s' % (n, stage)]
+            print('%-24s %10.3f %10.3f %12.1f' % ('%d/%s' % (n, stage), res['wall'], res['cpu'], res['peak_rss_mb']))
+
+    if args.save_baseline is not None:
+        with open(args.save_baseline, 'w') as fid:
+            json.dump(results, fid, indent=2, sort_keys=True)
+
+    if args.baseline is not None:
+        with open(args.baseline) as fid:
+            baseline = json.load(fid)
+        found = regressions(results, baseline, args.tolerance)
+        for line in found:
+            print('REGRESSION %s' % line)
+        if found:
+            sys.exit(1)
+        print('No regressions against %s.' % args.baseline)
@@ -2,99 +2,696 @@
 '''
 Reads records from a Gedcom file ([filename].ged) and writes relevant fields to a CSV.
 
+The Gedcom file is read once, line by line. The relevant fields of the INDI records, and the
+HUSB/WIFE links of the FAM records, are collected in tables, and the parents of each
+individual are resolved by joining these tables at the end. Therefore, the file is never
+searched for the family records an individual points to.
+
 Usage:
     ged2csv.py [GED filename] [CSV filename]
+    ged2csv.py --raw-legacy-export [--cleaned-ged [GED output]] [GED filename] [CSV filename]
+    ged2csv.py --workers [number of processes] [GED filename] [CSV filename]
+    ged2csv.py --incremental [--changelog [changelog CSV]] [GED filename] [CSV filename]
+    ged2csv.py --refn-csv [REFN CSV] [GED filename] [CSV filename]
+    ged2csv.py --fields-csv [fields CSV] --fields [field,field,...] [GED filename] [CSV filename]
 
 Arguments:
     GED filename:       Path to a Gedcom file.
     CSV filename:       Path to output CSV file.
+
+Options:
+    --raw-legacy-export:    The Gedcom file is a Legacy export that has not been cleaned with
+                            `ged_cleanup.sh`. It is cleaned while it is read.
+    --cleaned-ged:          Path to write the cleaned Gedcom file to (with --raw-legacy-export).
+    --workers:              Number of processes to parse the Gedcom file with [1].
+    --incremental:          Only parse the records that changed since the CSV was last written
+                            with --incremental (see `ged2csv_incremental`).
+    --changelog:            Path to write the RINs of added, removed and modified individuals to
+                            (with --incremental).
+    --refn-csv:             Path to write a CSV with the RIN and REFN of all individuals to.
+    --fields-csv:           Path to write a CSV with the RIN and the fields given by --fields of
+                            all individuals to.
+    --fields:               Comma separated names of fields to write to --fields-csv, see
+                            `INDI_FIELDS`.
+    --profile:              Report the time and memory of each stage to standard error (see
+                            `profiling.py`).
+    --profile-json:         Path to also write the time and memory of each stage to, as JSON.
+
+All output CSV files are written from a single pass over the Gedcom file.
 '''
 
-from ged4py import GedcomReader
+from remove_unwanted_newlines import open_ged, clean_lines, write_lines, BUFFER_SIZE
+from lineages import csv2dict, cache_path, CSV_COLUMNS
+from profiling import profiler
+from multiprocessing import Pool
 import pandas as pd
-import sys, re, warnings
+import argparse, hashlib, json, os, re
+
+# Fields of INDI records that can be extracted (see `parse_records`), mostly those included by
+# `export_list.gel`. Each field is given by its level 1 tag, its level 2 tag (for fields of
+# events, such as BIRT DATE), and its value when it is not found in a record.
+INDI_FIELDS = {
+    'sex': ('SEX', None, 'U'),
+    'name': ('NAME', None, None),
+    'refn': ('REFN', None, None),
+    'birth_date': ('BIRT', 'DATE', None),
+    'birth_place': ('BIRT', 'PLAC', 'NA'),
+    'christening_date': ('CHR', 'DATE', None),
+    'christening_place': ('CHR', 'PLAC', None),
+    'death_date': ('DEAT', 'DATE', None),
+    'death_place': ('DEAT', 'PLAC', None),
+    'burial_date': ('BURI', 'DATE', None),
+    'burial_place': ('BURI', 'PLAC', None),
+}
 
-assert len(sys.argv) > 2, 'To few arguments to "ged2csv.py", see documentation for details.'
+# Fields needed to write the genealogy CSV.
+GENEALOGY_FIELDS = ('sex', 'birth_date', 'birth_place')
 
-ged_path = sys.argv[1]  # Path to input GED file.
-csv_path = sys.argv[2]  # Path to output CSV file.
+# Version of the format of the record fingerprints written by `ged2csv_incremental`.
+FINGERPRINT_VERSION = 1
 
-# List to store relevant fields of all records in.
-gen = list()
+# Number of chunks per worker when parsing in parallel. Using more chunks than workers
+# balances the load when records are unevenly distributed in the file.
+CHUNKS_PER_WORKER = 4
 
-count_none_rin = 0
 
 def format_rin(rin):
     '''Extract RIN, as Gedcom represents RIN as e.g. @I1@.'''
     return rin[2:-1]
 
-# Initialize GED parser.
-with GedcomReader(ged_path, encoding='utf-8') as parser:
-    # iterate over all INDI records
-    for i, record in enumerate(parser.records0('INDI')):
-        # Get individual RIN ID.
-        ind_ref = int(format_rin(record.xref_id))
-
-        # Get the RIN ID of the individuals parents.
-        # If the parent does not exist, set to 0.
-
-        fa = record.father
-        fa_ref = 0
-        if not fa is None:
-            if fa.xref_id is not None:
-                fa_ref = int(format_rin(fa.xref_id))
-
-        mo = record.mother
-        mo_ref = 0
-        if not mo is None:
-            if mo.xref_id is not None:
-                mo_ref = int(format_rin(mo.xref_id))
-
-        # Get information about individual in a dictionary.
-        ind_records = {r.tag: r for r in record.sub_records}
-
-        sex = ind_records['SEX'].value
-
-        birth = ind_records.get('BIRT')
-
-        # NOTE: some individuals are "unknown" in AEBS and usually have no "BIRT" record.
-        # Such individuals will always have parental records "0". Therefore, when reconstructing
-        # a genealogy in "scripts/lineage.py", any lineage will stop at such an "unknown"
-        # individual.
-
-        # If birth year or place is not found in record, it is set to NA.
-        birth_year = 'NA'
-        birth_place = 'NA'
-        if birth is not None:
-            birth_records = {r.tag: r for r in birth.sub_records}
-
-            # Get birth year of individual.
-            birth_date = birth_records.get('DATE')  # Date record, or None.
-            if birth_date is not None:
-                birth_date = birth_date.value  # DateValue object.
-                birth_date = birth_date.fmt()  # Birth date as a string.
-                # Match birth year in string using regex, as format is inconsistent.
-                match = re.search('\d{4}', birth_date)  # Find four letter digit.
-                if match:
-                    birth_year = birth_date[match.start():match.end()]  # Birth year as a string.
-
-                    # If the birth year is not an integer, something probably went wrong.
-                    # Just make a warning.
-                    try:
-                        _ = int(birth_year)
-                    except ValueError:
-                        warnings.warn('Non integer birth year in record %d: %s' %(ind_ref, birth_year), Warning)
-
-            # Get birth place of individual.
-            birth_place = birth_records.get('PLAC')  # Get the record with tag "PLAC".
-            if birth_place is not None:
-                birth_place = birth_place.value
-
-        # Add record to list.
-        gen.append((ind_ref, fa_ref, mo_ref, sex, birth_year, birth_place))
-
-# Convert list of records to dataframe and write to CSV.
-gen = pd.DataFrame(data=gen, columns=('ind', 'father', 'mother', 'sex', 'birth_year', 'birth_place'))
-gen.to_csv(csv_path, index=None)
 
+def parse_line(line):
+    '''
+    Split a Gedcom line into level, cross-reference ID, tag and value.
+
+    Example:
+        parse_line('0 @I1@ INDI')  # (0, '@I1@', 'INDI', '')
+        parse_line('2 DATE 1990')  # (2, None, 'DATE', '1990')
+
+    Returns:
+    Tuple (level, xref, tag, value), or None if the line is not a valid Gedcom line.
+    '''
+    parts = line.split(' ', 2)
+    if len(parts) < 2 or not parts[0].isdigit():
+        return None
+
+    level = int(parts[0])
+    xref = None
+    if parts[1].startswith('@'):
+        # Line has a cross-reference ID, e.g. "0 @I1@ INDI".
+        xref = parts[1]
+        parts = [parts[0]] + (parts[2].split(' ', 1) if len(parts) > 2 else [''])
+
+    tag = parts[1]
+    value = parts[2] if len(parts) > 2 else ''
+
+    return level, xref, tag, value
+
+
+def birth_year_from_date(date):
+    '''Find the birth year (a four digit number) in a Gedcom date string, as format is inconsistent.'''
+    match = re.search(r'\d{4}', date)
+    if match:
+        return match.group()
+    return 'NA'
+
+
+def parse_records(lines, fields=GENEALOGY_FIELDS):
+    '''
+    Collect the fields of INDI records, and the HUSB/WIFE links of FAM records, from Gedcom lines.
+
+    If a tag occurs multiple times in a record, the last occurrence is used, except for FAMC,
+    HUSB and WIFE, where the first occurrence is used. For fields of events (e.g. BIRT DATE),
+    only the last occurrence of the event is used. Fields that are not found in a record get the
+    default value in `INDI_FIELDS`, except fields of an event that is found, which are None.
+
+    NOTE: some individuals are "unknown" in AEBS and usually have no "BIRT" record. Such
+    individuals will always have parental records "0". Therefore, when reconstructing a
+    genealogy in "scripts/lineage.py", any lineage will stop at such an "unknown" individual.
+
+    Input:
+        lines:      Iterable of strings, lines of a Gedcom file.
+        fields:     Tuple of strings, names of fields to collect, see `INDI_FIELDS` [`GENEALOGY_FIELDS`].
+
+    Returns:
+    Tuple of two lists:
+        indis:      (ind, famc, *fields) of each INDI record.
+        fams:       (fam, husb, wife) of each FAM record.
+    '''
+
+    # Positions of the fields in the INDI tuples, by level 1 tag, and by event and level 2 tag.
+    tags = dict()
+    events = dict()
+    for i, field in enumerate(fields, 2):
+        tag, sub_tag, _ = INDI_FIELDS[field]
+        if sub_tag is None:
+            tags[tag] = i
+        else:
+            events.setdefault(tag, dict())[sub_tag] = i
+    defaults = [None, None] + [INDI_FIELDS[field][2] for field in fields]
+
+    indis = list()
+    fams = list()
+
+    # Fields of the current record. `rec` is the type of the current level 0 record, and
+    # `event` maps the level 2 tags of the current level 1 event to positions in `values`.
+    rec = None
+    event = None
+    # Position of the field that CONC/CONT lines are added to.
+    cont = None
+
+    for line in lines:
+        line = line.strip()
+        parsed = parse_line(line)
+        if parsed is None:
+            continue
+        level, xref, tag, value = parsed
+
+        if level == 0:
+            # Finish previous record.
+            if rec == 'INDI':
+                indis.append(tuple(values))
+            elif rec == 'FAM':
+                fams.append((fam, husb, wife))
+
+            rec = tag if xref is not None else None
+            event = None
+            cont = None
+            if rec == 'INDI':
+                values = list(defaults)
+                values[0] = int(format_rin(xref))
+            elif rec == 'FAM':
+                fam = xref
+                husb = None
+                wife = None
+            continue
+
+        if tag in ('CONC', 'CONT'):
+            # Continuation of the value of the previous line.
+            if cont is not None:
+                values[cont] += ('' if tag == 'CONC' else '\n') + value
+            continue
+        cont = None
+
+        if rec == 'INDI':
+            if level == 1:
+                event = events.get(tag)
+                if tag in tags:
+                    cont = tags[tag]
+                    values[cont] = value
+                elif tag == 'FAMC' and values[1] is None:
+                    values[1] = value
+                elif event is not None:
+                    # Only the last occurrence of an event is used.
+                    for i in event.values():
+                        values[i] = None
+            elif level == 2 and event is not None and tag in event:
+                cont = event[tag]
+                values[cont] = value
+        elif rec == 'FAM' and level == 1:
+            if tag == 'HUSB' and husb is None:
+                husb = value
+            elif tag == 'WIFE' and wife is None:
+                wife = value
+
+    # Finish last record.
+    if rec == 'INDI':
+        indis.append(tuple(values))
+    elif rec == 'FAM':
+        fams.append((fam, husb, wife))
+
+    return indis, fams
+
+
+def resolve_parents(indis, fams, fields=GENEALOGY_FIELDS):
+    '''
+    Join the tables produced by `parse_records` into a genealogy dataframe.
+
+    `fields` are the fields collected by `parse_records`, which must include `GENEALOGY_FIELDS`.
+
+    The family of an individual is the first family it is a child in (FAMC), and the parents
+    are the HUSB and WIFE of that family. If a parent does not exist, it is set to 0.
+
+    Returns:
+    Dataframe with the columns of the output CSV, individuals in the order of the Gedcom file.
+    '''
+
+    if len(indis) == 0:
+        return pd.DataFrame(columns=CSV_COLUMNS)
+    columns = dict(zip(('ind', 'famc') + tuple(fields), zip(*indis)))
+    ind = columns['ind']
+    famc = columns['famc']
+    sex = columns['sex']
+    birth_date = columns['birth_date']
+    birth_place = columns['birth_place']
+
+    # Join individuals with their families.
+    fams = pd.DataFrame(data=fams, columns=('fam', 'husb', 'wife'))
+    fams = fams.drop_duplicates('fam').set_index('fam')
+    parents = fams.reindex(famc)
+
+    def parent_rin(refs):
+        '''Convert parent cross-reference IDs to RIN, setting missing parents to 0.'''
+        return [int(format_rin(ref)) if isinstance(ref, str) else 0 for ref in refs]
+
+    # Get birth year of individuals.
+    birth_year = [birth_year_from_date(date) if date is not None else 'NA' for date in birth_date]
+
+    gen = pd.DataFrame({'ind': ind,
+        'father': parent_rin(parents.husb.values),
+        'mother': parent_rin(parents.wife.values),
+        'sex': sex,
+        'birth_year': birth_year,
+        'birth_place': birth_place},
+        columns=CSV_COLUMNS)
+
+    return gen
+
+
+def field_table(indis, fields, names):
+    '''
+    Get some of the fields collected by `parse_records` as a dataframe.
+
+    Input:
+        indis:      List of tuples, INDI records produced by `parse_records`.
+        fields:     Tuple of strings, the fields collected by `parse_records`.
+        names:      Tuple of strings, the fields to get.
+
+    Returns:
+    Dataframe with the column ind, and a column for each field in `names`.
+    '''
+    columns = ('ind',) + tuple(names)
+    if len(indis) == 0:
+        return pd.DataFrame(columns=columns)
+
+    positions = [0] + [2 + fields.index(name) for name in names]
+    values = list(zip(*indis))
+
+    return pd.DataFrame({column: values[i] for column, i in zip(columns, positions)}, columns=columns)
+
+
+def output_fields(refn_path=None, fields_path=None, fields=()):
+    '''Get the fields `parse_records` has to collect to write the outputs of `ged2csv`.'''
+    extra = ('refn',) if refn_path is not None else ()
+    if fields_path is not None:
+        extra += tuple(fields)
+
+    return GENEALOGY_FIELDS + tuple(field for i, field in enumerate(extra)
+            if field not in GENEALOGY_FIELDS and field not in extra[:i])
+
+
+def write_outputs(indis, fams, fields, csv_path, refn_path=None, fields_path=None, extra_fields=()):
+    '''
+    Write the CSV files of `ged2csv` from the tables produced by `parse_records`.
+
+    Input:
+        indis:          List of tuples, INDI records produced by `parse_records`.
+        fams:           List of tuples, FAM records produced by `parse_records`.
+        fields:         Tuple of strings, the fields collected by `parse_records`.
+        csv_path:       String, path to genealogy CSV file.
+        refn_path:      String, path to CSV file with the columns RIN and REFN [None].
+        fields_path:    String, path to CSV file with the column ind and `extra_fields` [None].
+        extra_fields:   Tuple of strings, fields to write to `fields_path` [()].
+    '''
+    with profiler.stage('resolve_parents'):
+        gen = resolve_parents(indis, fams, fields)
+        profiler.count('individuals', len(gen))
+
+    with profiler.stage('write'):
+        gen.to_csv(csv_path, index=None)
+
+        if refn_path is not None:
+            refn = field_table(indis, fields, ('refn',))
+            refn.columns = ('RIN', 'REFN')
+            refn.to_csv(refn_path, index=None)
+
+        if fields_path is not None:
+            field_table(indis, fields, tuple(extra_fields)).to_csv(fields_path, index=None)
+
+
+def chunk_ranges(ged_path, n_chunks):
+    '''
+    Split a Gedcom file into byte ranges at level 0 record boundaries.
+
+    The file is split into `n_chunks` ranges of roughly equal size, and each boundary is
+    moved forward to the start of the next line starting with "0 " (e.g. "0 @I1@ INDI"), so
+    that no record is split between two ranges. As continuation lines in a Legacy export
+    never start with a digit, this also works for files that have not been cleaned up.
+
+    Returns:
+    List of (start, end) tuples, byte offsets of each range.
+    '''
+    size = os.path.getsize(ged_path)
+
+    boundaries = [0]
+    with open(ged_path, 'rb') as fid:
+        for k in range(1, n_chunks):
+            # Go to the first line starting after the approximate boundary.
+            fid.seek(max(size * k // n_chunks, boundaries[-1]))
+            fid.readline()
+
+            # Find the next level 0 line.
+            boundary = size
+            while True:
+                start = fid.tell()
+                line = fid.readline()
+                if not line:
+                    break
+                if line.startswith(b'0 '):
+                    boundary = start
+                    break
+            boundaries.append(boundary)
+    boundaries.append(size)
+
+    return [(start, end) for start, end in zip(boundaries[:-1], boundaries[1:]) if end > start]
+
+
+def _parse_chunk(args):
+    '''Parse the records in a byte range of a Gedcom file (see `chunk_ranges`), in a worker process.'''
+    ged_path, start, end, raw, fields = args
+
+    with open(ged_path, 'rb') as fid:
+        fid.seek(start)
+        data = fid.read(end - start)
+
+    # Only the first chunk can start with a byte order mark.
+    lines = data.decode('utf-8-sig' if start == 0 else 'utf-8').split('\n')
+    if raw:
+        lines = clean_lines(lines)
+
+    return parse_records(lines, fields)
+
+
+def parse_records_parallel(ged_path, workers, raw=False, fields=GENEALOGY_FIELDS):
+    '''
+    Collect the relevant fields of INDI and FAM records from a Gedcom file, using multiple processes.
+
+    The file is split into chunks at level 0 record boundaries (see `chunk_ranges`), the chunks
+    are parsed in a process pool, and the resulting tables are concatenated in the order of the
+    chunks. Therefore, the result is identical to parsing the whole file with `parse_records`.
+
+    Input:
+        ged_path:   String, path to Gedcom file.
+        workers:    Integer, number of processes.
+        raw:        Boolean, clean up the lines of the file (see `remove_unwanted_newlines.py`) [False].
+        fields:     Tuple of strings, names of fields to collect, see `parse_records` [`GENEALOGY_FIELDS`].
+
+    Returns:
+    Tuple of two lists, see `parse_records`.
+    '''
+    ranges = chunk_ranges(ged_path, workers * CHUNKS_PER_WORKER)
+
+    indis = list()
+    fams = list()
+    with Pool(workers) as pool:
+        tasks = [(ged_path, start, end, raw, fields) for start, end in ranges]
+        for chunk_indis, chunk_fams in pool.imap(_parse_chunk, tasks):
+            indis.extend(chunk_indis)
+            fams.extend(chunk_fams)
+
+    return indis, fams
+
+
+def ged2csv(ged_path, csv_path, raw=False, cleaned_path=None, workers=1, refn_path=None,
+        fields_path=None, fields=()):
+    '''
+    Read the Gedcom file `ged_path` and write the genealogy to the CSV file `csv_path`.
+
+    Other fields of the individuals can be written to other CSV files in the same pass over the
+    Gedcom file: RIN and REFN to `refn_path`, and RIN and the fields in `fields` (see
+    `INDI_FIELDS`) to `fields_path`, if these are not None.
+
+    If `raw` is True, the Gedcom file is a Legacy export, which is cleaned up while it is read
+    (see `remove_unwanted_newlines.py`), and the cleaned lines are also written to
+    `cleaned_path`, if it is not None.
+
+    If `workers` is larger than 1, the file is parsed in that many processes (see
+    `parse_records_parallel`). A cleaned Gedcom file cannot be written in this case.
+
+    When profiling is enabled (see `profiling.py`), the stages parse (including the clean-up of
+    the lines, which is done while they are parsed), resolve_parents and write are recorded.
+    '''
+    assert workers == 1 or cleaned_path is None, 'A cleaned GED file can only be written with one worker.'
+
+    all_fields = output_fields(refn_path, fields_path, fields)
+
+    with profiler.stage('ged2csv'):
+        with profiler.stage('parse'):
+            if workers > 1:
+                indis, fams = parse_records_parallel(ged_path, workers, raw=raw, fields=all_fields)
+            elif not raw:
+                with open(ged_path, encoding='utf-8-sig') as fid:
+                    indis, fams = parse_records(fid, all_fields)
+            else:
+                with open_ged(ged_path) as fid:
+                    lines = clean_lines(fid)
+                    if cleaned_path is None:
+                        indis, fams = parse_records(lines, all_fields)
+                    else:
+                        with open(cleaned_path, 'w', encoding='utf-8', buffering=BUFFER_SIZE) as out:
+                            indis, fams = parse_records(write_lines(lines, out), all_fields)
+            profiler.count('indi_records', len(indis))
+            profiler.count('fam_records', len(fams))
+
+        write_outputs(indis, fams, all_fields, csv_path, refn_path, fields_path, fields)
+
+
+def fingerprint_path(csv_path):
+    '''Path of the record fingerprints of a CSV file written by `ged2csv_incremental`.'''
+    return csv_path + '.fingerprints.json'
+
+
+def record_blocks(data):
+    '''
+    Split the contents of a Gedcom file into its INDI and FAM records.
+
+    A record starts at a line starting with "0 " and ends where the next one starts. As
+    continuation lines in a Legacy export never start with a digit, this also works for files
+    that have not been cleaned up.
+
+    Input:
+        data:       Bytes, contents of a Gedcom file.
+
+    Returns:
+    Generator of tuples (tag, block), where tag is 'INDI' or 'FAM', and block is the bytes of
+    the record, in the order of the file.
+    '''
+    starts = [0] + [match.start() + 1 for match in re.finditer(b'\n0 ', data)]
+    ends = starts[1:] + [len(data)]
+    for start, end in zip(starts, ends):
+        block = data[start:end]
+        first = block.split(b'\n', 1)[0].strip().split(b' ', 3)
+        if len(first) >= 3 and first[0] == b'0' and first[1].startswith(b'@') and first[2] in (b'INDI', b'FAM'):
+            yield first[2].decode(), block
+
+
+def _read_fingerprints(csv_path, raw, fields):
+    '''Read the record fingerprints of a CSV file, if they exist and match the `raw` mode and `fields`.'''
+    path = fingerprint_path(csv_path)
+    if not os.path.isfile(path):
+        return dict(), dict()
+
+    with open(path) as fid:
+        fingerprints = json.load(fid)
+    if fingerprints.get('version') != FINGERPRINT_VERSION or fingerprints.get('raw') != raw \
+            or fingerprints.get('fields') != list(fields):
+        return dict(), dict()
+
+    indis = {digest: tuple(fields) for digest, fields in fingerprints['indi'].items()}
+    fams = {digest: tuple(fields) for digest, fields in fingerprints['fam'].items()}
+    return indis, fams
+
+
+def _write_fingerprints(csv_path, raw, fields, indis, fams):
+    '''Write the record fingerprints of a CSV file, replacing the old ones in one step.'''
+    path = fingerprint_path(csv_path)
+    tmp = '%s.tmp%d' % (path, os.getpid())
+    with open(tmp, 'w') as fid:
+        # Encoding the whole string at once is much faster than `json.dump`.
+        fid.write(json.dumps({'version': FINGERPRINT_VERSION, 'raw': raw, 'fields': list(fields),
+            'indi': indis, 'fam': fams}))
+    os.replace(tmp, path)
+
+
+def changelog(old, new):
+    '''
+    Compare two versions of a genealogy CSV.
+
+    Input:
+        old:        Dataframe, old version of the CSV, read with all columns as strings.
+        new:        Dataframe, new version of the CSV, read with all columns as strings.
+
+    Returns:
+    Dataframe with the columns ind and change, where change is "added", "removed" or "modified"
+    (any field in the record has changed), sorted by RIN.
+    '''
+    old = old.drop_duplicates('ind').set_index('ind')
+    new = new.drop_duplicates('ind').set_index('ind')
+
+    added = new.index.difference(old.index)
+    removed = old.index.difference(new.index)
+    both = new.index.intersection(old.index)
+    changed = (old.loc[both, list(new.columns)] != new.loc[both]).any(axis=1)
+    modified = both[changed.values]
+
+    log = pd.DataFrame({'ind': list(added) + list(removed) + list(modified),
+        'change': ['added'] * len(added) + ['removed'] * len(removed) + ['modified'] * len(modified)},
+        columns=('ind', 'change'))
+    log['ind'] = log.ind.astype(int)
+
+    return log.sort_values('ind', kind='stable').reset_index(drop=True)
+
+
+def ged2csv_incremental(ged_path, csv_path, raw=False, changelog_path=None, refn_path=None,
+        fields_path=None, fields=()):
+    '''
+    Update the CSV file `csv_path` from a new version of the Gedcom file `ged_path`, parsing only
+    the records that have changed.
+
+    The INDI and FAM records of the Gedcom file are fingerprinted with a hash of their contents,
+    and the parsed fields of each record are stored with its fingerprint next to the CSV (see
+    `fingerprint_path`). On the next update, records with a known fingerprint are not parsed
+    again, and only new or changed records are parsed. The parents are then resolved for all
+    individuals (see `resolve_parents`), which is fast compared to parsing, so the CSV is
+    identical to the one written by `ged2csv`. If there are no fingerprints (e.g. on the first
+    update, or if other fields are written), all records are parsed. Other fields are written
+    to `refn_path` and `fields_path` as by `ged2csv`.
+
+    If the CSV has a binary cache (see `lineages.csv2dict`), the cache is rebuilt. If
+    `changelog_path` is not None, the RINs of the individuals that have been added, removed or
+    modified since the previous version of the CSV are written to it (see `changelog`).
+
+    When profiling is enabled (see `profiling.py`), each of these steps is recorded as a stage.
+
+    Input:
+        ged_path:       String, path to Gedcom file.
+        csv_path:       String, path to CSV file to update.
+        raw:            Boolean, clean up the lines of the file (see `remove_unwanted_newlines.py`) [False].
+        changelog_path: String, path to write changelog CSV to [None].
+        refn_path:      String, path to write RIN and REFN CSV to [None].
+        fields_path:    String, path to write CSV with RIN and `fields` to [None].
+        fields:         Tuple of strings, fields to write to `fields_path` [()].
+
+    Returns:
+    Dataframe, the changelog.
+    '''
+    all_fields = output_fields(refn_path, fields_path, fields)
+
+    with profiler.stage('ged2csv_incremental'):
+        with profiler.stage('fingerprint'):
+            known_indis, known_fams = _read_fingerprints(csv_path, raw, all_fields)
+
+            with open(ged_path, 'rb') as fid:
+                data = fid.read()
+            if data.startswith(b'\xef\xbb\xbf'):
+                data = data[3:]
+
+            # Fingerprint the records, and collect the ones that have to be parsed.
+            # Identical records are parsed once, as their fields are looked up by fingerprint below.
+            records = list()
+            changed = list()
+            queued = set()
+            for tag, block in record_blocks(data):
+                digest = hashlib.sha1(block).hexdigest()
+                records.append((tag, digest))
+                if digest not in (known_indis if tag == 'INDI' else known_fams) and digest not in queued:
+                    queued.add(digest)
+                    changed.append(block)
+            profiler.count('records', len(records))
+            profiler.count('changed_records', len(changed))
+
+        with profiler.stage('parse'):
+            lines = b''.join(changed).decode('utf-8').split('\n')
+            if raw:
+                lines = clean_lines(lines)
+            new_indis, new_fams = parse_records(lines, all_fields)
+            profiler.count('indi_records', len(new_indis))
+            profiler.count('fam_records', len(new_fams))
+
+            # Assemble the tables in the order of the file. Changed records were parsed in this order.
+            new_indis = iter(new_indis)
+            new_fams = iter(new_fams)
+            indi_fields = dict()
+            fam_fields = dict()
+            indis = list()
+            fams = list()
+            for tag, digest in records:
+                if tag == 'INDI':
+                    if digest not in indi_fields:
+                        indi_fields[digest] = known_indis[digest] if digest in known_indis else next(new_indis)
+                    indis.append(indi_fields[digest])
+                else:
+                    if digest not in fam_fields:
+                        fam_fields[digest] = known_fams[digest] if digest in known_fams else next(new_fams)
+                    fams.append(fam_fields[digest])
+
+        # Read previous version of the CSV for the changelog.
+        with profiler.stage('read_previous'):
+            if os.path.isfile(csv_path):
+                old = pd.read_csv(csv_path, dtype=str, keep_default_na=False)
+            else:
+                old = pd.DataFrame(columns=CSV_COLUMNS, dtype=str)
+
+        write_outputs(indis, fams, all_fields, csv_path, refn_path, fields_path, fields)
+        with profiler.stage('write_fingerprints'):
+            _write_fingerprints(csv_path, raw, all_fields, indi_fields, fam_fields)
+
+        # Rebuild binary cache, if there is one.
+        if os.path.isdir(cache_path(csv_path)):
+            csv2dict(csv_path, cache=True)
+
+        with profiler.stage('changelog'):
+            new = pd.read_csv(csv_path, dtype=str, keep_default_na=False)
+            log = changelog(old, new)
+            profiler.count('changes', len(log))
+            if changelog_path is not None:
+                log.to_csv(changelog_path, index=None)
+
+    return log
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+
+    # Arguments for parser.
+    parser.add_argument('ged', type=str, help='Path to input GED file.')
+    parser.add_argument('csv', type=str, help='Path to output CSV file.')
+    parser.add_argument('--raw-legacy-export', action='store_true', help='Clean up the GED file while reading it.')
+    parser.add_argument('--cleaned-ged', type=str, help='Path to write cleaned GED file to.')
+    parser.add_argument('--workers', type=int, default=1, help='Number of processes to parse the GED file with.')
+    parser.add_argument('--incremental', action='store_true', help='Only parse records that changed since the last update.')
+    parser.add_argument('--changelog', type=str, help='Path to write changelog CSV to (with --incremental).')
+    parser.add_argument('--refn-csv', type=str, help='Path to write RIN and REFN CSV to.')
+    parser.add_argument('--fields-csv', type=str, help='Path to write CSV with RIN and other fields to.')
+    parser.add_argument('--fields', type=str, help='Comma separated fields to write to --fields-csv, e.g. "name,death_date".')
+    parser.add_argument('--profile', action='store_true', help='Report time and memory of each stage.')
+    parser.add_argument('--profile-json', type=str, help='Path to write time and memory of each stage to, as JSON.')
+
+    # Parse input arguments.
+    args = parser.parse_args()
+
+    if args.profile_json is not None:
+        profiler.configure(args.profile_json)
+    elif args.profile:
+        profiler.configure('1')
+
+    assert args.cleaned_ged is None or args.raw_legacy_export, '--cleaned-ged requires --raw-legacy-export.'
+
+    assert args.changelog is None or args.incremental, '--changelog requires --incremental.'
+    assert (args.fields_csv is None) == (args.fields is None), '--fields-csv and --fields must be used together.'
+
+    fields = tuple(args.fields.split(',')) if args.fields is not None else ()
+    for field in fields:
+        assert field in INDI_FIELDS, 'Unknown field "%s", choose from: %s.' % (field, ', '.join(INDI_FIELDS))
+
+    if args.incremental:
+        assert args.cleaned_ged is None and args.workers == 1, \
+                '--incremental cannot be used with --cleaned-ged or --workers.'
+        ged2csv_incremental(args.ged, args.csv, raw=args.raw_legacy_export, changelog_path=args.changelog,
+                refn_path=args.refn_csv, fields_path=args.fields_csv, fields=fields)
+    else:
+        ged2csv(args.ged, args.csv, raw=args.raw_legacy_export, cleaned_path=args.cleaned_ged,
+                workers=args.workers, refn_path=args.refn_csv, fields_path=args.fields_csv,
+                fields=fields)
 
+    profiler.finish()
@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+'''
+Gene dropping: Monte Carlo simulation of the transmission of an allele through a genealogy,
+typically one reconstructed by the `Gen` class in `lineages.py`. This script can also be executed
+directly, to reconstruct the genealogy of specified individuals and estimate the probability that
+each of them carries an allele introduced by one or more carriers, e.g. a founder mutation.
+
+Usage:
+    python genedrop.py --csv [CSV] --ind [individuals] --carriers [RIN] --out [output]
+    python genedrop.py --csv [CSV] --ind [individuals] --carriers [RIN] [RIN] --out [output] --replicates 100000 --processes 4 --seed 1
+
+Input:
+    CSV:              Input CSV file with genealogy.
+    Individuals:      Text file with RIN of individuals.
+    RIN:              RIN of the individuals that carry one copy of the allele.
+    Output:           Filename to write resulting CSV to.
+
+Output:
+    CSV with the columns ind, carrier and homozygous, with one row for each individual: the
+    fraction of the replicates in which the individual carries at least one copy of the allele,
+    and two copies, respectively.
+'''
+
+from lineages import Gen, read_individuals
+from utils import parent_arrays, topological_order
+from kinship import ancestor_mask
+from multiprocessing import Pool
+import pandas as pd
+import numpy as np
+import argparse
+
+# Number of replicates stored in each word of the allele arrays.
+WORD_BITS = 64
+
+# Number of bits set in each byte.
+_POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.int64)
+
+
+def _popcount(words):
+    '''Number of bits set in each row of a two-dimensional array of unsigned 64-bit integers.'''
+    return _POPCOUNT[words.view(np.uint8)].sum(axis=1)
+
+
+def _replicate_mask(replicates):
+    '''Array of words with the bits of the first `replicates` replicates set.'''
+    words = (replicates + WORD_BITS - 1) // WORD_BITS
+    mask = np.full(words, np.iinfo(np.uint64).max, dtype=np.uint64)
+    if replicates % WORD_BITS:
+        mask[-1] = np.uint64((1 << (replicates % WORD_BITS)) - 1)
+    return mask
+
+
+def drop_block(fa, mo, levels, carriers, rows, replicates, seed):
+    '''
+    Drop an allele through a genealogy in a block of replicates, and count how often the
+    individuals in `rows` carry it.
+
+    All replicates are simulated at once: the paternal and maternal allele of each individual are
+    arrays of bits, one bit per replicate, packed in 64-bit words. The individuals are processed
+    one generation at a time, starting with the founders, so that the alleles of the parents are
+    known. The allele an individual gets from a parent is, in each replicate, the paternal or the
+    maternal allele of the parent, chosen by a random bit, which for a whole generation is a few
+    bitwise operations on arrays. Carriers have one copy of the allele (the paternal allele) in
+    every replicate, regardless of their parents. Unknown parents do not carry the allele.
+
+    Input:
+        fa:         Array of integer, rows of fathers (-1 if none).
+        mo:         Array of integer, rows of mothers (-1 if none).
+        levels:     List of arrays of integer, rows in each generation, founders first (see
+                    `utils.topological_order`).
+        carriers:   Array of integer, rows of carriers.
+        rows:       Array of integer, rows of individuals to count.
+        replicates: Integer, number of replicates.
+        seed:       `np.random.SeedSequence` or integer, seed of the random bits.
+
+    Returns:
+    Tuple (carrier, homozygous) of arrays of integer, number of replicates in which each
+    individual in `rows` carries at least one copy and two copies of the allele.
+    '''
+    n = len(fa)
+    mask = _replicate_mask(replicates)
+    words = len(mask)
+    bits = np.random.PCG64(seed)
+
+    # Unknown parents are mapped to an extra row, which never carries the allele.
+    fa = np.where(fa >= 0, fa, n)
+    mo = np.where(mo >= 0, mo, n)
+    is_carrier = np.zeros(n, dtype=bool)
+    is_carrier[carriers] = True
+
+    pat = np.zeros((n + 1, words), dtype=np.uint64)
+    mat = np.zeros((n + 1, words), dtype=np.uint64)
+    for level in levels:
+        for alleles, parents in ((pat, fa[level]), (mat, mo[level])):
+            coin = bits.random_raw(len(level) * words).reshape(len(level), words)
+            alleles[level] = (coin & pat[parents]) | (~coin & mat[parents])
+        carrying = level[is_carrier[level]]
+        pat[carrying] = mask
+        mat[carrying] = 0
+
+    carrier = _popcount((pat[rows] | mat[rows]) & mask)
+    homozygous = _popcount(pat[rows] & mat[rows] & mask)
+
+    return carrier, homozygous
+
+
+def _drop_task(args):
+    '''Simulate a block of replicates in a worker process.'''
+    return drop_block(*args)
+
+
+def gene_drop(gen, carriers, inds=None, replicates=10000, block_size=4096, processes=1, seed=None):
+    '''
+    Estimate the probability that individuals carry an allele introduced by carriers, by gene
+    dropping (see `drop_block`).
+
+    Only the individuals and their ancestors are simulated. The replicates are simulated in
+    blocks of `block_size`, which limits the memory used to about `block_size / 4` bytes per
+    ancestor, and the blocks can be simulated in parallel. Each block has its own stream of
+    random numbers, derived from `seed`, so that the results only depend on `seed` and
+    `block_size`, and not on the number of processes.
+
+    Example:
+        gen = Gen('path/to/genealogy.csv', [1, 2, 3])
+        probs = gene_drop(gen, [4], replicates=100000, processes=4, seed=1)
+
+    Input:
+        gen:        `Gen`, `GenStore` or dictionary, genealogy object.
+        carriers:   List of integer, IDs of individuals with one copy of the allele.
+        inds:       List of integer, IDs of individuals [`gen.probands`].
+        replicates: Integer, number of replicates [10000].
+        block_size: Integer, number of replicates per block, rounded up to a multiple of 64 [4096].
+        processes:  Integer, number of processes to simulate blocks in [1].
+        seed:       Integer, seed of the random numbers [None, unpredictable].
+
+    Returns:
+    Dataframe with the columns ind, carrier and homozygous, the fraction of replicates in which
+    each individual carries at least one copy and two copies of the allele, in the order of `inds`.
+    '''
+    assert replicates > 0, 'Number of replicates must be positive.'
+
+    if inds is None:
+        inds = gen.probands
+
+    ids, fa, mo = parent_arrays(gen)
+
+    # Rows of the individuals and the carriers.
+    pos = {ind: row for row, ind in enumerate(ids.tolist())}
+    for ind in list(inds) + list(carriers):
+        assert ind in pos, 'Individual %d does not exist in genealogy.' % ind
+    rows = np.array([pos[ind] for ind in inds], dtype=np.int64)
+    carrier_rows = np.array([pos[ind] for ind in carriers], dtype=np.int64)
+
+    # Only the individuals and their ancestors are needed. Map them to local rows.
+    u = np.flatnonzero(ancestor_mask(rows, fa, mo))
+    local = np.full(len(fa) + 1, -1, dtype=np.int64)
+    local[u] = np.arange(len(u))
+    lfa = local[fa[u]]
+    lmo = local[mo[u]]
+    order, generation = topological_order(lfa, lmo)
+    levels = np.split(order, np.flatnonzero(np.diff(generation[order])) + 1)
+    lcarriers = local[carrier_rows]
+    lcarriers = lcarriers[lcarriers >= 0]
+
+    block_size = max(WORD_BITS, -(-block_size // WORD_BITS) * WORD_BITS)
+    sizes = [min(block_size, replicates - start) for start in range(0, replicates, block_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+
+    tasks = [(lfa, lmo, levels, lcarriers, local[rows], size, block_seed) for size, block_seed in zip(sizes, seeds)]
+    if processes > 1:
+        with Pool(processes) as pool:
+            results = pool.map(_drop_task, tasks)
+    else:
+        results = [_drop_task(task) for task in tasks]
+
+    carrier = np.zeros(len(rows), dtype=np.int64)
+    homozygous = np.zeros(len(rows), dtype=np.int64)
+    for block_carrier, block_homozygous in results:
+        carrier += block_carrier
+        homozygous += block_homozygous
+
+    return pd.DataFrame({'ind': np.asarray(inds, dtype=np.int64), 'carrier': carrier / replicates,
+        'homozygous': homozygous / replicates}, columns=['ind', 'carrier', 'homozygous'])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+
+    # Arguments for parser.
+    parser.add_argument('--csv', type=str, required=True)
+    parser.add_argument('--ind', type=str, required=True)
+    parser.add_argument('--carriers', type=int, nargs='+', required=True, help='RIN of individuals with one copy of the allele.')
+    parser.add_argument('--out', type=str, required=True)
+    parser.add_argument('--replicates', type=int, default=10000, help='Number of replicates.')
+    parser.add_argument('--block_size', type=int, default=4096, help='Number of replicates per block.')
+    parser.add_argument('--processes', type=int, default=1, help='Number of processes to simulate blocks in.')
+    parser.add_argument('--seed', type=int, help='Seed of the random numbers.')
+    parser.add_argument('--by_thres', type=int)
+    parser.add_argument('--d_thres', type=int)
+
+    # Parse input arguments.
+    args = parser.parse_args()
+
+    assert args.replicates > 0, '--replicates must be positive.'
+
+    ind = read_individuals(args.ind)
+
+    # Construct a genealogy of the individuals from CSV file.
+    gen = Gen(args.csv, ind, depth=args.d_thres, by=args.by_thres, batch=True)
+
+    probs = gene_drop(gen, args.carriers, ind, replicates=args.replicates, block_size=args.block_size,
+            processes=args.processes, seed=args.seed)
+
+    probs.to_csv(args.out, index=None)
@@ -2,52 +2,33 @@
 '''
 Reads records from a Gedcom file ([filename].ged) and writes two fields to CSV: RIN and REFN.
 
+The records are read with the same parser as `ged2csv.py`. When the genealogy CSV is also
+needed, use `ged2csv.py --refn-csv [CSV filename]` instead, which writes both CSV files from
+a single pass over the Gedcom file.
+
 Usage:
-    ged2csv.py [GED filename] [CSV filename]
+    get_refn.py [GED filename] [CSV filename]
 
 Arguments:
     GED filename:       Path to a Gedcom file.
     CSV filename:       Path to output CSV file.
 '''
 
-from ged4py import GedcomReader
-import pandas as pd
-import sys, re, warnings
+from ged2csv import parse_records, field_table
+import sys
 
-assert len(sys.argv) > 2, 'To few arguments to "ged2csv.py", see documentation for details.'
+assert len(sys.argv) > 2, 'To few arguments to "get_refn.py", see documentation for details.'
 
 ged_path = sys.argv[1]  # Path to input GED file.
 csv_path = sys.argv[2]  # Path to output CSV file.
 
-# List to store relevant fields of all records in.
-gen = list()
-
-count_none_rin = 0
-
-def format_rin(rin):
-    '''Extract RIN, as Gedcom represents RIN as e.g. @I1@.'''
-    return rin[2:-1]
-
-# Initialize GED parser.
-with GedcomReader(ged_path, encoding='utf-8') as parser:
-    # iterate over all INDI records
-    for i, record in enumerate(parser.records0('INDI')):
-        # Get individual RIN ID.
-        ind_ref = int(format_rin(record.xref_id))
+fields = ('refn',)
 
-        # Get the records of the individual.
-        ind_records = {r.tag: r for r in record.sub_records}
+# Collect REFN of all INDI records.
+with open(ged_path, encoding='utf-8-sig') as fid:
+    indis, _ = parse_records(fid, fields)
 
-        # Get the record with tag "REFN".
-        refn = ind_records.get('REFN')
-        if refn is not None:
-            refn = refn.value
-
-        # Add record to list.
-        gen.append((ind_ref, refn))
-
-# Convert list of records to dataframe and write to CSV.
-gen = pd.DataFrame(data=gen, columns=('RIN', 'REFN'))
+# Write RIN and REFN to CSV.
+gen = field_table(indis, fields, fields)
+gen.columns = ('RIN', 'REFN')
 gen.to_csv(csv_path, index=None)
-
-
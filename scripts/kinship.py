@@ -0,0 +1,407 @@
+#!/usr/bin/env python
+'''
+Kinship coefficients between individuals in a genealogy, typically one reconstructed by the
+`Gen` class in `lineages.py`. This script can also be executed directly, to reconstruct the
+genealogy of specified individuals and compute the kinship coefficients between them.
+
+Usage:
+    python kinship.py --csv [CSV] --ind [individuals] --out [output]
+    python kinship.py --csv [CSV] --inbreeding --out [output]
+
+Input:
+    CSV:              Input CSV file with genealogy.
+    Individuals:      Text file with RIN of individuals.
+    Output:           Filename to write resulting CSV to.
+
+Output:
+    CSV with the columns ind1, ind2 and kinship, with one row for each pair of individuals
+    (including each individual with itself) with non-zero kinship coefficient.
+
+    With --inbreeding, the input CSV with an extra column, inbreeding, containing the inbreeding
+    coefficient of every individual in the CSV.
+'''
+
+from lineages import Gen, csv2dict
+from utils import parent_arrays, topological_order
+from multiprocessing import Pool
+import pandas as pd
+import numpy as np
+import argparse
+
+
+def ancestor_mask(rows, fa, mo):
+    '''Boolean mask of the individuals in `rows` and all their ancestors.'''
+    mask = np.zeros(len(fa), dtype=bool)
+    frontier = np.unique(rows)
+    while len(frontier) > 0:
+        mask[frontier] = True
+        parents = np.concatenate((fa[frontier], mo[frontier]))
+        parents = parents[parents >= 0]
+        frontier = np.unique(parents[~mask[parents]])
+    return mask
+
+
+def _sum_by_parent(parents, values):
+    '''Sum the rows of `values` with the same parent. Returns the unique parents and the sums.'''
+    keep = parents >= 0
+    parents = parents[keep]
+    values = values[keep]
+    order = np.argsort(parents, kind='stable')
+    parents, starts = np.unique(parents[order], return_index=True)
+    return parents, np.add.reduceat(values[order], starts, axis=0) if len(parents) > 0 else values[:0]
+
+
+def mendelian_variance(fa, mo, F):
+    '''
+    Variance of the Mendelian sampling term of each individual (in units of additive relationship),
+    given the inbreeding coefficients `F`. This is 1 for founders, 0.75 - F/4 for individuals
+    with one known parent, and 0.5 - (F_fa + F_mo)/4 for individuals with two known parents.
+    '''
+    d = np.ones(len(fa))
+    for p in (fa, mo):
+        known = p >= 0
+        d[known] -= 0.25 * (1.0 + F[p[known]])
+    return d
+
+
+def _couple_inbreeding(cf, cm, fa, mo, generation, F, d):
+    '''
+    Inbreeding coefficients of the children of a batch of couples (see `inbreeding`).
+
+    The ancestors of all couples in the batch are handled together, as (couple, ancestor) pairs
+    encoded as `couple * n + row`. The fractions of genes passed to each pair are collected in
+    one bucket per generation, and the generations are processed from the youngest to the
+    oldest, so that all contributions to a pair have been collected when it is processed.
+    '''
+    n = len(fa)
+    k = len(cf)
+    couple = np.arange(k, dtype=np.int64)
+
+    # Buckets of (pair, fraction of genes) arrays, per generation.
+    buckets = dict()
+
+    def push(keys, values):
+        gens = generation[keys % n]
+        order = np.argsort(gens, kind='stable')
+        gens = gens[order]
+        bounds = np.flatnonzero(np.diff(gens)) + 1
+        for block in np.split(np.arange(len(order)), bounds):
+            g = gens[block[0]]
+            buckets.setdefault(g, list()).append((keys[order[block]], values[order[block]]))
+
+    push(np.concatenate((couple * n + cf, couple * n + cm)), np.full(2 * k, 0.5))
+
+    S = np.zeros(k)
+    while len(buckets) > 0:
+        # Youngest remaining generation.
+        g = max(buckets)
+        keys, values = zip(*buckets.pop(g))
+        keys, inverse = np.unique(np.concatenate(keys), return_inverse=True)
+        L = np.bincount(inverse.ravel(), weights=np.concatenate(values), minlength=len(keys))
+
+        c = keys // n
+        rows = keys % n
+        S += np.bincount(c, weights=L * L * d[rows], minlength=k)
+
+        # Pass half of the fraction to each parent.
+        for p in (fa[rows], mo[rows]):
+            known = p >= 0
+            if np.any(known):
+                push(c[known] * n + p[known], 0.5 * L[known])
+
+    # The Mendelian sampling variance of the child is 0.5 - (F_fa + F_mo) / 4.
+    d_child = 0.5 - 0.25 * (F[cf] + F[cm])
+    return d_child + S - 1.0
+
+
+def inbreeding(fa, mo, generation, batch_size=256):
+    '''
+    Compute the inbreeding coefficients of all individuals in a genealogy.
+
+    This uses the algorithm of Meuwissen and Luo (1992), which does not enumerate paths. The
+    inbreeding coefficient of an individual i is `F_i = sum_j L_ij^2 d_j - 1`, where the sum is
+    over i and its ancestors j, `L_ij` is the expected fraction of the genes of i coming from j,
+    and `d_j` is the Mendelian sampling variance of j (see `mendelian_variance`). `L_ij` is
+    obtained by passing the fractions of genes from each ancestor to its parents, one generation
+    at a time, starting with the youngest ancestors. The individuals are processed one
+    generation at a time, starting with the founders, so that `d_j` is known for all ancestors.
+    As the inbreeding coefficient only depends on the parents, it is computed once per couple,
+    and `batch_size` couples are processed together (see `_couple_inbreeding`).
+
+    Input:
+        fa:         Array of integer, rows of fathers (-1 if none).
+        mo:         Array of integer, rows of mothers (-1 if none).
+        generation: Array of integer, generation of each row (see `utils.topological_order`).
+        batch_size: Integer, number of couples processed together [256].
+
+    Returns:
+    Array of float, inbreeding coefficient of each row.
+    '''
+    n = len(fa)
+    F = np.zeros(n)
+    d = np.ones(n)
+
+    order = np.argsort(generation, kind='stable')
+    bounds = np.flatnonzero(np.diff(generation[order])) + 1
+    for level in np.split(order, bounds):
+        f = fa[level]
+        m = mo[level]
+
+        # Only individuals with two known parents can be inbred.
+        both = (f >= 0) & (m >= 0)
+        couples, inverse = np.unique(np.stack((f[both], m[both]), axis=1), axis=0, return_inverse=True)
+        F_couples = np.zeros(len(couples))
+        for start in range(0, len(couples), batch_size):
+            batch = couples[start:start + batch_size]
+            F_couples[start:start + batch_size] = _couple_inbreeding(batch[:, 0], batch[:, 1], fa,
+                    mo, generation, F, d)
+
+        F_level = np.zeros(len(level))
+        F_level[both] = F_couples[inverse.ravel()]
+        F[level] = F_level
+        d[level] = mendelian_variance(f, m, F)
+
+    return F
+
+
+def inbreeding_coefficients(gen, batch_size=256):
+    '''
+    Compute the inbreeding coefficients of all individuals in a genealogy, see `inbreeding`.
+
+    Parents that are not in the genealogy are treated as unknown.
+
+    Example:
+        inds, F = inbreeding_coefficients(csv2dict('path/to/genealogy.csv'))
+
+    Input:
+        gen:        `GenStore`, `Gen` or dictionary, genealogy object.
+        batch_size: Integer, number of couples processed together [256].
+
+    Returns:
+    Tuple (inds, F) of arrays, RIN of individuals and their inbreeding coefficients.
+    '''
+    inds, fa, mo = parent_arrays(gen)
+    _, generation = topological_order(fa, mo)
+
+    return inds, inbreeding(fa, mo, generation, batch_size)
+
+
+def write_inbreeding(csv, path, gen=None):
+    '''
+    Write a genealogy CSV file with an extra column, inbreeding, containing the inbreeding
+    coefficient of every individual.
+
+    Input:
+        csv:        String, path to genealogy CSV file, produced by `ged2csv.py`.
+        path:       String, path to output CSV file.
+        gen:        `GenStore`, genealogy read from `csv` [read with `csv2dict`].
+    '''
+    if gen is None:
+        gen = csv2dict(csv, cache=True)
+
+    inds, F = inbreeding_coefficients(gen)
+
+    # Read all columns as strings, so that they are written unchanged.
+    df = pd.read_csv(csv, dtype=str, keep_default_na=False)
+    df['inbreeding'] = pd.Series(F, index=inds).reindex(df.ind.astype(np.int64).values).values
+    df.to_csv(path, index=None)
+
+
+def kinship_block(fa, mo, generation, F, rows, cols, dtype=np.float64):
+    '''
+    Compute the kinship coefficients between two sets of individuals.
+
+    The additive relationship matrix can be written as `A = T D T'`, where `T` is the matrix of
+    expected fractions of genes each individual has from each ancestor, and `D` is the diagonal
+    matrix of Mendelian sampling variances (Henderson, 1976). The columns of A for the
+    individuals in `cols` are computed without forming T, as in Colleau (2002): first `T' e_j`
+    is obtained by passing values from children to parents, one generation at a time starting
+    with the youngest, then it is multiplied by D, and finally T is applied by passing values
+    from parents to children, one generation at a time starting with the founders. Only the
+    ancestors of `rows` and `cols` are processed, and memory usage is proportional to the
+    number of ancestors times `len(cols)`. The kinship coefficient is half the relationship.
+
+    Input:
+        fa:         Array of integer, rows of fathers (-1 if none).
+        mo:         Array of integer, rows of mothers (-1 if none).
+        generation: Array of integer, generation of each row (see `utils.topological_order`).
+        F:          Array of float, inbreeding coefficient of each row (see `inbreeding`).
+        rows:       Array of integer, rows of first set of individuals.
+        cols:       Array of integer, rows of second set of individuals.
+        dtype:      NumPy data type used in computations [`np.float64`].
+
+    Returns:
+    Array of float, kinship coefficients with shape `(len(rows), len(cols))`.
+    '''
+    rows = np.asarray(rows, dtype=np.int64)
+    cols = np.asarray(cols, dtype=np.int64)
+
+    # Only ancestors of the individuals (U) are needed. Map them to local rows, sorted by
+    # generation, with missing parents mapped to an extra row which is always zero.
+    u = np.flatnonzero(ancestor_mask(np.concatenate((rows, cols)), fa, mo))
+    u = u[np.argsort(generation[u], kind='stable')]
+    nu = len(u)
+    local = np.full(len(fa) + 1, nu, dtype=np.int64)
+    local[u] = np.arange(nu)
+    lfa = local[fa[u]]
+    lmo = local[mo[u]]
+    levels = np.split(np.arange(nu), np.flatnonzero(np.diff(generation[u])) + 1)
+
+    X = np.zeros((nu + 1, len(cols)), dtype=dtype)
+    X[local[cols], np.arange(len(cols))] = 1.0
+
+    # T' E, from the youngest generation to the oldest.
+    for level in levels[::-1]:
+        for p in (lfa[level], lmo[level]):
+            parents, sums = _sum_by_parent(np.where(p < nu, p, -1), X[level])
+            X[parents] += 0.5 * sums
+
+    # D T' E.
+    X[:nu] *= mendelian_variance(fa[u], mo[u], F)[:, None]
+    X[nu] = 0.0
+
+    # T D T' E, from the oldest generation to the youngest.
+    for level in levels:
+        X[level] += 0.5 * (X[lfa[level]] + X[lmo[level]])
+
+    return 0.5 * X[local[rows]].astype(np.float64)
+
+
+def _kinship_task(args):
+    '''Compute a block of the kinship matrix in a worker process.'''
+    return kinship_block(*args)
+
+
+def kinship_matrix(gen, inds=None, chunk_size=None, processes=1, sparse=False, dtype=np.float64):
+    '''
+    Compute the kinship coefficients between all pairs of a list of individuals.
+
+    The kinship matrix is computed one block of columns at a time, see `kinship_block`. The
+    memory needed is proportional to the number of ancestors times `chunk_size`, and the blocks
+    can be computed in parallel.
+
+    Example:
+        gen = Gen('path/to/genealogy.csv', [1, 2, 3])
+        K = kinship_matrix(gen)
+        K = kinship_matrix(gen, [1, 2], chunk_size=1000, processes=4)
+
+    Input:
+        gen:        `Gen`, `GenStore` or dictionary, genealogy object.
+        inds:       List of integer, IDs of individuals [`gen.probands`].
+        chunk_size: Integer, number of individuals per block of columns [all individuals].
+        processes:  Integer, number of processes to compute blocks in [1].
+        sparse:     Boolean, return a `scipy.sparse` matrix (requires scipy), without forming the
+                    dense matrix; use with `chunk_size` to limit memory [False].
+        dtype:      NumPy data type used in computations, `np.float32` halves memory usage [`np.float64`].
+
+    Returns:
+    Array of float, kinship matrix, with rows and columns in the order of `inds`.
+    '''
+    if inds is None:
+        inds = gen.probands
+
+    ids, fa, mo = parent_arrays(gen)
+    _, generation = topological_order(fa, mo)
+
+    # Rows of the individuals.
+    pos = {ind: row for row, ind in enumerate(ids.tolist())}
+    for ind in inds:
+        assert ind in pos, 'Individual %d does not exist in genealogy.' % ind
+    rows = np.array([pos[ind] for ind in inds], dtype=np.int64)
+
+    # Inbreeding coefficients of the ancestors of the individuals.
+    F = np.zeros(len(fa))
+    u = np.flatnonzero(ancestor_mask(rows, fa, mo))
+    local = np.full(len(fa) + 1, -1, dtype=np.int64)
+    local[u] = np.arange(len(u))
+    F[u] = inbreeding(local[fa[u]], local[mo[u]], generation[u])
+
+    n = len(rows)
+    if chunk_size is None:
+        chunk_size = max(n, 1)
+    chunks = [np.arange(start, min(start + chunk_size, n)) for start in range(0, n, chunk_size)]
+
+    if sparse:
+        try:
+            import scipy.sparse
+        except ImportError:
+            raise ImportError('A sparse kinship matrix requires scipy.')
+
+    # The blocks are collected as they are computed, so only one block per process is in memory.
+    tasks = [(fa, mo, generation, F, rows, rows[chunk], dtype) for chunk in chunks]
+    if processes > 1:
+        with Pool(processes) as pool:
+            K = _collect_blocks(n, chunks, pool.imap(_kinship_task, tasks), sparse)
+    else:
+        K = _collect_blocks(n, chunks, (_kinship_task(task) for task in tasks), sparse)
+
+    return K
+
+
+def _collect_blocks(n, chunks, blocks, sparse=False):
+    '''
+    Assemble the kinship matrix from blocks of columns, see `kinship_matrix`. With `sparse`, only
+    the non-zero coefficients of each block are kept, and the dense matrix is never formed.
+    '''
+    if not sparse:
+        K = np.zeros((n, n))
+        for chunk, block in zip(chunks, blocks):
+            K[:, chunk] = block
+        return K
+
+    import scipy.sparse
+
+    data, row_idx, col_idx = list(), list(), list()
+    for chunk, block in zip(chunks, blocks):
+        i, j = np.nonzero(block)
+        data.append(block[i, j])
+        row_idx.append(i)
+        col_idx.append(chunk[j])
+
+    if not data:
+        return scipy.sparse.csr_matrix((n, n))
+    return scipy.sparse.csr_matrix((np.concatenate(data), (np.concatenate(row_idx), np.concatenate(col_idx))),
+            shape=(n, n))
+
+
+def write_kinship(K, inds, path):
+    '''Write the non-zero kinship coefficients of each pair of individuals to a CSV file.'''
+    a, b = np.nonzero(np.triu(K))
+    with open(path, 'w') as fid:
+        fid.write('ind1,ind2,kinship\n')
+        fid.writelines('%d,%d,%.12g\n' % (inds[i], inds[j], K[i, j]) for i, j in zip(a.tolist(), b.tolist()))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+
+    # Arguments for parser.
+    parser.add_argument('--csv', type=str, required=True)
+    parser.add_argument('--ind', type=str)
+    parser.add_argument('--out', type=str, required=True)
+    parser.add_argument('--inbreeding', action='store_true', help='Write inbreeding coefficients of all individuals in CSV.')
+    parser.add_argument('--by_thres', type=int)
+    parser.add_argument('--d_thres', type=int)
+    parser.add_argument('--chunk_size', type=int, help='Number of individuals per block of the kinship matrix.')
+    parser.add_argument('--processes', type=int, default=1, help='Number of processes to compute blocks in.')
+
+    # Parse input arguments.
+    args = parser.parse_args()
+
+    if args.inbreeding:
+        write_inbreeding(args.csv, args.out)
+        raise SystemExit
+
+    assert args.ind is not None, 'Either --ind or --inbreeding is required.'
+
+    # Read lines in individual list.
+    ind = open(args.ind).readlines()
+    # Remove whitespace.
+    ind = [int(i.strip()) for i in ind]
+
+    # Construct a genealogy of the individuals from CSV file.
+    gen = Gen(args.csv, ind, depth=args.d_thres, by=args.by_thres, batch=True)
+
+    K = kinship_matrix(gen, ind, chunk_size=args.chunk_size, processes=args.processes)
+
+    write_kinship(K, ind, args.out)
@@ -4,16 +4,62 @@ Functions for reading in and extracting information from genealogies produced by
 
 Usage:
     python lineages.py --csv [CSV] --ind [individuals] --out [output]
+    python lineages.py --csv [CSV] --ind [individuals] --out [output] --direction down
+    python lineages.py --csv [CSV] --ind [individuals] --out [output] --prune
+    python lineages.py --csv [CSV] --ind [individuals] --out [output] --order topological
+    python lineages.py --csv [CSV] --manifest [manifest] --workers [number of processes]
+    python lineages.py --csv [CSV] --ind [individuals] --out [output] --profile_json [JSON output]
 
 Input:
     CSV:              Input CSV file with genealogy.
     Individuals:      Text file with RIN of individuals to reconstruct.
     Output:           Filename to write resulting CSV to.
+    Manifest:         CSV with one cohort (individuals, output and thresholds) per line, see
+                      `run_manifest`.
+    JSON output:      File to write the time and memory of each stage to (see `profiling.py`).
+                      They are also reported to standard error, as with --profile.
 '''
 
+from multiprocessing import Pool
+from utils import AncestorIndex, calc_depths, child_index, gather_children, connecting_pedigree, cycle_members, \
+        parent_arrays, topological_order
+from profiling import profiler
 import pandas as pd
 import numpy as np
-import warnings, argparse
+import warnings, argparse, bz2, copy, csv, gzip, hashlib, json, lzma, os, shutil, sys, time
+
+# Version of the binary genealogy cache format. Caches of other versions are rebuilt.
+CACHE_VERSION = 2
+
+# Version of the ancestor index stored in the binary cache, see `load_ancestor_index`.
+ANCESTOR_INDEX_VERSION = 1
+
+# Columns of genealogy CSV files, in the order written by `ged2csv.py` and `write_genealogy`.
+CSV_COLUMNS = ('ind', 'father', 'mother', 'sex', 'birth_year', 'birth_place')
+
+# Extensions of genealogy files that are not CSV, and the pandas functions that read them. These
+# formats require the optional pyarrow package.
+BINARY_FORMATS = {'.parquet': pd.read_parquet, '.feather': pd.read_feather}
+
+# Compressions of CSV files written by `write_genealogy`, with the extension each is inferred from.
+COMPRESSIONS = {'gzip': ('.gz', gzip.open), 'bz2': ('.bz2', bz2.open), 'xz': ('.xz', lzma.open)}
+
+
+class GenealogyError(ValueError):
+    '''
+    Error raised when a genealogy fails validation (see `GenStore.validate`). The `problems`
+    attribute is the dataframe of all problems found.
+    '''
+    def __init__(self, problems, path=None):
+        self.problems = problems
+
+        counts = problems.problem.value_counts()
+        lines = ['Genealogy%s has %d problems:' % ('' if path is None else ' %s' % path, len(problems))]
+        lines += ['    %s: %d' % (problem, count) for problem, count in counts.items()]
+        lines += ['First problems:']
+        lines += ['    %d: %s%s' % (row.ind, row.problem, ' (%d)' % row.parent if row.parent else '')
+                for row in problems.head(20).itertuples()]
+        super(GenealogyError, self).__init__('\n'.join(lines))
 
 
 class Record(object):
@@ -25,36 +71,710 @@ class Record(object):
         self.birth_year = by
 
 
-def csv2dict(csv):
-    '''Read genealogy from CSV into a dictionary of individual objects.'''
+class GenStore(object):
+    '''
+    Columnar genealogy, storing each field of all records in a NumPy array.
+
+    Individuals are stored in rows, in the order they were first seen in the CSV. The RIN of
+    an individual is mapped to its row by a dense index array, such that `index[rin]` is the
+    row of the individual, or -1 if the individual does not exist. The row of each parent is
+    stored in `fa_idx` and `mo_idx` (-1 if the parent is 0 or does not exist). Sex and birth
+    place are stored as categorical codes into `sex_categories` and `place_categories` (-1 if
+    missing). The children of each individual are found with a compressed (CSR) index from
+    parents to children, see `child_index`.
 
-    # Read CSV into dataframe.
-    df = pd.read_csv(csv)
+    The `get` method returns a `Record`, so a `GenStore` can be used wherever a dictionary of
+    `Record` objects was used before, e.g. in `lineage`, `genealogy` and `utils.calc_depth`.
 
-    dd = dict()
-    for i, row in df.iterrows():
-        # Obtain row of dataframe.
-        # Check that ID isn't already in dictionary.
-        if row.ind in dd:
-            warnings.warn('Individual RIN %d is associated with multiple records. Ignoring all but first seen record.' %row.ind, Warning)
+    A `GenStore` loaded with `mmap_mode` (see `load`) is backed by read-only memory-mapped
+    files, so processes using the same files share one copy of the pages. Such a store is
+    pickled as its path, so passing it to `multiprocessing` workers does not copy the arrays.
+
+    Example:
+        store = csv2dict('path/to/genealogy.csv')
+        rec = store.get(1)
+        father = rec.fa
+
+    Input:
+        ind:                Array of integer, RIN of individuals.
+        father:             Array of integer, RIN of fathers (0 if unknown).
+        mother:             Array of integer, RIN of mothers (0 if unknown).
+        birth_year:         Array of float, birth years (NaN if unknown).
+        sex_codes:          Array of integer, codes into `sex_categories`.
+        sex_categories:     List of string, sex categories.
+        place_codes:        Array of integer, codes into `place_categories`.
+        place_categories:   List of string, birth place categories.
+    '''
+    # Arrays stored in binary genealogy files (see `save`).
+    ARRAYS = ('ind', 'father', 'mother', 'birth_year', 'sex_codes', 'place_codes', 'index',
+            'fa_idx', 'mo_idx', 'child_ptr', 'children')
+
+    def __init__(self, ind, father, mother, birth_year, sex_codes, sex_categories, place_codes,
+            place_categories, index=None, fa_idx=None, mo_idx=None, child_ptr=None, children=None):
+        self.ind = np.asarray(ind, dtype=np.int64)
+        self.father = np.asarray(father, dtype=np.int64)
+        self.mother = np.asarray(mother, dtype=np.int64)
+        self.birth_year = np.asarray(birth_year, dtype=np.float64)
+        self.sex_codes = np.asarray(sex_codes, dtype=np.int32)
+        self.sex_categories = list(sex_categories)
+        self.place_codes = np.asarray(place_codes, dtype=np.int32)
+        self.place_categories = list(place_categories)
+
+        # Dense RIN to row index.
+        if index is None:
+            size = int(self.ind.max()) + 1 if len(self.ind) > 0 else 1
+            index = np.full(size, -1, dtype=np.int64)
+            index[self.ind] = np.arange(len(self.ind), dtype=np.int64)
+        self.index = index
+
+        # Rows of parents.
+        self.fa_idx = self.rows(self.father) if fa_idx is None else fa_idx
+        self.mo_idx = self.rows(self.mother) if mo_idx is None else mo_idx
+
+        # Index from parents to children, constructed when it is first needed (see `child_index`).
+        self.child_ptr = child_ptr
+        self.children = children
+
+        # Path of the binary cache of the store (see `csv2dict`), and memory-map mode it was
+        # loaded with, see `load`.
+        self.path = None
+        self.mmap_mode = None
+
+    @classmethod
+    def from_frame(cls, df):
+        '''Construct a genealogy store from a dataframe with the columns of a `ged2csv.py` CSV.'''
+
+        # Only keep the first record of each RIN.
+        dup = df.ind.duplicated().values
+        for ind in df.ind.values[dup]:
+            warnings.warn('Individual RIN %d is associated with multiple records. Ignoring all but first seen record.' %ind, Warning)
+        df = df[~dup]
+
+        sex = pd.Categorical(df.sex)
+        place = pd.Categorical(df.birth_place)
+
+        return cls(df.ind.values, df.father.values, df.mother.values,
+                df.birth_year.to_numpy(dtype=np.float64, na_value=np.nan), sex.codes,
+                sex.categories.tolist(), place.codes, place.categories.tolist())
+
+    def save(self, path, meta=None):
+        '''
+        Write genealogy to a directory of binary files, one NumPy (.npy) file per array and a
+        JSON file with the categories and the dictionary `meta`, see `write_cache_dir`.
+        '''
+        self.child_index()
+
+        meta = dict() if meta is None else dict(meta)
+        meta['version'] = CACHE_VERSION
+        meta['sex_categories'] = self.sex_categories
+        meta['place_categories'] = self.place_categories
+
+        write_cache_dir(path, {name: getattr(self, name) for name in self.ARRAYS}, meta)
+
+    @classmethod
+    def load(cls, path, mmap_mode=None):
+        '''
+        Read genealogy written by `save`.
+
+        `mmap_mode` is passed on to `np.load`. Use `mmap_mode='r'` to memory-map the files
+        read-only instead of reading them into memory.
+        '''
+        with open(os.path.join(path, 'meta.json')) as fid:
+            meta = json.load(fid)
+        arrays = {name: np.load(os.path.join(path, name + '.npy'), mmap_mode=mmap_mode)
+                for name in cls.ARRAYS}
+
+        store = cls(sex_categories=meta['sex_categories'], place_categories=meta['place_categories'],
+                **arrays)
+        store.path = path
+        store.mmap_mode = mmap_mode
+
+        return store
+
+    def __reduce_ex__(self, protocol):
+        # A memory-mapped store is pickled as its path, and mapped again when unpickled.
+        if self.mmap_mode is not None:
+            return (GenStore.load, (self.path, self.mmap_mode))
+        return super(GenStore, self).__reduce_ex__(protocol)
+
+    def child_index(self):
+        '''
+        Index from parents to children, such that the rows of the children of the individual in
+        row `i` are `children[child_ptr[i]:child_ptr[i+1]]` (see `utils.child_index`).
+
+        The index is constructed when it is first needed, and stored with the genealogy (see
+        `save`), so it is read from the binary cache.
+
+        Returns:
+        Tuple (child_ptr, children) of arrays of integer.
+        '''
+        if self.child_ptr is None:
+            self.child_ptr, self.children = child_index(self.fa_idx, self.mo_idx)
+        return self.child_ptr, self.children
+
+    def validate(self):
+        '''
+        Check the genealogy for errors, using the parent arrays, so that every problem is found in
+        one pass over all individuals:
+
+            missing father/mother:      The parent RIN is not 0, but not in the genealogy.
+            father has sex F:           The father is registered as female.
+            mother has sex M:           The mother is registered as male.
+            father/mother born after child: The parent has a later birth year than the child.
+            ancestor of itself:         The individual is in a cycle of parent links (see
+                                        `utils.cycle_members`).
+            descends from a cycle:      The individual is not in a cycle, but descends from an
+                                        individual in one, so it has no generation.
+
+        Example:
+            problems = csv2dict('path/to/genealogy.csv').validate()
+            print(problems.problem.value_counts())
+
+        Returns:
+        Dataframe with a line per problem, and the columns ind, problem and parent (RIN of the
+        parent involved, or 0). Empty if there are no problems.
+        '''
+        frames = list()
+
+        def add(rows, problem, parents):
+            frames.append(pd.DataFrame({'ind': self.ind[rows], 'problem': problem,
+                'parent': np.asarray(parents, dtype=np.int64)}))
+
+        for name, ids, idx, wrong_sex in (('father', self.father, self.fa_idx, 'F'),
+                ('mother', self.mother, self.mo_idx, 'M')):
+            missing = (ids != 0) & (idx < 0)
+            add(np.flatnonzero(missing), 'missing %s' % name, ids[missing])
+
+            rows = np.flatnonzero(idx >= 0)
+            parents = idx[rows]
+            if wrong_sex in self.sex_categories:
+                bad = self.sex_codes[parents] == self.sex_categories.index(wrong_sex)
+                add(rows[bad], '%s has sex %s' % (name, wrong_sex), self.ind[parents[bad]])
+
+            # NOTE: comparisons with unknown (NaN) birth years are False.
+            later = self.birth_year[parents] > self.birth_year[rows]
+            add(rows[later], '%s born after child' % name, self.ind[parents[later]])
+
+        _, generation = calc_depths(self)
+        cycle = cycle_members(self.fa_idx, self.mo_idx, generation)
+        add(np.flatnonzero(cycle), 'ancestor of itself', np.zeros(cycle.sum()))
+        descends = np.flatnonzero((generation < 0) & ~cycle)
+        add(descends, 'descends from a cycle', np.zeros(len(descends)))
+
+        return pd.concat(frames, ignore_index=True)
+
+    def rows(self, inds):
+        '''Rows of an array of RIN. Individuals that do not exist (including 0) get row -1.'''
+        inds = np.asarray(inds, dtype=np.int64)
+        rows = np.full(inds.shape, -1, dtype=np.int64)
+        valid = (inds > 0) & (inds < len(self.index))
+        rows[valid] = self.index[inds[valid]]
+        return rows
+
+    def row(self, ind):
+        '''Row of a single individual, or -1 if the individual does not exist.'''
+        if ind is None or ind < 0 or ind >= len(self.index):
+            return -1
+        return int(self.index[ind])
+
+    def record(self, row):
+        '''Construct a `Record` from the data in a row.'''
+        birth_year = self.birth_year[row]
+        if np.isnan(birth_year):
+            birth_year = np.nan
         else:
-            # Add record to dictionary.
-            if np.isnan(row.birth_year):
-                birth_year = np.nan
-            else:
-                birth_year = int(row.birth_year)
+            birth_year = int(birth_year)
+
+        sex = self.sex_codes[row]
+        sex = self.sex_categories[sex] if sex >= 0 else np.nan
+        place = self.place_codes[row]
+        place = self.place_categories[place] if place >= 0 else np.nan
+
+        return Record(int(self.father[row]), int(self.mother[row]), sex, birth_year, place)
+
+    def records(self, rows):
+        '''Construct a list of `Record` objects from the data in an array of rows.'''
+        rows = np.asarray(rows, dtype=np.int64)
+
+        birth_year = self.birth_year[rows]
+        known = ~np.isnan(birth_year)
+        birth_year = birth_year.astype(object)
+        birth_year[known] = birth_year[known].astype(np.int64)
+        birth_year[~known] = np.nan
+
+        sex = np.array(self.sex_categories + [np.nan], dtype=object)[self.sex_codes[rows]]
+        place = np.array(self.place_categories + [np.nan], dtype=object)[self.place_codes[rows]]
+
+        return [Record(fa, mo, sx, by, bp) for fa, mo, sx, by, bp in zip(self.father[rows].tolist(),
+            self.mother[rows].tolist(), sex.tolist(), birth_year.tolist(), place.tolist())]
+
+    def get(self, ind, default=None):
+        row = self.row(ind)
+        if row < 0:
+            return default
+        return self.record(row)
+
+    def __getitem__(self, ind):
+        row = self.row(ind)
+        if row < 0:
+            raise KeyError(ind)
+        return self.record(row)
+
+    def __contains__(self, ind):
+        return self.row(ind) >= 0
+
+    def __len__(self):
+        return len(self.ind)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def keys(self):
+        return self.ind.tolist()
+
+
+def cache_path(csv):
+    '''Path of the binary genealogy cache of a CSV file.'''
+    return csv + '.cache'
+
+
+def file_hash(path):
+    '''SHA-1 hash of the contents of a file.'''
+    sha = hashlib.sha1()
+    with open(path, 'rb') as fid:
+        for block in iter(lambda: fid.read(1 << 20), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def csv_signature(csv):
+    '''Size, modification time and content hash of a CSV file, stored with caches built from it.'''
+    stat = os.stat(csv)
+    return {'csv_size': stat.st_size, 'csv_mtime_ns': stat.st_mtime_ns, 'csv_sha1': file_hash(csv)}
+
+
+def cache_is_valid(csv, meta, version=CACHE_VERSION):
+    '''
+    Check whether a cache was built from the current version of a CSV file.
+
+    If the size or modification time of the CSV has changed since the cache was built, the
+    cache is invalid. If only the modification time has changed (e.g. the file was copied or
+    re-exported without changes), the content hash decides, and if the cache is valid, the
+    modification time in `meta` is updated.
+    '''
+    if meta.get('version') != version:
+        return False
+
+    stat = os.stat(csv)
+    if stat.st_size != meta.get('csv_size'):
+        return False
+    if stat.st_mtime_ns == meta.get('csv_mtime_ns'):
+        return True
+    if file_hash(csv) == meta.get('csv_sha1'):
+        meta['csv_mtime_ns'] = stat.st_mtime_ns
+        return True
+    return False
+
+
+def read_cache_meta(path, csv, version=CACHE_VERSION):
+    '''
+    Read the metadata (meta.json) of the cache directory `path` built from `csv`.
+
+    Returns:
+    Dictionary, or None if there is no cache or it is not valid (see `cache_is_valid`).
+    '''
+    meta_path = os.path.join(path, 'meta.json')
+    if not os.path.isfile(meta_path):
+        return None
+
+    with open(meta_path) as fid:
+        meta = json.load(fid)
+    mtime = meta.get('csv_mtime_ns')
+    if not cache_is_valid(csv, meta, version):
+        return None
+
+    if meta['csv_mtime_ns'] != mtime:
+        # Content is unchanged, so avoid hashing the CSV again next time.
+        try:
+            with open(meta_path, 'w') as fid:
+                json.dump(meta, fid)
+        except OSError:
+            pass
+
+    return meta
+
+
+def write_cache_dir(path, arrays, meta):
+    '''
+    Write a cache directory: one NumPy (.npy) file per array, and the metadata as meta.json.
+
+    The files are written to a temporary directory first. Then the old cache is renamed aside,
+    the temporary directory is renamed to `path`, and the old cache is removed, so that an
+    incomplete cache is never read; between the two renames there is briefly no cache, which
+    readers treat as a missing cache. If the last rename fails because another process has
+    written the cache in the meantime, its cache is kept and the temporary directory is removed.
+    If writing fails, the temporary directory is removed, and the error is raised.
+
+    Input:
+        path:       String, path to the cache directory.
+        arrays:     Dictionary of arrays, written to "[name].npy".
+        meta:       Dictionary, written as JSON.
+    '''
+    tmp = '%s.tmp%d' % (path, os.getpid())
+    old = '%s.old%d' % (path, os.getpid())
+    try:
+        os.makedirs(tmp)
+        for name, array in arrays.items():
+            np.save(os.path.join(tmp, name + '.npy'), array)
+        with open(os.path.join(tmp, 'meta.json'), 'w') as fid:
+            json.dump(meta, fid)
+        if os.path.isdir(path):
+            try:
+                os.rename(path, old)
+            except FileNotFoundError:
+                # Another process has moved the old cache aside.
+                pass
+        try:
+            os.rename(tmp, path)
+        except OSError:
+            if not os.path.isdir(path):
+                raise
+            # Another process has written the cache since the old one was moved aside.
+            shutil.rmtree(tmp, ignore_errors=True)
+    except OSError:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+    finally:
+        shutil.rmtree(old, ignore_errors=True)
+
+
+def _build_cache(csv, store):
+    '''Write the binary genealogy cache of a CSV file. Warns and continues if this fails.'''
+    path = cache_path(csv)
+    try:
+        store.save(path, csv_signature(csv))
+    except OSError as err:
+        warnings.warn('Could not write genealogy cache %s: %s' % (path, err), Warning)
+
+
+def load_ancestor_index(store):
+    '''
+    Get the ancestor index (see `utils.AncestorIndex`) of a whole genealogy, stored in the binary
+    cache the genealogy was read from.
+
+    The index is stored in the directory "ancestors" of the cache (see `cache_path`), and read
+    from there (memory-mapped) if it exists. Otherwise, it is constructed and stored. The cache
+    is replaced when the CSV changes, and the index with it.
+
+    Example:
+        index = load_ancestor_index(csv2dict('path/to/genealogy.csv', cache=True))
+        index.is_ancestor(2, 1)
+
+    Input:
+        store:      `GenStore`, read with a binary cache (see `csv2dict`).
+
+    Returns:
+    `AncestorIndex`.
+
+    Raises:
+    ValueError if the genealogy contains a cycle, see `utils.topological_order`.
+    '''
+    assert store.path is not None, 'The genealogy has no binary cache to store the ancestor index in.'
+    path = os.path.join(store.path, 'ancestors')
+
+    with profiler.stage('ancestor_index'):
+        meta_path = os.path.join(path, 'meta.json')
+        if os.path.isfile(meta_path):
+            with open(meta_path) as fid:
+                meta = json.load(fid)
+            if meta.get('version') == ANCESTOR_INDEX_VERSION and meta.get('individuals') == len(store):
+                return AncestorIndex(**{name: np.load(os.path.join(path, name + '.npy'), mmap_mode='r')
+                        for name in AncestorIndex.ARRAYS})
+
+        index = AncestorIndex.build(store)
+        profiler.count('intervals', len(index.lo))
+        try:
+            write_cache_dir(path, index.arrays(), {'version': ANCESTOR_INDEX_VERSION, 'individuals': len(store)})
+        except OSError as err:
+            warnings.warn('Could not write ancestor index %s: %s' % (path, err), Warning)
+
+    return index
+
+
+def read_genealogy(path):
+    '''
+    Read a genealogy file into a dataframe.
+
+    Files ending in ".parquet" or ".feather" are read as such (see `write_genealogy`), and all
+    other files as CSV, which may be compressed (e.g. ".csv.gz").
+    '''
+    for ext, read in BINARY_FORMATS.items():
+        if path.endswith(ext):
+            return read(path)
+    return pd.read_csv(path)
+
+
+def genealogy_frame(gen, order=None):
+    '''
+    Get the records of a genealogy as a dataframe with the columns `CSV_COLUMNS`.
+
+    The columns are constructed from all records at once: directly from the arrays of a
+    `GenStore`, or from the records of a `Gen` object or dictionary of `Record` objects. Unknown
+    birth years, sexes and birth places are missing values.
+
+    The records are in the order of the genealogy, or with `order="topological"`, in generation
+    order: founders first, and every parent before its children (see `utils.topological_order`).
+    Individuals in the same generation keep the order of the genealogy. A file in this order can
+    be read in one pass by tools that need the parents of an individual before the individual.
+
+    Input:
+        gen:        `GenStore`, `Gen` or dictionary, genealogy object.
+        order:      String, None for the order of the genealogy, or "topological" [None].
+
+    Returns:
+    Dataframe, with a nullable integer birth_year column.
+    '''
+    if isinstance(gen, GenStore):
+        ind = gen.ind
+        father = gen.father
+        mother = gen.mother
+        birth_year = gen.birth_year
+        sex = pd.Categorical.from_codes(gen.sex_codes, gen.sex_categories)
+        place = pd.Categorical.from_codes(gen.place_codes, gen.place_categories)
+    else:
+        if isinstance(gen, Gen):
+            gen = gen.gen
+        ind = list(gen.keys())
+        recs = [gen.get(i) for i in ind]
+        father = [rec.fa for rec in recs]
+        mother = [rec.mo for rec in recs]
+        birth_year = np.array([rec.birth_year for rec in recs], dtype=np.float64)
+        sex = [rec.sex for rec in recs]
+        place = [rec.birth_place for rec in recs]
+
+    df = pd.DataFrame({'ind': np.asarray(ind, dtype=np.int64),
+        'father': np.asarray(father, dtype=np.int64),
+        'mother': np.asarray(mother, dtype=np.int64),
+        'sex': pd.Series(sex, dtype=object),
+        'birth_year': pd.Series(birth_year, dtype=np.float64).astype('Int64'),
+        'birth_place': pd.Series(place, dtype=object)},
+        columns=CSV_COLUMNS)
+
+    if order == 'topological':
+        _, fa, mo = parent_arrays(gen)
+        rows, _ = topological_order(fa, mo)
+        df = df.iloc[rows].reset_index(drop=True)
+    else:
+        assert order is None, 'Unknown order "%s", use None or "topological".' % order
+
+    return df
+
+
+def write_genealogy(gen, path, compression='infer', order=None):
+    '''
+    Write a genealogy to a file, in one operation from the columns of the genealogy (see
+    `genealogy_frame`).
+
+    The format is given by the extension of `path`: Parquet (".parquet") or Feather (".feather"),
+    which require the pyarrow package, or otherwise CSV, with the columns in the same order as
+    the CSV written by `ged2csv.py`, and quoting of fields where needed. All rows of a CSV are
+    written by a single call to the `csv` module, which is faster than `DataFrame.to_csv`.
+    Missing values are written as "NA" in CSV. Files written by this function can be read by
+    `csv2dict` and `Gen` without loss.
+
+    Example:
+        write_genealogy(gen, 'genealogy.csv')
+        write_genealogy(gen, 'genealogy.csv.gz')   # Compressed CSV.
+        write_genealogy(gen, 'genealogy.parquet')
+
+    Input:
+        gen:            `GenStore`, `Gen` or dictionary, genealogy object.
+        path:           String, path to output file.
+        compression:    String, compression for CSV ("infer" from extension of `path`, "gzip",
+                        "bz2", "xz" or None), or for Parquet and Feather (e.g. "snappy", "zstd"
+                        or "lz4", "infer" for the default of the format) ["infer"].
+        order:          String, order of the records, None or "topological", see
+                        `genealogy_frame` [None].
+    '''
+    df = genealogy_frame(gen, order=order)
+
+    if path.endswith('.parquet'):
+        df.to_parquet(path, index=False, **({} if compression == 'infer' else {'compression': compression}))
+    elif path.endswith('.feather'):
+        df.to_feather(path, **({} if compression == 'infer' else {'compression': compression}))
+    else:
+        if compression == 'infer':
+            compression = None
+            for name, (ext, _) in COMPRESSIONS.items():
+                if path.endswith(ext):
+                    compression = name
+        assert compression is None or compression in COMPRESSIONS, \
+                'Unknown compression "%s" for CSV, use one of: %s.' % (compression, ', '.join(COMPRESSIONS))
+        open_csv = open if compression is None else COMPRESSIONS[compression][1]
+
+        with open_csv(path, 'wt', newline='') as fid:
+            write_genealogy_csv(df, fid)
+
+
+def write_genealogy_csv(gen, fid):
+    '''
+    Write a genealogy as CSV to an open text file (e.g. `io.StringIO`), as `write_genealogy`.
+
+    Input:
+        gen:        Dataframe from `genealogy_frame`, or `GenStore`, `Gen` or dictionary.
+        fid:        File object, opened in text mode with `newline=''`.
+    '''
+    df = gen if isinstance(gen, pd.DataFrame) else genealogy_frame(gen)
+
+    # Columns as lists, with missing values as "NA".
+    columns = [df[name].astype(object).where(df[name].notna(), 'NA').tolist()
+            for name in CSV_COLUMNS]
+
+    writer = csv.writer(fid, lineterminator='\n')
+    writer.writerow(CSV_COLUMNS)
+    writer.writerows(zip(*columns))
+
+
+def csv2dict(csv, cache=False, mmap=False, validate=False):
+    '''
+    Read genealogy from CSV into a columnar genealogy store (see `GenStore`).
+
+    Compressed CSV, Parquet and Feather files can also be read, see `read_genealogy`.
+
+    If `cache` is True, the genealogy is also stored in a binary cache next to the CSV (see
+    `cache_path`), and read from this cache instead of the CSV on subsequent calls. The cache
+    is rebuilt when the CSV changes (see `cache_is_valid`).
+
+    If `mmap` is True (requires `cache`), the cache is memory-mapped read-only rather than read
+    into memory, so that multiple processes reading the same CSV share the genealogy.
+
+    If `validate` is True, the genealogy is checked for errors (see `GenStore.validate`), and a
+    `GenealogyError` listing all problems is raised if any are found.
+
+    Example:
+        gen = csv2dict('path/to/genealogy.csv', cache=True)
+        gen = csv2dict('path/to/genealogy.csv', cache=True, mmap=True)
+    '''
+    store = _read_store(csv, cache, mmap)
+
+    if validate:
+        _check_store(store, csv)
+
+    return store
+
+
+def _check_store(store, path=None):
+    '''Validate a genealogy store (see `GenStore.validate`), and raise a `GenealogyError` if it has problems.'''
+    with profiler.stage('validate'):
+        problems = store.validate()
+        profiler.count('problems', len(problems))
+    if len(problems) > 0:
+        raise GenealogyError(problems, path)
+
+
+def _read_store(csv, cache, mmap):
+    '''Read genealogy from CSV or binary cache, see `csv2dict`.'''
+
+    assert cache or not mmap, 'Memory-mapping the genealogy requires the binary cache.'
+    mmap_mode = 'r' if mmap else None
+
+    with profiler.stage('csv2dict'):
+        if cache and read_cache_meta(cache_path(csv), csv) is not None:
+            with profiler.stage('load_cache'):
+                store = GenStore.load(cache_path(csv), mmap_mode)
+                profiler.count('individuals', len(store))
+            return store
+
+        # Read CSV into dataframe.
+        with profiler.stage('read_csv'):
+            df = read_genealogy(csv)
+            profiler.count('records', len(df))
 
-            dd[row.ind] = Record(row.father, row.mother, row.sex, birth_year, row.birth_place)
+        with profiler.stage('build_store'):
+            store = GenStore.from_frame(df)
+            profiler.count('individuals', len(store))
 
-    return dd
+        if cache:
+            with profiler.stage('write_cache'):
+                _build_cache(csv, store)
+            if os.path.isdir(cache_path(csv)):
+                store.path = cache_path(csv)
+                if mmap:
+                    store = GenStore.load(cache_path(csv), mmap_mode)
+
+    return store
+
+
+def _ancestors(inds, gen, lin, depth=None, d=0, by=None):
+    '''
+    Add the lineages of a list of individuals to `lin`. See `lineage` for details.
+
+    The traversal uses an explicit stack instead of recursion, so deep lineages do not hit
+    Python's recursion limit. The smallest generational depth at which each individual has
+    been expanded is recorded, and an individual is only expanded again if it is reached at
+    a smaller depth. Without this, shared ancestors (pedigree collapse) would be traversed
+    once for every path leading to them. The individuals are added to `lin` in the same
+    order as a recursive depth-first traversal (father before mother) would add them.
+    '''
+
+    # Smallest generational depth each individual has been reached at.
+    seen = dict()
+
+    # Number of individuals expanded, and of individuals not expanded again, for profiling.
+    visited = 0
+    revisits = 0
+
+    for ind in inds:
+        # Stack of (individual, generational depth) pairs still to visit.
+        stack = [(ind, d)]
+        while stack:
+            ind, di = stack.pop()
+
+            # If the individual has already been reached at the same or a smaller depth,
+            # all its ancestors within the allowed depth are already in the lineage.
+            dprev = seen.get(ind)
+            if dprev is not None and dprev <= di:
+                revisits += 1
+                continue
+            seen[ind] = di
+            visited += 1
+
+            # Get record corresponding to individual.
+            rec = gen.get(ind)
+
+            assert rec is not None, 'Individual %d does not exist in genealogy.' % ind
+
+            # If we have reached the minimum birth year or the maximum genereational depth, we do
+            # nothing.
+            # NOTE: "unknown" individuals have NaN birth year, and `nan < by` is False, so such
+            # individuals are always added.
+            if by is not None and rec.birth_year < by or depth is not None and di > depth:
+                continue
+
+            # Add record to lineage.
+            lin[ind] = rec
+
+            # If the parent exists (ID different from 0), push it onto the stack with
+            # incremented depth. The mother is pushed first, so that the father's line is
+            # visited first.
+            if rec.mo != 0:
+                stack.append((rec.mo, di + 1))
+            if rec.fa != 0:
+                stack.append((rec.fa, di + 1))
+
+    profiler.count('nodes_visited', visited)
+    profiler.count('revisits_avoided', revisits)
+
+    return lin
 
 
 def lineage(ind, gen, lin, depth=None, d=0, by=None):
     '''
     Generate lineage of a single individual based on complete genealogy available.
 
-    This method starts with a single individual and recursively obtains the parents of an individual,
-    until either there are no more ancestors, or a stopping criteria is met.
+    This method starts with a single individual and iteratively obtains the parents of an individual,
+    until either there are no more ancestors, or a stopping criteria is met. Each ancestor is
+    only traversed once per generational depth it is reached at, see `_ancestors`.
 
     Example:
         lin = lineage(1, gen, dict())
@@ -62,82 +782,233 @@ def lineage(ind, gen, lin, depth=None, d=0, by=None):
 
     Input:
         ind:        Integer, ID of individual.
-        gen:        Dictionary, genealogy object.
+        gen:        Dictionary or `GenStore`, genealogy object.
         lin:        Dictionary, set to empty dictionary (`dict()`).
         depth:      Integer, total generational depth allowed [`None`].
-        d:          Integer, current generational depth, do not change [0].
+        d:          Integer, generational depth of `ind` [0].
         by:         Integer, minimum allowed birth year of ancestor [`None`].
 
     Returns:
     Dictionary, lineage of individual.
     '''
 
-    # Get record corresponding to individual.
-    rec = gen.get(ind)
+    # NOTE: sometimes an individual is "unknown" in AEBS. Usually, such a person will
+    # not have a "BIRT" record, and will therefore have "nan" (or "NA") in rec.birth_year
+    # and rec.birth_place. Such a person will always have rec.fa = 0 and rec.mo = 0.
+
+    return _ancestors([ind], gen, lin, depth=depth, d=d, by=by)
 
-    assert rec is not None, 'Individual %d does not exist in genealogy.' % ind
 
-    # If we have reached the minimum birth year or the maximum genereational depth, we do
-    # nothing.
-    if by is not None and rec.birth_year < by or depth is not None and d > depth:
-        return lin
+def frontier_genealogy(inds, store, depth=None, d=0, by=None):
+    '''
+    Find the rows of all ancestors of multiple individuals in a `GenStore`.
 
-    # Add record to lineage.
-    lin[ind] = rec
+    Rather than traversing one lineage at a time, all individuals are expanded together,
+    one generation at a time. Each generation (the frontier) is an array of rows, and the next
+    generation is obtained from the parent rows of the frontier. Individuals already in the
+    genealogy are removed from the frontier, and the `depth` and `by` cut-offs are applied as
+    masks. As the expansion is breadth first, each individual is reached at the smallest
+    generational depth of any path from the input individuals, so the resulting individuals
+    are the same as those obtained by `genealogy`.
 
-    # Get IDs of the individual's parents.
-    fa = rec.fa
-    mo = rec.mo
+    Example:
+        store = csv2dict('path/to/genealogy.csv')
+        rows = frontier_genealogy([1, 2, 3], store, depth=5, by=1800)
+        inds = store.ind[rows]
 
-    # If the parent exists (ID different from 0), make a recursive call, attempting
-    # to add the parent.
-    # Pass all parameters on in the recursive call, and increment the depth.
-    # The recursive call will return the resulting lineage.
-    if fa != 0:
-        lin = lineage(ind=fa, gen=gen, depth=depth, d=d+1, lin=lin, by=by)
-    if mo != 0:
-        lin = lineage(ind=mo, gen=gen, depth=depth, d=d+1, lin=lin, by=by)
+    Input:
+        inds:       List of integer, IDs of individuals.
+        store:      `GenStore`, genealogy object.
+        depth:      Integer, total generational depth allowed [`None`].
+        d:          Integer, generational depth of the individuals in `inds` [0].
+        by:         Integer, minimum allowed birth year of ancestor [`None`].
 
-    # NOTE: sometimes an individual is "unknown" in AEBS. Usually, such a person will
-    # not have a "BIRT" record, and will therefore have "nan" (or "NA") in rec.birth_year
-    # and rec.birth_place. Such a person will always have rec.fa = 0 and rec.mo = 0.
+    Returns:
+    Array of integer, rows of the individuals in the genealogy, one generation at a time.
+    '''
+
+    # Mask of individuals allowed by the birth year cut-off. Individuals with unknown (NaN)
+    # birth year are always allowed, as `nan < by` is False.
+    allowed = ~(store.birth_year < by) if by is not None else None
+
+    def parents(frontier):
+        # Get the rows of the parents of the frontier, and check that all parents exist.
+        rows = np.concatenate((store.fa_idx[frontier], store.mo_idx[frontier]))
+        ids = np.concatenate((store.father[frontier], store.mother[frontier]))
+        missing = (ids != 0) & (rows < 0)
+        assert not missing.any(), 'Individual %d does not exist in genealogy.' % ids[missing][0]
+        return rows[rows >= 0]
+
+    return _frontier_search(inds, store, parents, allowed, depth, d)
+
+
+def _frontier_search(inds, store, neighbours, allowed, depth, d):
+    '''
+    Expand individuals in a `GenStore` one generation at a time, see `frontier_genealogy` and
+    `frontier_descendants`.
+
+    Input:
+        inds:       List of integer, IDs of individuals.
+        store:      `GenStore`, genealogy object.
+        neighbours: Function, returns the rows of the next generation (parents or children) of
+                    an array of rows.
+        allowed:    Array of boolean, individuals allowed by the birth year cut-off, or None.
+        depth:      Integer, total generational depth allowed, or None.
+        d:          Integer, generational depth of the individuals in `inds`.
+
+    Returns:
+    Array of integer, rows of the individuals found, one generation at a time.
+    '''
+    inds = np.asarray(inds, dtype=np.int64)
+    frontier = store.rows(inds)
+    missing = frontier < 0
+    assert not missing.any(), 'Individual %d does not exist in genealogy.' % inds[missing][0]
+
+    # Mask of individuals already in genealogy.
+    visited = np.zeros(len(store), dtype=bool)
+
+    # Number of individuals not expanded again, for profiling.
+    revisits = 0
+
+    rows = list()
+    frontier = np.unique(frontier)
+    while len(frontier) > 0 and (depth is None or d <= depth):
+        # Apply cut-offs and remove individuals that are already in genealogy.
+        if allowed is not None:
+            frontier = frontier[allowed[frontier]]
+        reached = len(frontier)
+        frontier = frontier[~visited[frontier]]
+        revisits += reached - len(frontier)
+
+        visited[frontier] = True
+        rows.append(frontier)
+
+        # The next generation.
+        frontier = np.unique(neighbours(frontier))
+        d += 1
+
+    rows = np.concatenate(rows) if len(rows) > 0 else np.zeros(0, dtype=np.int64)
+
+    profiler.count('nodes_visited', len(rows))
+    profiler.count('revisits_avoided', revisits)
+    profiler.count('generations', d)
+
+    return rows
+
+
+def frontier_descendants(inds, store, depth=None, d=0, by=None):
+    '''
+    Find the rows of all descendants of multiple individuals in a `GenStore`.
+
+    The descendants are found one generation at a time, as in `frontier_genealogy`, but the next
+    generation is obtained from the children of the frontier, using the index from parents to
+    children of the store (see `GenStore.child_index`). Each descendant is reached at the
+    smallest generational depth of any path from the input individuals.
+
+    The cut-offs mirror those of `frontier_genealogy`: `depth` is the number of generations
+    below the input individuals, and `by` is the maximum allowed birth year of a descendant.
+    Individuals born after `by` are excluded together with their descendants (that are not
+    reached through other paths). Individuals with unknown (NaN) birth year are always allowed.
+
+    Example:
+        store = csv2dict('path/to/genealogy.csv', cache=True)
+        rows = frontier_descendants([4], store, depth=5, by=2000)
+        inds = store.ind[rows]
+
+    Input:
+        inds:       List of integer, IDs of individuals.
+        store:      `GenStore`, genealogy object.
+        depth:      Integer, total generational depth allowed [`None`].
+        d:          Integer, generational depth of the individuals in `inds` [0].
+        by:         Integer, maximum allowed birth year of descendant [`None`].
+
+    Returns:
+    Array of integer, rows of the individuals and their descendants, one generation at a time.
+    '''
+
+    child_ptr, children = store.child_index()
+
+    # Mask of individuals allowed by the birth year cut-off.
+    allowed = ~(store.birth_year > by) if by is not None else None
+
+    return _frontier_search(inds, store, lambda frontier: gather_children(child_ptr, children, frontier),
+            allowed, depth, d)
+
+
+def descendants(inds, gen, lin, depth=None, d=0, by=None):
+    '''
+    Generate the descendants of multiple individuals based on complete genealogy available.
+
+    This is the downward counterpart of `genealogy`: the individuals and all their descendants
+    are added to `lin`, one generation at a time (see `frontier_descendants`). Note that the
+    parents of a descendant are not necessarily in `lin` (e.g. spouses of descendants).
 
+    Example:
+        store = csv2dict('path/to/genealogy.csv', cache=True)
+        desc = descendants([4], store, dict())
+        desc2 = descendants([4], store, dict(), depth=3, by=1950)
+
+    Input:
+        inds:       List of integer, IDs of individuals.
+        gen:        `GenStore`, genealogy object.
+        lin:        Dictionary, set to empty dictionary (`dict()`).
+        depth:      Integer, total generational depth allowed [`None`].
+        d:          Integer, generational depth of the individuals in `inds` [0].
+        by:         Integer, maximum allowed birth year of descendant [`None`].
+
+    Returns:
+    Dictionary, the individuals and their descendants.
+    '''
+    assert isinstance(gen, GenStore), 'Descendants require a GenStore genealogy.'
+    rows = frontier_descendants(inds, gen, depth=depth, d=d, by=by)
+    for ind, rec in zip(gen.ind[rows].tolist(), gen.records(rows)):
+        lin[ind] = rec
     return lin
 
 
-def genealogy(inds, gen, lin, depth=None, d=0, by=None):
+def genealogy(inds, gen, lin, depth=None, d=0, by=None, batch=False):
     '''
     Generate lineages of multiple individuals based on complete genealogy available.
 
-    This method calls the `lineage` method, which generates the lineage of a single
-    individual. See `lineage` for more details. The genealogy is generated iteratively
-    one individual at a time, adding each lineage to the previous. The `lineage` method
-    checks whether an individual is already added to the lineage, avoiding unnecessary
-    CPU usage and memory overhead.
+    The genealogy is generated one individual at a time, adding each lineage to the previous,
+    in the same way as `lineage`. See `lineage` for more details. Ancestors shared between
+    individuals are only traversed again if they are reached at a smaller generational depth,
+    avoiding unnecessary CPU usage and memory overhead.
+
+    If `batch` is True, `gen` must be a `GenStore`, and the ancestors of all individuals are
+    found together, one generation at a time, see `frontier_genealogy`. This is much faster
+    for many individuals. The resulting individuals are the same, but they are added to `lin`
+    one generation at a time rather than one lineage at a time.
 
     The `depth` parameter specifies the depth of the individual lineages, and does not
     give any guarantees about the total generational depth of the complete genealogy.
 
     Example:
-        gen2 = genealogy(1, gen, dict())
-        gen3 = genealogy(1, gen, dict(), depth=5, by=1800)
+        gen2 = genealogy([1], gen, dict())
+        gen3 = genealogy([1], gen, dict(), depth=5, by=1800)
+        gen4 = genealogy([1, 2, 3], store, dict(), batch=True)
 
     Input:
         inds:       List of integer, IDs of individuals.
-        gen:        Dictionary, genealogy object.
+        gen:        Dictionary or `GenStore`, genealogy object.
         lin:        Dictionary, set to empty dictionary (`dict()`).
         depth:      Integer, total generational depth allowed [`None`].
-        d:          Integer, current generational depth, do not change [0].
+        d:          Integer, generational depth of the individuals in `inds` [0].
         by:         Integer, minimum allowed birth year of ancestor [`None`].
+        batch:      Boolean, expand all individuals together [False].
 
     Returns:
     Dictionary, genealogy of individuals.
     '''
 
-    for ind in inds:
-        lin = lineage(ind, gen, lin, depth, d, by)
+    if batch:
+        assert isinstance(gen, GenStore), 'Batch mode requires a GenStore genealogy.'
+        rows = frontier_genealogy(inds, gen, depth=depth, d=d, by=by)
+        for ind, rec in zip(gen.ind[rows].tolist(), gen.records(rows)):
+            lin[ind] = rec
+        return lin
 
-    return lin
+    return _ancestors(inds, gen, lin, depth=depth, d=d, by=by)
 
 
 def sim_gen(ind, gen, d, dmax, sex):
@@ -150,7 +1021,7 @@ def sim_gen(ind, gen, d, dmax, sex):
 
     while fa in gen:
         fa = np.random.randint(1, 1000000)
-    while fa in gen:
+    while mo in gen:
         mo = np.random.randint(1, 1000000)
 
     gen[ind] = Record(fa, mo, sex, None, None)
@@ -162,10 +1033,12 @@ def sim_gen(ind, gen, d, dmax, sex):
 
 
 class Gen(object):
-    def __init__(self, csv, inds, depth=None, by=None):
+    def __init__(self, csv, inds, depth=None, by=None, batch=False, cache=True, mmap=False, direction='up',
+            validate=False):
         '''
         Construct a genealogy object of specified individuals, taking ancestors from
-        supplied CSV file.
+        supplied CSV file. With `direction='down'`, descendants are taken instead of ancestors
+        (see `descendants`).
 
         Examples:
             # Construct a genealogy of three specific individuals from CSV file.
@@ -184,66 +1057,326 @@ class Gen(object):
             # Write genealogy to CSV.
             gen.write_csv('small_genealogy.csv')
 
+            # All descendants of an individual born in 1950 or earlier.
+            gen = Gen('path/to/genealogy.csv', [4], by=1950, direction='down')
+
         Input:
-            csv:        String, path to Gedcom ([filename].ged) file, produced by `ged2csv.py`.
+            csv:        String, path to Gedcom ([filename].ged) file, produced by `ged2csv.py`,
+                        or a `GenStore` that has already been read (e.g. to reconstruct many
+                        genealogies from one registry, see `run_manifest`).
             inds:       List of integer, IDs of individuals.
             depth:      Integer, total generational depth allowed [`None`].
-            by:         Integer, minimum allowed birth year of ancestor [`None`].
+            by:         Integer, minimum allowed birth year of ancestor, or maximum allowed
+                        birth year of descendant with `direction='down'` [`None`].
+            batch:      Boolean, expand all individuals together, see `genealogy` [False].
+            cache:      Boolean, use a binary cache of the CSV, see `csv2dict` [True].
+            mmap:       Boolean, memory-map the binary cache of the CSV, see `csv2dict` [False].
+            direction:  String, 'up' for ancestors or 'down' for descendants ['up'].
+            validate:   Boolean, check the genealogy for errors, see `csv2dict` [False].
         '''
-
-        # Read genealogy into a dictionary of individual objects.
-        # This dictionary includes all individuals in input genealogy.
-        dd = csv2dict(csv)
-
-        # Reconstruct genealogy of input individuals.
-        self.gen = genealogy(inds, dd, dict(), depth=depth, by=by)
+        assert direction in ('up', 'down'), 'Direction must be "up" or "down".'
+
+        with profiler.stage('gen'):
+            # Read genealogy into a columnar genealogy store, unless it has already been read.
+            # This store includes all individuals in input genealogy.
+            if isinstance(csv, GenStore):
+                dd = csv
+                if validate:
+                    _check_store(dd)
+            else:
+                dd = csv2dict(csv, cache=cache, mmap=mmap, validate=validate)
+
+            # Reconstruct genealogy of input individuals.
+            with profiler.stage('genealogy'):
+                if direction == 'down':
+                    self.gen = descendants(inds, dd, dict(), depth=depth, by=by)
+                else:
+                    self.gen = genealogy(inds, dd, dict(), depth=depth, by=by, batch=batch)
+                profiler.count('probands', len(inds))
+                profiler.count('individuals', len(self.gen))
+
+        # Without cut-offs, the genealogy contains all ancestors of its individuals, so ancestry
+        # queries can use the ancestor index of the whole genealogy, stored in its binary cache
+        # (see `ancestor_index`).
+        self._store_path = dd.path if direction == 'up' and depth is None and by is None else None
 
         # The genealogy which gen is created from is no longer needed.
         del dd
 
         self.individuals = list(self.gen.keys())
 
+        # Individuals the genealogy was reconstructed from.
+        self.probands = list(inds)
+
+        # Index of ancestors, constructed when it is first needed (see `ancestor_index`).
+        self._ancestor_index = None
 
     def get(self, ind):
         return self.gen.get(ind)
 
-    def write_csv(self, path):
-        '''Write genealogy to a CSV file.'''
-        with open(path, 'w') as fid:
-            fid.write('ind,father,mother,sex,birth_place,birth_year\n')
-            for ind in self.gen.keys():
-                rec = self.get(ind)
-                fid.write('%d,%d,%d,%s,"%s",%s\n' %(ind, rec.fa, rec.mo, rec.sex, rec.birth_place, rec.birth_year))
+    def ancestor_index(self):
+        '''
+        Get the `AncestorIndex` of the genealogy the first time it is used.
+
+        If the genealogy was reconstructed without cut-offs from a CSV with a binary cache, the
+        index of the whole genealogy is read from the cache, or constructed and stored there
+        (see `load_ancestor_index`), so that it is only constructed once for all `Gen` objects.
+        Otherwise, the index of this genealogy is constructed.
+        '''
+        if self._ancestor_index is None:
+            if self._store_path is not None:
+                try:
+                    self._ancestor_index = load_ancestor_index(GenStore.load(self._store_path, 'r'))
+                except ValueError:
+                    # The whole genealogy contains a cycle, which may not affect this genealogy.
+                    self._store_path = None
+            if self._ancestor_index is None:
+                self._ancestor_index = AncestorIndex.build(self.gen)
+        return self._ancestor_index
+
+    def _check_individuals(self, *inds):
+        for ind in inds:
+            assert ind in self.gen, 'Individual %d does not exist in genealogy.' % ind
+
+    def is_ancestor(self, anc, ind):
+        '''Check whether individual `anc` is an ancestor of individual `ind`.'''
+        self._check_individuals(anc, ind)
+        return self.ancestor_index().is_ancestor(anc, ind)
+
+    def common_ancestors(self, ind1, ind2):
+        '''Get a list of the ancestors that two individuals share.'''
+        self._check_individuals(ind1, ind2)
+        return self.ancestor_index().common_ancestors(ind1, ind2)
+
+    def mrca(self, ind1, ind2):
+        '''Get a list of the most recent common ancestors of two individuals, see `AncestorIndex.mrca`.'''
+        self._check_individuals(ind1, ind2)
+        return self.ancestor_index().mrca(ind1, ind2)
+
+    def prune(self):
+        '''
+        Get a copy of the genealogy with only the probands and the individuals on paths linking
+        two or more probands (see `utils.connecting_pedigree`).
+
+        Parents that are removed are set to 0 in the records of their children, so the pruned
+        genealogy is a complete pedigree, which can be written with `write_csv`.
+
+        Example:
+            gen = Gen('path/to/genealogy.csv', [1, 2, 3])
+            pruned = gen.prune()
+            pruned.write_csv('pruned_genealogy.csv')
+
+        Returns:
+        `Gen` object.
+        '''
+        with profiler.stage('prune'):
+            # Rows of the individuals are in the order of the genealogy (see `parent_arrays`).
+            inds, fa, mo = parent_arrays(self.gen)
+            pos = {ind: row for row, ind in enumerate(self.gen.keys())}
+            # Rows of the probands that are in the genealogy (a cut-off can exclude a proband).
+            rows = np.array([pos[ind] for ind in self.probands if ind in pos], dtype=np.int64)
+            keep = connecting_pedigree(fa, mo, rows)
+
+            kept = set(inds[keep].tolist())
+            gen = dict()
+            for ind in inds[keep].tolist():
+                rec = self.gen.get(ind)
+                gen[ind] = Record(rec.fa if rec.fa in kept else 0, rec.mo if rec.mo in kept else 0,
+                        rec.sex, rec.birth_year, rec.birth_place)
+            profiler.count('individuals', len(gen))
+            profiler.count('removed', len(inds) - len(gen))
+
+        pruned = copy.copy(self)
+        pruned.gen = gen
+        pruned.individuals = list(gen.keys())
+        pruned._ancestor_index = None
+        pruned._store_path = None
+
+        return pruned
+
+    def write_csv(self, path, compression='infer', order=None):
+        '''
+        Write genealogy to a CSV file, or a Parquet or Feather file depending on the extension of
+        `path`. With `order="topological"`, founders are written first, and every parent before
+        its children. See `write_genealogy`.
+        '''
+        with profiler.stage('write_csv'):
+            write_genealogy(self.gen, path, compression=compression, order=order)
+            profiler.count('individuals', len(self.gen))
+
+def read_individuals(path):
+    '''Read a text file with one RIN per line.'''
+    with open(path) as fid:
+        return [int(line.strip()) for line in fid if line.strip()]
+
+
+def read_manifest(path, batch=False):
+    '''
+    Read a manifest of cohorts, see `run_manifest`. `batch` is the default of the batch column.
+
+    Returns:
+    List of dictionaries, one per cohort, with the keys ind, out, depth, by, batch, direction,
+    prune and order.
+    '''
+    df = pd.read_csv(path, dtype=str, keep_default_na=False)
+    missing = {'ind', 'out'} - set(df.columns)
+    assert not missing, 'Manifest %s has no column(s): %s.' % (path, ', '.join(sorted(missing)))
+
+    def optional(row, name, convert, default=None):
+        value = row.get(name, '').strip()
+        return convert(value) if value else default
+
+    def boolean(value):
+        return value.lower() in ('1', 'true', 'yes')
+
+    cohorts = list()
+    for row in df.to_dict('records'):
+        cohorts.append({'ind': row['ind'].strip(), 'out': row['out'].strip(),
+            'depth': optional(row, 'd_thres', int), 'by': optional(row, 'by_thres', int),
+            'batch': optional(row, 'batch', boolean, batch), 'direction': optional(row, 'direction', str, 'up'),
+            'prune': optional(row, 'prune', boolean, False), 'order': optional(row, 'order', str)})
+        assert cohorts[-1]['direction'] in ('up', 'down'), 'Direction must be "up" or "down".'
+        assert cohorts[-1]['order'] in (None, 'topological'), 'Order must be empty or "topological".'
+
+    return cohorts
+
+
+# Genealogy store shared by the workers of `run_manifest`.
+_manifest_store = None
+
+
+def _init_manifest_worker(store):
+    global _manifest_store
+    _manifest_store = store
+
+
+def _run_cohort(cohort):
+    '''Reconstruct and write the genealogy of a cohort, see `run_manifest`. Returns the cohort with results.'''
+    start = time.perf_counter()
+
+    inds = read_individuals(cohort['ind'])
+    gen = Gen(_manifest_store, inds, depth=cohort['depth'], by=cohort['by'], batch=cohort['batch'],
+            direction=cohort['direction'])
+    if cohort['prune']:
+        gen = gen.prune()
+    gen.write_csv(cohort['out'], order=cohort['order'])
+
+    result = dict(cohort)
+    result['individuals'] = len(gen.individuals)
+    result['seconds'] = time.perf_counter() - start
+    return result
+
+
+def run_manifest(csv, manifest, workers=1, cache=True, batch=False):
+    '''
+    Reconstruct the genealogies of many cohorts from one genealogy CSV, reading the CSV once.
+
+    The manifest is a CSV with one line per cohort, and the columns ind (path to a text file with
+    the RIN of the individuals), out (path to write the genealogy to, see `Gen.write_csv`), and
+    optionally d_thres, by_thres, batch ("true" or "false", see `Gen`), direction ("up" or "down"),
+    prune ("true" to prune the genealogy, see `Gen.prune`) and order ("topological" to write
+    parents before children, see `Gen.write_csv`). Empty values are the defaults.
+    Relative paths are relative to the working directory.
+
+    The genealogy is read once, and the cohorts are processed by `workers` processes, which share
+    the genealogy: with `cache`, the binary cache is memory-mapped (see `csv2dict`), so all
+    workers use the same pages. Each genealogy is written as soon as it is reconstructed, so the
+    total time is close to one read of the CSV and one traversal per cohort, divided between the
+    workers.
+
+    Example:
+        for result in run_manifest('genealogy.csv', 'cohorts.csv', workers=4):
+            print(result['out'], result['individuals'])
+
+    Input:
+        csv:        String, path to genealogy CSV.
+        manifest:   String, path to manifest CSV.
+        workers:    Integer, number of processes [1].
+        cache:      Boolean, use a binary cache of the CSV, see `csv2dict` [True].
+        batch:      Boolean, default of the batch column of the manifest [False].
+
+    Returns:
+    Generator of dictionaries, one per cohort in the order they finish, with the fields of the
+    cohort (see `read_manifest`), the number of individuals and the time it took in seconds.
+    '''
+    cohorts = read_manifest(manifest, batch=batch)
+    store = csv2dict(csv, cache=cache, mmap=cache)
+
+    if workers <= 1:
+        _init_manifest_worker(store)
+        for cohort in cohorts:
+            yield _run_cohort(cohort)
+        return
+
+    with Pool(workers, initializer=_init_manifest_worker, initargs=(store,)) as pool:
+        for result in pool.imap_unordered(_run_cohort, cohorts):
+            yield result
+
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
 
     # Arguments for parser.
     parser.add_argument('--csv', type=str, required=True)
-    parser.add_argument('--ind', type=str, required=True)
-    parser.add_argument('--out', type=str, required=True)
+    parser.add_argument('--ind', type=str)
+    parser.add_argument('--out', type=str)
+    parser.add_argument('--manifest', type=str, help='CSV with a cohort on each line, instead of --ind and --out.')
+    parser.add_argument('--workers', type=int, default=1, help='Number of processes to process the cohorts of --manifest with.')
     parser.add_argument('--by_thres', type=int)
     parser.add_argument('--d_thres', type=int)
+    parser.add_argument('--batch', action='store_true', help='Expand all individuals together, one generation at a time.')
+    parser.add_argument('--no_cache', action='store_true', help='Do not use a binary cache of the CSV.')
+    parser.add_argument('--direction', type=str, default='up', choices=('up', 'down'),
+            help='Reconstruct ancestors (up) or descendants (down) of the individuals.')
+    parser.add_argument('--prune', action='store_true',
+            help='Only keep the individuals on paths linking two or more of the individuals.')
+    parser.add_argument('--order', type=str, choices=('topological',),
+            help='Write the genealogy in generation order, with every parent before its children.')
+    parser.add_argument('--validate', action='store_true', help='Check the genealogy for errors before reconstructing.')
+    parser.add_argument('--profile', action='store_true', help='Report time and memory of each stage.')
+    parser.add_argument('--profile_json', type=str, help='Path to write time and memory of each stage to, as JSON.')
 
     # Parse input arguments.
     args = parser.parse_args()
 
+    if args.profile_json is not None:
+        profiler.configure(args.profile_json)
+    elif args.profile:
+        profiler.configure('1')
+
+    if args.manifest is not None:
+        assert args.ind is None and args.out is None, '--ind and --out cannot be used with --manifest.'
+        for result in run_manifest(args.csv, args.manifest, workers=args.workers, cache=not args.no_cache,
+                batch=args.batch):
+            print('Wrote %s (%d individuals, %.2f s).' % (result['out'], result['individuals'], result['seconds']))
+            sys.stdout.flush()
+        profiler.finish()
+        sys.exit()
+
+    assert args.ind is not None and args.out is not None, '--ind and --out are required without --manifest.'
+
     csv_path = args.csv
     ind_path = args.ind
     out_path = args.out
     birth_year = args.by_thres
     depth = args.d_thres
+    batch = args.batch
+    cache = not args.no_cache
 
     # Read lines in individual list.
-    ind = open(ind_path).readlines()
-    # Remove whitespace.
-    ind = [int(i.strip()) for i in ind]
+    ind = read_individuals(ind_path)
 
     # Construct a genealogy of three specific individuals from CSV file.
-    gen = Gen(csv_path, ind, depth=depth, by=birth_year)
+    gen = Gen(csv_path, ind, depth=depth, by=birth_year, batch=batch, cache=cache, direction=args.direction,
+            validate=args.validate)
+
+    if args.prune:
+        gen = gen.prune()
 
     # Write genealogy to CSV.
-    gen.write_csv(out_path)
+    gen.write_csv(out_path, order=args.order)
+
+    profiler.finish()
 
 
 
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+'''
+Query a genealogy server (see `lineages_server.py`), with the same arguments as `lineages.py`.
+
+The client only uses the Python standard library, so it starts quickly, and the genealogy is
+already in the memory of the server. The result is written to the output file, in the same
+format as `lineages.py`.
+
+Usage:
+    python lineages_client.py --socket [socket path] --ind [individuals] --out [output]
+    python lineages_client.py --port [port] --ind [individuals] --out [output] --direction down
+    python lineages_client.py --socket [socket path] --ind [individuals] --out [output] --query depth
+
+Input:
+    Individuals:      Text file with RIN of individuals to reconstruct.
+    Output:           Filename to write resulting CSV to.
+'''
+
+import http.client
+import argparse, json, socket, sys
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    '''HTTP connection over a Unix socket.'''
+    def __init__(self, path, timeout=None):
+        super(UnixHTTPConnection, self).__init__('localhost', timeout=timeout)
+        self.socket_path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.timeout is not None:
+            self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+def query(name, params, socket_path=None, port=None, timeout=None):
+    '''
+    Send a query to a genealogy server, see `lineages_server.py`.
+
+    Input:
+        name:           String, "genealogy", "descendants" or "depth".
+        params:         Dictionary with inds, and optionally depth, by and batch.
+        socket_path:    String, path of the Unix socket of the server [None].
+        port:           Integer, port of the server on localhost [None].
+        timeout:        Float, seconds to wait for the server [None].
+
+    Returns:
+    String, CSV.
+    '''
+    assert (socket_path is None) != (port is None), 'Give either a socket path or a port.'
+    if socket_path is not None:
+        conn = UnixHTTPConnection(socket_path, timeout=timeout)
+    else:
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=timeout)
+
+    try:
+        conn.request('POST', '/' + name, body=json.dumps(params), headers={'Content-Type': 'application/json'})
+        response = conn.getresponse()
+        content = response.read().decode('utf-8')
+    finally:
+        conn.close()
+
+    if response.status != 200:
+        raise RuntimeError('Query failed (%d %s): %s' % (response.status, response.reason, content.strip()))
+
+    return content
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+
+    # Arguments for parser.
+    parser.add_argument('--ind', type=str, required=True)
+    parser.add_argument('--out', type=str, required=True)
+    parser.add_argument('--by_thres', type=int)
+    parser.add_argument('--d_thres', type=int)
+    parser.add_argument('--batch', action='store_true', help='Expand all individuals together, one generation at a time.')
+    parser.add_argument('--direction', type=str, default='up', choices=('up', 'down'),
+            help='Reconstruct ancestors (up) or descendants (down) of the individuals.')
+    parser.add_argument('--query', type=str, default='genealogy', choices=('genealogy', 'depth'),
+            help='Write the genealogy, or the generational depth of each individual.')
+    parser.add_argument('--socket', type=str, help='Path of Unix socket of the server.')
+    parser.add_argument('--port', type=int, help='Port of the server on localhost.')
+
+    # Parse input arguments.
+    args = parser.parse_args()
+
+    assert (args.socket is None) != (args.port is None), 'Give either --socket or --port.'
+    assert args.query == 'genealogy' or args.direction == 'up', '--query depth only works with --direction up.'
+
+    # Read lines in individual list, and remove whitespace.
+    with open(args.ind) as fid:
+        ind = [int(line.strip()) for line in fid if line.strip()]
+
+    name = 'descendants' if args.direction == 'down' else args.query
+    params = {'inds': ind, 'depth': args.d_thres, 'by': args.by_thres, 'batch': args.batch}
+
+    try:
+        content = query(name, params, socket_path=args.socket, port=args.port)
+    except (RuntimeError, OSError) as err:
+        sys.exit('Error: %s' % err)
+
+    with open(args.out, 'w', newline='') as fid:
+        fid.write(content)
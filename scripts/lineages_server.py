@@ -0,0 +1,254 @@
+#!/usr/bin/env python
+'''
+Serve genealogy queries from a genealogy that is read once and kept in memory.
+
+Reading the CSV (and importing pandas) takes much longer than reconstructing the genealogy of a
+list of individuals. This server reads the genealogy once (see `csv2dict`), and answers queries
+from `lineages_client.py` (or any HTTP client) over a Unix socket or localhost TCP. Clients are
+handled concurrently with asyncio, and the queries are computed in a thread pool, so that the
+server keeps accepting connections while a query runs. The CSV is checked for changes every few
+seconds, and when it has changed, the genealogy is read again in the background, while the
+queries are answered from the previous version.
+
+The protocol is HTTP. Queries are POST requests with a JSON body with the fields inds (list of
+RIN), depth, by and batch (see `Gen`), and the response is CSV:
+
+    POST /genealogy     Genealogy of the individuals (ancestors), as written by `lineages.py`.
+    POST /descendants   The individuals and their descendants, see `descendants`.
+    POST /depth         CSV with the columns ind and depth, the generational depth of each
+                        individual (see `utils.calc_depth`), within the depth and by cut-offs.
+    GET /status         JSON with the path of the CSV, the number of individuals and the time
+                        the genealogy was read.
+
+Usage:
+    python lineages_server.py --csv [CSV] --socket [socket path]
+    python lineages_server.py --csv [CSV] --port [port]
+
+Example:
+    python lineages_server.py --csv genealogy.csv --socket /tmp/aebs.sock &
+    python lineages_client.py --socket /tmp/aebs.sock --ind individuals.txt --out genealogy_out.csv
+    curl --unix-socket /tmp/aebs.sock -d '{"inds": [1, 2]}' http://localhost/depth
+'''
+
+from lineages import csv2dict, genealogy, descendants, write_genealogy_csv
+from utils import calc_depth, calc_depths
+import asyncio
+import argparse, io, json, os, signal, sys, time, traceback, warnings
+
+# Reason phrases of the HTTP status codes used by the server.
+STATUS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 500: 'Internal Server Error'}
+
+
+def file_signature(path):
+    '''Size and modification time of a file, which change when the file is written.'''
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+class GenServer(object):
+    def __init__(self, csv, poll=5.0, mmap=False):
+        '''
+        Serve genealogy queries from the genealogy in a CSV file, see top of file.
+
+        Example:
+            server = GenServer('path/to/genealogy.csv')
+            server.load()
+            csv_text = server.query('genealogy', {'inds': [1, 2, 3]})
+
+        Input:
+            csv:        String, path to genealogy CSV.
+            poll:       Float, seconds between checks of whether the CSV has changed [5].
+            mmap:       Boolean, memory-map the binary cache of the CSV, see `csv2dict` [False].
+        '''
+        self.csv = csv
+        self.poll = poll
+        self.mmap = mmap
+
+        # Genealogy store, the signature of the CSV it was read from, and when it was read.
+        self.store = None
+        self.signature = None
+        self.loaded = None
+
+    def load(self):
+        '''Read the genealogy from the CSV (or its binary cache).'''
+        signature = file_signature(self.csv)
+        store = csv2dict(self.csv, cache=True, mmap=self.mmap)
+        self.store, self.signature, self.loaded = store, signature, time.time()
+
+    def query(self, name, params):
+        '''
+        Answer a query, see top of file.
+
+        Input:
+            name:       String, "genealogy", "descendants" or "depth".
+            params:     Dictionary with inds, and optionally depth, by and batch.
+
+        Returns:
+        String, CSV.
+        '''
+        # Keep a reference to the store, so a reload during the query does not affect it.
+        store = self.store
+
+        inds = [int(ind) for ind in params['inds']]
+        depth = params.get('depth')
+        by = params.get('by')
+
+        if name == 'descendants':
+            lin = descendants(inds, store, dict(), depth=depth, by=by)
+        elif name == 'depth' and depth is None and by is None:
+            lin = None
+        else:
+            lin = genealogy(inds, store, dict(), depth=depth, by=by, batch=bool(params.get('batch')))
+
+        out = io.StringIO(newline='')
+        if name == 'depth':
+            # Without cut-offs, the depths are looked up in the whole genealogy.
+            if lin is None:
+                depths = [calc_depth(ind, store) for ind in inds]
+            else:
+                rins, table = calc_depths(lin)
+                table = dict(zip(rins.tolist(), table.tolist()))
+                depths = [table[ind] for ind in inds]
+                for ind, d in zip(inds, depths):
+                    if d < 0:
+                        raise ValueError('Individual %d is its own ancestor, or descends from one.' % ind)
+            out.write('ind,depth\n')
+            out.write(''.join('%d,%d\n' % (ind, d) for ind, d in zip(inds, depths)))
+        else:
+            write_genealogy_csv(lin, out)
+
+        return out.getvalue()
+
+    def status(self):
+        '''Dictionary with the path of the CSV, the number of individuals and the time it was read.'''
+        return {'csv': self.csv, 'individuals': len(self.store),
+                'loaded': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.loaded))}
+
+    async def watch(self):
+        '''Read the genealogy again whenever the CSV changes, checking every `poll` seconds.'''
+        loop = asyncio.get_event_loop()
+        while True:
+            await asyncio.sleep(self.poll)
+            try:
+                changed = file_signature(self.csv) != self.signature
+            except OSError:
+                # The CSV is being replaced.
+                continue
+            if changed:
+                try:
+                    await loop.run_in_executor(None, self.load)
+                    sys.stderr.write('Reloaded %s (%d individuals).\n' % (self.csv, len(self.store)))
+                except Exception as err:
+                    warnings.warn('Could not reload %s, keeping the previous genealogy: %s' % (self.csv, err), Warning)
+
+    async def handle(self, reader, writer):
+        '''Handle a single HTTP request.'''
+        try:
+            request = (await reader.readline()).decode('latin-1').split()
+            headers = dict()
+            while True:
+                line = (await reader.readline()).decode('latin-1').strip()
+                if not line:
+                    break
+                key, _, value = line.partition(':')
+                headers[key.strip().lower()] = value.strip()
+            try:
+                length = int(headers.get('content-length', 0))
+                assert length >= 0
+            except (ValueError, AssertionError):
+                code, content_type, content = 400, 'text/plain', 'Malformed Content-Length header.\n'
+            else:
+                body = await reader.readexactly(length)
+                code, content_type, content = await self.respond(request, body)
+
+            content = content.encode('utf-8')
+            writer.write(('HTTP/1.1 %d %s\r\nContent-Type: %s; charset=utf-8\r\nContent-Length: %d\r\n'
+                'Connection: close\r\n\r\n' % (code, STATUS[code], content_type, len(content))).encode('latin-1'))
+            writer.write(content)
+            await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def respond(self, request, body):
+        '''
+        Answer an HTTP request, given as the words of its request line and its body.
+
+        Returns:
+        Tuple (status code, content type, content).
+        '''
+        if len(request) < 2:
+            return 400, 'text/plain', 'Malformed request.\n'
+        method, target = request[:2]
+        name = target.strip('/')
+
+        if method == 'GET' and name == 'status':
+            return 200, 'application/json', json.dumps(self.status())
+        if method != 'POST' or name not in ('genealogy', 'descendants', 'depth'):
+            return 404, 'text/plain', 'Unknown query %s %s.\n' % (method, target)
+
+        try:
+            params = json.loads(body.decode('utf-8'))
+            assert 'inds' in params, 'The query has no individuals (inds).'
+        except (ValueError, AssertionError) as err:
+            return 400, 'text/plain', 'Malformed query: %s\n' % err
+
+        loop = asyncio.get_event_loop()
+        try:
+            content = await loop.run_in_executor(None, self.query, name, params)
+        except (AssertionError, KeyError, ValueError, TypeError) as err:
+            return 400, 'text/plain', '%s\n' % err
+        except Exception:
+            traceback.print_exc()
+            return 500, 'text/plain', 'Internal error, see the log of the server.\n'
+
+        return 200, 'text/csv', content
+
+    def serve(self, socket_path=None, port=None):
+        '''Read the genealogy and serve queries on a Unix socket or a localhost port until interrupted or terminated.'''
+        assert (socket_path is None) != (port is None), 'Give either a socket path or a port.'
+
+        self.load()
+
+        loop = asyncio.get_event_loop()
+        if socket_path is not None:
+            if os.path.exists(socket_path):
+                os.remove(socket_path)
+            server = loop.run_until_complete(asyncio.start_unix_server(self.handle, path=socket_path))
+            address = socket_path
+        else:
+            server = loop.run_until_complete(asyncio.start_server(self.handle, host='127.0.0.1', port=port))
+            address = 'http://127.0.0.1:%d' % port
+        watcher = loop.create_task(self.watch())
+        loop.add_signal_handler(signal.SIGTERM, loop.stop)
+
+        sys.stderr.write('Serving %s (%d individuals) on %s.\n' % (self.csv, len(self.store), address))
+        try:
+            loop.run_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            watcher.cancel()
+            server.close()
+            loop.run_until_complete(server.wait_closed())
+            if socket_path is not None and os.path.exists(socket_path):
+                os.remove(socket_path)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+
+    # Arguments for parser.
+    parser.add_argument('--csv', type=str, required=True, help='Path to genealogy CSV.')
+    parser.add_argument('--socket', type=str, help='Path of Unix socket to serve on.')
+    parser.add_argument('--port', type=int, help='Port on localhost to serve on.')
+    parser.add_argument('--poll', type=float, default=5.0, help='Seconds between checks of whether the CSV has changed.')
+    parser.add_argument('--mmap', action='store_true', help='Memory-map the binary cache of the CSV.')
+
+    # Parse input arguments.
+    args = parser.parse_args()
+
+    assert (args.socket is None) != (args.port is None), 'Give either --socket or --port.'
+
+    GenServer(args.csv, poll=args.poll, mmap=args.mmap).serve(socket_path=args.socket, port=args.port)
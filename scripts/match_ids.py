@@ -3,138 +3,198 @@
 # Takes two CSV files and matches the IDs in the second column, and writes a CSV with the first columns.
 # Use this script to match P-numbers in Progeny with "REFN" numbers in AEBS.
 #
+# The REFN of the AEBS records are normalized to the format of P-numbers, and stored in an index
+# next to the REFN CSV ([csv 2].index). The index is only rebuilt when the REFN CSV changes, and
+# the samples are matched with the index in a single join.
+#
 # Usage:
 # python match_ids.py [csv 1] [csv 2] [csv out] [txt out]
+# python match_ids.py --rejects [rejects out] [csv 1] [csv 2] [csv out] [txt out]
 #
 # Input:
 # csv 1         CSV with two columns: sample ID and P-number from Progeny.
-# csv 2         CSV with two columns: RIN and REFN from AEBS.
+# csv 2         CSV with two columns: RIN and REFN from AEBS (e.g. from `ged2csv.py --refn-csv`).
 #
 # Output:
 # csv out       CSV with sample ID (csv 1) and RIN (csv 2) where P-number (csv 1) and REFN (csv 2) match.
 # txt out       Text file with only the RIN in the CSV file.
+# rejects out   CSV with the samples that could not be matched, with the columns sample, pnum and
+#               reason [csv out with extension ".rejects.csv"].
+#
+# A summary of the number of discarded REFN and unmatched samples is printed.
 
-import sys, warnings
+from lineages import csv_signature, read_cache_meta, write_cache_dir
+import pandas as pd
+import numpy as np
+import argparse, os, warnings
 
-assert len(sys.argv) > 2, 'To few arguments to "match_ids.py", see documentation for details.'
+# Version of the format of the REFN index.
+INDEX_VERSION = 1
 
-csv1_path = sys.argv[1]  # CSV with sample IDs and P-numbers.
-csv2_path = sys.argv[2]  # CSV with RIN and REFN.
-csv_out = sys.argv[3]  # CSV to write RIN and sample IDs.
-txt_out = sys.argv[4]  # Text file with only RIN of samples.
 
-def csv2dict(csv):
+def read_ids(csv):
     '''
-    Read CSV file to a dictionary. Discards first line as header.
+    Read a CSV file with two columns of IDs. Discards first line as header.
+
+    Whitespace around the IDs is removed, and IDs in the first column must be unique.
 
     Input:
     csv:    CSV path.
 
     Output:
-    Dictionary.
+    Tuple of two arrays of strings, the two columns of the CSV.
+    '''
+    df = pd.read_csv(csv, dtype=str, keep_default_na=False, usecols=[0, 1])
+    names = np.array([name.strip() for name in df.iloc[:, 0]], dtype=str)
+    ids = np.array([idd.strip() for idd in df.iloc[:, 1]], dtype=str)
+
+    duplicated = pd.Index(names).duplicated()
+    assert not duplicated.any(), 'Error: row "%s" is a duplicate.' % names[duplicated][0]
+
+    return names, ids
+
+
+def normalize_pnum(pnum):
+    '''Discard hyphen in P-numbers (array of strings), so they have the format ddmmYYXXX.'''
+    return np.array([p.replace('-', '', 1) for p in pnum], dtype=str)
+
+
+def normalize_refn(refn):
+    '''
+    Reformat REFN (array of strings of length 11) so that they match P-numbers.
+
+    The format of REFN is YYYYmmddXXX (birth date and a three cipher ID), and the format of
+    P-numbers is ddmmYYXXX, using the two last digits of the year. The characters are
+    rearranged for all REFN at once, as columns of a character matrix.
+    '''
+    chars = np.ascontiguousarray(refn, dtype='U11').view('U1').reshape(-1, 11)
+    return np.ascontiguousarray(chars[:, [6, 7, 4, 5, 2, 3, 8, 9, 10]]).view('U9').ravel()
+
+
+def index_path(refn_csv):
+    '''Path of the REFN index of a CSV file with RIN and REFN.'''
+    return refn_csv + '.index'
+
+
+def build_index(refn_csv):
+    '''
+    Build the index of normalized REFN of a CSV file with RIN and REFN.
+
+    Records with no REFN, with REFN ending in "000", and with REFN that are not of length 11 are
+    discarded. If several records have the same normalized REFN, the last one is used.
+
+    Returns:
+    Tuple (index, counts):
+        index:      Dataframe with the columns pnum (normalized REFN, unique) and rin.
+        counts:     Dictionary, number of records discarded for each reason.
+    '''
+    rin, refn = read_ids(refn_csv)
+
+    length = np.char.str_len(refn)
+    empty = length == 0
+    zeros = ~empty & np.char.endswith(refn, '000')
+    malformed = ~empty & ~zeros & (length != 11)
+    keep = ~(empty | zeros | malformed)
+
+    pnum = normalize_refn(refn[keep])
+    duplicated = pd.Index(pnum).duplicated(keep='last')
+    index = pd.DataFrame({'pnum': pnum[~duplicated], 'rin': rin[keep][~duplicated]})
+
+    counts = {'no_refn': int(empty.sum()), 'refn_000': int(zeros.sum()), 'malformed': int(malformed.sum()),
+            'duplicated': int(duplicated.sum())}
+
+    return index, counts
+
+
+def load_index(refn_csv):
     '''
-    dd = dict()
-    with open(csv) as fid:
-        # Discard header.
-        tt = fid.readline()
-        # Read all lines.
-        for line in fid:
-            # Extract fields.
-            name, idd = line.strip().split(',')
-
-            # Remove any trailing whitespace from name and idd.
-            name = name.strip()
-            idd = idd.strip()
-
-            assert dd.get(name) is None, 'Error: row "%s" is a duplicate.' % name
-
-            # Add row to dictionary.
-            dd[name] = idd
-
-    return dd
-
-# Read both CSV files into dictionaries.
-progeny_ids = csv2dict(csv1_path)
-aebs_ids = csv2dict(csv2_path)
-
-# Discard hyphen in P-number.
-for sample, pnum in progeny_ids.items():
-    idx = pnum.find('-')
-    if idx > -1:
-        # Hyphen found. Remove it from string.
-        pnum = pnum[:idx] + pnum[idx+1:]
-
-    # Check formatting of ID.
-    #idd_len = len(idd)
-    #assert idd_len == 9: 'Error: ID %s is incorrectly formatted.' % idd
-    if len(pnum) != 9:
-        warnings.warn('P-number should be of length 9 (excluding hyphen). Ignoring record with P-number: %s' %pnum, Warning)
-
-    progeny_ids[sample] = pnum
-
-
-# Discard all records with no REFN.
-n_before = len(aebs_ids)
-for rin, refn in list(aebs_ids.items()):
-    if len(refn) == 0:
-        del aebs_ids[rin]
-
-n_after = len(aebs_ids)
-
-print('Records with no REFN discarded: %d' % (n_before - n_after))
-
-# Discard all records with REFN ending in 000.
-n_before = len(aebs_ids)
-for rin, refn in list(aebs_ids.items()):
-    if refn[-3:] == '000':
-        del aebs_ids[rin]
-
-n_after = len(aebs_ids)
-
-print('Records with REFN ending in "000" discarded: %d' % (n_before - n_after))
-
-# Reformat REFN so that it matches that of P-number. The correct format is:
-# ddmmYYXXX
-# REFN that cannot be parsed are discarded.
-refn_fail = 0
-aebs_rev = dict() ##FIXME
-for rin, refn in aebs_ids.items():
-    if len(refn) != 11:
-        warnings.warn('REFN should be of length 11. Ignoring record with REFN: %s' %refn, Warning)
-        refn_fail += 1
-
-    # Get birth date and three cipher ID from REFN.
-    yyyy = refn[:4]
-    mm = refn[4:6]
-    dd = refn[6:8]
-    XXX = refn[8:11]
-
-    # Use two last digits of date.
-    YY = yyyy[-2:]
-
-    # Format new ID, and replace the old one.
-    new_id = dd + mm + YY + XXX
-    aebs_rev[new_id] = rin
-
-warnings.warn('Number of records with problematic REFN discarded: %d' %refn_fail)
-
-# Write a file with RIN and sample IDs.
-csv_fid = open(csv_out, 'w')
-txt_fid = open(txt_out, 'w')
-# CSV file header.
-csv_fid.write('rin,sample\n')
-no_match = 0  # Number of samples with no matching AEBS record.
-for sample, pnum in progeny_ids.items():
-    if aebs_rev.get(pnum) is None:
-        warnings.warn('P-number %s could not be matched with AEBS.' %pnum, Warning)
-        no_match += 1
-        continue
-
-    # Get RIN corresponding to sample.
-    rin = aebs_rev[pnum]
-
-    csv_fid.write('%s,%s\n' %(rin, sample))
-    txt_fid.write(rin + '\n')
+    Get the index of normalized REFN of a CSV file with RIN and REFN (see `build_index`).
+
+    The index is stored next to the CSV (see `index_path`), and read from there if the CSV has
+    not changed since it was built. Otherwise, it is rebuilt and stored.
+
+    Returns:
+    Tuple (index, counts), see `build_index`.
+    '''
+    path = index_path(refn_csv)
+    meta = read_cache_meta(path, refn_csv, INDEX_VERSION)
+    if meta is not None:
+        index = pd.DataFrame({'pnum': np.load(os.path.join(path, 'pnum.npy')),
+            'rin': np.load(os.path.join(path, 'rin.npy'))})
+        return index, meta['counts']
+
+    index, counts = build_index(refn_csv)
+
+    meta = csv_signature(refn_csv)
+    meta['version'] = INDEX_VERSION
+    meta['counts'] = counts
+
+    try:
+        write_cache_dir(path, {'pnum': index.pnum.to_numpy(dtype=str), 'rin': index.rin.to_numpy(dtype=str)}, meta)
+    except OSError as err:
+        warnings.warn('Could not write REFN index %s: %s' % (path, err), Warning)
+
+    return index, counts
+
+
+def match_ids(progeny_csv, refn_csv, csv_out, txt_out, rejects_out):
+    '''
+    Match samples in Progeny with records in AEBS, by P-number and REFN. See top of file.
+
+    Returns:
+    Dictionary, summary of the number of records in each step.
+    '''
+    sample, pnum = read_ids(progeny_csv)
+    pnum = normalize_pnum(pnum)
+
+    index, counts = load_index(refn_csv)
+
+    # Match samples with AEBS in a single lookup, keeping the order of the samples.
+    rows = pd.Index(index.pnum.values).get_indexer(pnum)
+    found = rows >= 0
+    rin = index.rin.values[rows[found]]
+
+    pd.DataFrame({'rin': rin, 'sample': sample[found]}).to_csv(csv_out, index=None)
+    with open(txt_out, 'w') as fid:
+        fid.write(''.join(r + '\n' for r in rin))
+
+    # Samples that were not matched, and why.
+    rejects = pd.DataFrame({'sample': sample[~found], 'pnum': pnum[~found]})
+    rejects['reason'] = np.where(np.char.str_len(pnum[~found]) != 9, 'invalid P-number', 'no matching REFN')
+    rejects.to_csv(rejects_out, index=None)
+
+    summary = {'samples': len(sample), 'matched': int(found.sum())}
+    summary['invalid_pnum'] = int((rejects.reason == 'invalid P-number').sum())
+    summary['unmatched'] = len(rejects) - summary['invalid_pnum']
+    summary.update(counts)
+
+    return summary
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+
+    # Arguments for parser.
+    parser.add_argument('csv1', type=str, help='CSV with sample IDs and P-numbers.')
+    parser.add_argument('csv2', type=str, help='CSV with RIN and REFN.')
+    parser.add_argument('csv_out', type=str, help='CSV to write RIN and sample IDs.')
+    parser.add_argument('txt_out', type=str, help='Text file with only RIN of samples.')
+    parser.add_argument('--rejects', type=str, help='CSV to write samples that could not be matched.')
+
+    # Parse input arguments.
+    args = parser.parse_args()
+
+    rejects_out = args.rejects
+    if rejects_out is None:
+        rejects_out = os.path.splitext(args.csv_out)[0] + '.rejects.csv'
 
-warnings.warn('%d individuals were not found in AEBS.' %no_match, Warning)
+    summary = match_ids(args.csv1, args.csv2, args.csv_out, args.txt_out, rejects_out)
 
+    print('Records with no REFN discarded: %d' % summary['no_refn'])
+    print('Records with REFN ending in "000" discarded: %d' % summary['refn_000'])
+    print('Records with REFN not of length 11 discarded: %d' % summary['malformed'])
+    print('Records with the same REFN as a later record discarded: %d' % summary['duplicated'])
+    print('Samples matched with AEBS: %d of %d' % (summary['matched'], summary['samples']))
+    print('Samples with P-number not of length 9 (excluding hyphen): %d' % summary['invalid_pnum'])
+    print('Samples not found in AEBS: %d' % summary['unmatched'])
+    print('Samples that were not matched are written to %s' % rejects_out)
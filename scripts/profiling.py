@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+'''
+Stage-level profiling of the conversion and lineage pipeline.
+
+The pipeline (`ged2csv.py`, `lineages.py` and `Gen`) is divided into stages, e.g. parsing the
+Gedcom file, reading the CSV and reconstructing the genealogy. When profiling is enabled, the
+wall time, CPU time (including child processes, e.g. the workers of `ged2csv.py --workers`) and
+peak memory (maximum resident set size of the process so far) of each stage are recorded,
+together with counters such as the number of records parsed, and the number of individuals
+visited in the genealogy. Stages can be nested, e.g. "gen/csv2dict".
+
+Profiling is enabled with the `--profile` flag of the scripts, which writes a report to standard
+error at the end of the run. `--profile_json [path]` (`lineages.py`) or `--profile-json [path]`
+(`ged2csv.py`) also writes the profile to the path as JSON. Profiling can also be enabled by
+setting the environment variable AEBS_PROFILE: if the value is "1", the report is written to
+standard error, and any other value (except "0") is a path to write the JSON profile to.
+
+Example:
+    AEBS_PROFILE=1 lineages.py --csv [CSV] --ind [individuals] --out [output]
+    AEBS_PROFILE=profile.json lineages.py --csv [CSV] --ind [individuals] --out [output]
+    lineages.py --csv [CSV] --ind [individuals] --out [output] --profile
+    lineages.py --csv [CSV] --ind [individuals] --out [output] --profile_json profile.json
+    ged2csv.py --profile-json profile.json [GED] [CSV]
+
+    # In Python.
+    from profiling import profiler
+    profiler.configure('1')
+    gen = Gen('path/to/genealogy.csv', [1, 2, 3])
+    profiler.finish()
+
+When profiling is disabled, a stage is a shared context manager that does nothing, and counters
+are ignored, so the instrumentation costs close to nothing.
+'''
+
+import json, os, resource, sys, time
+
+# Environment variable that enables profiling, see top of file.
+ENV_VAR = 'AEBS_PROFILE'
+
+
+def peak_rss():
+    '''Peak resident set size of this process in MB.'''
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes.
+    return maxrss / (1024.0 ** 2 if sys.platform == 'darwin' else 1024.0)
+
+
+def cpu_time():
+    '''CPU time (user and system) of this process and its finished child processes, in seconds.'''
+    times = os.times()
+    return times[0] + times[1] + times[2] + times[3]
+
+
+class _NullStage(object):
+    '''Stage of a disabled profiler, which does nothing.'''
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class _Stage(object):
+    '''Stage of an enabled profiler, which records its time and memory when it exits.'''
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        stack = self.profiler._stack
+        name = '/'.join([stage['name'] for stage in stack[-1:]] + [self.name])
+        self.stage = {'name': name, 'counts': dict()}
+        self.profiler.stages.append(self.stage)
+        stack.append(self.stage)
+        self.wall = time.perf_counter()
+        self.cpu = cpu_time()
+        return self
+
+    def __exit__(self, *exc):
+        self.stage['wall'] = time.perf_counter() - self.wall
+        self.stage['cpu'] = cpu_time() - self.cpu
+        self.stage['peak_rss_mb'] = peak_rss()
+        self.profiler._stack.pop()
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+class Profiler(object):
+    def __init__(self, enabled=False, path=None):
+        '''
+        Collect the time, memory and counters of the stages of a run, see top of file.
+
+        Examples:
+            profiler = Profiler(enabled=True)
+            with profiler.stage('parse'):
+                records = parse(lines)
+                profiler.count('records', len(records))
+            print(profiler.report())
+
+        Input:
+            enabled:    Boolean, record stages and counters [False].
+            path:       String, path to write the profile to as JSON in `finish` [None].
+        '''
+        self.enabled = enabled
+        self.path = path
+
+        # Stages in the order they were started, each a dictionary with name, wall, cpu,
+        # peak_rss_mb and counts.
+        self.stages = list()
+        self._stack = list()
+
+    def configure(self, value=None):
+        '''
+        Enable profiling from a value as of the environment variable `ENV_VAR` ("1", or a path to
+        write JSON to), or from the environment variable itself if `value` is None. See top of file.
+        '''
+        if value is None:
+            value = os.environ.get(ENV_VAR, '')
+        if value in ('', '0'):
+            return
+        self.enabled = True
+        if value != '1':
+            self.path = value
+
+    def stage(self, name):
+        '''Context manager that records a stage of the run, named `name`.'''
+        if not self.enabled:
+            return _NULL_STAGE
+        return _Stage(self, name)
+
+    def count(self, name, value=1):
+        '''Add `value` to the counter `name` of the current stage.'''
+        if not self.enabled or not self._stack:
+            return
+        counts = self._stack[-1]['counts']
+        counts[name] = counts.get(name, 0) + value
+
+    def as_dict(self):
+        '''The profile as a dictionary, which can be written as JSON.'''
+        return {'stages': self.stages}
+
+    def report(self):
+        '''The profile as a human-readable table, with nested stages indented.'''
+        lines = ['%-40s %10s %10s %10s  %s' % ('stage', 'wall (s)', 'cpu (s)', 'peak (MB)', 'counts')]
+        for stage in self.stages:
+            parts = stage['name'].split('/')
+            name = '  ' * (len(parts) - 1) + parts[-1]
+            counts = ', '.join('%s=%d' % item for item in sorted(stage['counts'].items()))
+            lines.append('%-40s %10.3f %10.3f %10.1f  %s' % (name, stage.get('wall', float('nan')),
+                stage.get('cpu', float('nan')), stage.get('peak_rss_mb', float('nan')), counts))
+        return '\n'.join(lines)
+
+    def finish(self):
+        '''Write the report to standard error, and the JSON profile to `path` if it is set.'''
+        if not self.enabled:
+            return
+        sys.stderr.write(self.report() + '\n')
+        if self.path is not None:
+            with open(self.path, 'w') as fid:
+                json.dump(self.as_dict(), fid, indent=2)
+
+
+# Profiler of the pipeline, enabled by the environment variable `ENV_VAR`.
+profiler = Profiler()
+profiler.configure()
@@ -2,42 +2,101 @@
 '''
 Remove unwanted newlines from Gedcom file.
 
+Dos (Windows) line endings are also removed, so the Legacy export can be cleaned up in a
+single pass, without running `dos2unix` first.
+
 Usage:
     python remove_unwanted_newlines.py myfile.ged > outputfile.ged
+    python remove_unwanted_newlines.py myfile.ged outputfile.ged
 '''
 
 import sys
 
-# Input file.
-path = sys.argv[1]
+# Size of read and write buffers.
+BUFFER_SIZE = 1 << 20
+
+
+def open_ged(path):
+    '''
+    Open a Gedcom file for reading with a large buffer.
+
+    The byte order mark is removed (if there is one), and lines are only split at "\\n", as
+    Dos line endings ("\\r\\n") are removed when the lines are stripped of whitespace.
+    '''
+    return open(path, encoding='utf-8-sig', newline='\n', buffering=BUFFER_SIZE)
+
+
+def clean_lines(fid):
+    '''
+    Yield the lines of a Gedcom file with unwanted newlines removed.
+
+    Lines are stripped of whitespace (including Dos line endings), empty lines are ignored,
+    and a line that does not start with a level number is a continuation of the previous
+    line, and is added to it (separated by a space).
+
+    Example:
+        with open_ged('myfile.ged') as fid:
+            for line in clean_lines(fid):
+                print(line)
+
+    Input:
+        fid:        Iterable of strings, lines of a Gedcom file.
 
-def is_int(string):
-    '''Checks whether string represents an integer.'''
-    try:
-        int(string)
-    except ValueError:
-        return False
-    return True
+    Returns:
+    Generator of strings, cleaned lines without newline characters.
+    '''
 
-with open(path) as fid:
-    for i, line in enumerate(fid):
-        # Just print first line, which should be '0 HEAD'.
+    line = None
+    for i, next_line in enumerate(fid):
+        next_line = next_line.strip()
+
+        # Keep first line, which should be '0 HEAD'.
         if i == 0:
-            print(line.strip(), end='')
+            line = next_line
             continue
 
-        # Strip line of whitespace.
-        line = line.strip()
-
-        if len(line) == 0:
+        if len(next_line) == 0:
             # Empty line, ignore.
             continue
-        elif not is_int(line[0]):
+        elif not next_line[0].isdecimal():
             # Continuation of previous line.
-            print(' ' + line, end='')
+            line += ' ' + next_line
         else:
-            # End previous line with newline.
-            # Write the next line.
-            print('\n' + line, end='')
+            # Previous line is complete.
+            yield line
+            line = next_line
+
+    if line is not None:
+        yield line
+
+
+def write_lines(lines, fid):
+    '''
+    Write cleaned lines to a file, and yield them again.
+
+    This makes it possible to write a cleaned Gedcom file while the lines are consumed by a
+    parser. Lines are separated by newlines, and there is no newline after the last line.
+    '''
+    sep = ''
+    for line in lines:
+        fid.write(sep + line)
+        sep = '\n'
+        yield line
+
+
+def clean_ged(in_path, out):
+    '''Remove unwanted newlines from the Gedcom file `in_path`, writing the result to file object `out`.'''
+    with open_ged(in_path) as fid:
+        for _ in write_lines(clean_lines(fid), out):
+            pass
+
 
+if __name__ == '__main__':
+    # Input file.
+    path = sys.argv[1]
 
+    if len(sys.argv) > 2:
+        with open(sys.argv[2], 'w', encoding='utf-8', buffering=BUFFER_SIZE) as out:
+            clean_ged(path, out)
+    else:
+        clean_ged(path, sys.stdout)
@@ -0,0 +1,327 @@
+#!/usr/bin/env python
+'''
+Simulate a population pedigree, and write it as a Gedcom file and as a genealogy CSV.
+
+The population is simulated one year at a time, from a small number of founders (a founder
+bottleneck), and grows so that it reaches the requested number of individuals at the end of
+the simulation. Each year, unmarried adults form couples, some of them with a first cousin and
+some with an immigrant (a new founder), and children are born to couples where the mother is of
+childbearing age. Generations therefore overlap, and in a small population the pedigree
+collapses, as individuals descend from the same ancestors through many paths. The number of
+births can be reduced in given periods (e.g. epidemics), which makes further bottlenecks.
+
+The CSV is identical to the CSV `ged2csv.py` produces from the Gedcom file, so the simulated
+data can be used to test and benchmark all steps of the pipeline (see `benchmark.py`).
+
+Usage:
+    python simulate.py --n [individuals] --ged [GED output] --csv [CSV output]
+
+Example:
+    # One million individuals, with an epidemic halving the births from 1700 to 1710.
+    python simulate.py --n 1000000 --bottleneck 1700:1710:0.5 --ged sim.ged --csv sim.csv
+'''
+
+from lineages import GenStore, write_genealogy
+import pandas as pd
+import numpy as np
+import argparse
+
+# Birth places, chosen at random for founders, and mostly inherited from the mother.
+PLACES = ('Tórshavn', 'Klaksvík', 'Runavík', 'Tvøroyri', 'Vágur', 'Sørvágur', 'Miðvágur',
+        'Fuglafjørður', 'Vestmanna', 'Eiði', 'Sandur', 'Hvalba', 'Viðareiði', 'Nólsoy')
+
+MONTHS = ('JAN', 'FEB', 'MAR', 'APR', 'MAY', 'JUN', 'JUL', 'AUG', 'SEP', 'OCT', 'NOV', 'DEC')
+
+
+def _growth_rate(n, births, years):
+    '''Growth rate r such that `births * sum(exp(r * t))` for t < `years` is `n`, by bisection.'''
+    lo, hi = -1.0, 1.0
+    t = np.arange(years)
+    for _ in range(100):
+        r = (lo + hi) / 2
+        if births * np.exp(r * t).sum() < n:
+            lo = r
+        else:
+            hi = r
+    return r
+
+
+def _cousin_pairs(men, women, fa, mo, rng):
+    '''
+    Pair men with female first cousins (sharing a grandparent, but no parent) among `women`.
+
+    Each man and woman is used at most once, and the pairs are chosen at random.
+
+    Returns:
+    Tuple (men, women) of arrays of rows, the couples.
+    '''
+    def grandparents(rows):
+        '''Dataframe with the columns row and gp, one line for each known grandparent of the rows.'''
+        frames = list()
+        for parent in (fa, mo):
+            p = parent[rows]
+            known = p >= 0
+            for grandparent in (fa, mo):
+                gp = grandparent[p[known]]
+                frames.append(pd.DataFrame({'row': rows[known][gp >= 0], 'gp': gp[gp >= 0]}))
+        return pd.concat(frames)
+
+    pairs = grandparents(men).merge(grandparents(women), on='gp', suffixes=('_m', '_f'))
+    man = pairs.row_m.values
+    woman = pairs.row_f.values
+
+    # Siblings and half-siblings are not cousins.
+    cousins = (fa[man] != fa[woman]) & (mo[man] != mo[woman])
+    pairs = pd.DataFrame({'m': man[cousins], 'f': woman[cousins]})
+
+    pairs = pairs.iloc[rng.permutation(len(pairs))]
+    pairs = pairs.drop_duplicates('m').drop_duplicates('f')
+
+    return pairs.m.values, pairs.f.values
+
+
+def simulate(n, founders=200, start_year=1500, years=400, cousin_rate=0.05, immigration=0.05,
+        bottlenecks=(), missing_birth=0.02, seed=None):
+    '''
+    Simulate a population pedigree, see top of file.
+
+    Input:
+        n:              Integer, number of individuals.
+        founders:       Integer, number of individuals in the founding population [200].
+        start_year:     Integer, birth year of the first generation [1500].
+        years:          Integer, number of years it takes to reach `n` individuals [400].
+        cousin_rate:    Float, fraction of marriages between first cousins, when possible [0.05].
+        immigration:    Float, fraction of marriages with an immigrant [0.05].
+        bottlenecks:    List of tuples (first year, last year, factor), the number of births is
+                        multiplied by the factor in these periods [()].
+        missing_birth:  Float, fraction of individuals with no birth record [0.02].
+        seed:           Integer, seed of random number generator [None].
+
+    Returns:
+    Dataframe with the columns ind, father, mother, sex (M/F), birth_year, birth_place, birth_date
+    (Gedcom date string, empty if no birth record) and refn (YYYYmmddXXX), in order of RIN. RINs
+    are assigned at random, so parents do not always have lower RINs than their children.
+    '''
+    rng = np.random.default_rng(seed)
+    assert n > founders, 'The number of individuals must be larger than the number of founders.'
+
+    # Arrays of all individuals, indexed by row (order of creation).
+    sex = np.zeros(n, dtype=np.int8)  # 0: male, 1: female.
+    birth_year = np.zeros(n, dtype=np.int64)
+    fa = np.full(n, -1, dtype=np.int64)
+    mo = np.full(n, -1, dtype=np.int64)
+    place = np.zeros(n, dtype=np.int64)
+    # Age at which an individual marries, or a negative number if never.
+    marriage_age = np.where(rng.random(n) < 0.1, -1, np.clip(rng.normal(25, 4, n), 18, 40).astype(np.int64))
+    married = np.zeros(n, dtype=bool)
+
+    count = 0
+
+    def add(k, year, father=None, mother=None):
+        '''Add `k` individuals born around `year`, and return their rows.'''
+        nonlocal count
+        k = min(k, n - count)
+        rows = np.arange(count, count + k)
+        sex[rows] = rng.random(k) < 0.5
+        birth_year[rows] = year
+        if father is not None:
+            fa[rows] = father[:k]
+            mo[rows] = mother[:k]
+            place[rows] = np.where(rng.random(k) < 0.8, place[mother[:k]], rng.integers(len(PLACES), size=k))
+        else:
+            place[rows] = rng.integers(len(PLACES), size=k)
+        count += k
+        return rows
+
+    # Founders are born in the first generation, and married at once.
+    rows = add(founders, 0)
+    birth_year[rows] = start_year + rng.integers(0, 25, len(rows))
+    marriage_age[rows] = np.maximum(marriage_age[rows], 18)
+
+    couple_fa = list()
+    couple_mo = list()
+
+    # Yearly births grow exponentially from the births of the founding population.
+    births = max(founders / 25.0, 1.0)
+    rate = _growth_rate(n - founders, births, years)
+
+    year = start_year + 18
+    t = 0
+    while count < n:
+        # Unmarried individuals of marriage age form couples.
+        alive = np.arange(count)
+        age = year - birth_year[alive]
+        single = alive[~married[alive] & (marriage_age[alive] >= 0) & (age >= marriage_age[alive]) & (age <= 45)]
+        men = single[sex[single] == 0]
+        women = single[sex[single] == 1]
+
+        # Some men marry a cousin.
+        wants_cousin = men[rng.random(len(men)) < cousin_rate]
+        m, f = _cousin_pairs(wants_cousin, women, fa, mo, rng)
+        men = np.setdiff1d(men, m)
+        women = np.setdiff1d(women, f)
+
+        # The others pair at random, and some of those who do not find a partner marry an immigrant.
+        men = rng.permutation(men)
+        women = rng.permutation(women)
+        k = min(len(men), len(women))
+        m = np.concatenate((m, men[:k]))
+        f = np.concatenate((f, women[:k]))
+        rest = np.concatenate((men[k:], women[k:]))
+        rest = rest[rng.random(len(rest)) < immigration]
+        immigrants = add(len(rest), year)
+        rest = rest[:len(immigrants)]
+        sex[immigrants] = 1 - sex[rest]
+        birth_year[immigrants] = birth_year[rest] + rng.integers(-5, 6, len(rest))
+        married[immigrants] = True
+        m = np.concatenate((m, np.where(sex[rest] == 0, rest, immigrants)))
+        f = np.concatenate((f, np.where(sex[rest] == 0, immigrants, rest)))
+
+        married[m] = True
+        married[f] = True
+        couple_fa.extend(m.tolist())
+        couple_mo.extend(f.tolist())
+
+        # Children are born to couples where the mother is of childbearing age.
+        cf = np.asarray(couple_fa, dtype=np.int64)
+        cm = np.asarray(couple_mo, dtype=np.int64)
+        fertile = (year - birth_year[cm] >= 18) & (year - birth_year[cm] <= 45) & (year - birth_year[cf] <= 65)
+        cf = cf[fertile]
+        cm = cm[fertile]
+
+        k = births * np.exp(rate * t)
+        for first, last, factor in bottlenecks:
+            if first <= year <= last:
+                k *= factor
+        k = rng.poisson(k)
+        if len(cf) > 0 and k > 0:
+            parents = rng.integers(len(cf), size=k)
+            father = cf[parents]
+            mother = cm[parents]
+            # Some fathers are unknown.
+            father[rng.random(k) < 0.01] = -1
+            add(k, year, father, mother)
+
+        year += 1
+        t += 1
+
+    # Assign RINs at random, and order the individuals by RIN.
+    rin = rng.permutation(n) + 1
+    order = np.argsort(rin)
+
+    def parent_rin(parents):
+        return np.where(parents >= 0, rin[np.maximum(parents, 0)], 0)
+
+    # Birth records: a date, a REFN with the same date, and some individuals have no birth record.
+    has_birth = rng.random(n) >= missing_birth
+    month = rng.integers(1, 13, n)
+    day = rng.integers(1, 29, n)
+    serial = rng.integers(1, 1000, n)
+    birth_date = ['%d %s %d' % (d, MONTHS[m - 1], y) if b else ''
+            for d, m, y, b in zip(day.tolist(), month.tolist(), birth_year.tolist(), has_birth.tolist())]
+    refn = ['%04d%02d%02d%03d' % (y, m, d, s)
+            for y, m, d, s in zip(birth_year.tolist(), month.tolist(), day.tolist(), serial.tolist())]
+
+    ped = pd.DataFrame({'ind': rin,
+        'father': parent_rin(fa),
+        'mother': parent_rin(mo),
+        'sex': np.where(sex == 0, 'M', 'F'),
+        'birth_year': pd.array(np.where(has_birth, birth_year, -1)).astype('Int64'),
+        'birth_place': np.array(PLACES, dtype=object)[place],
+        'birth_date': birth_date,
+        'refn': refn})
+    ped.loc[~has_birth, 'birth_year'] = pd.NA
+    ped.loc[~has_birth, 'birth_place'] = None
+
+    return ped.iloc[order].reset_index(drop=True)
+
+
+def write_ged(ped, path):
+    '''
+    Write a simulated pedigree (see `simulate`) to a Gedcom file.
+
+    Each individual has an INDI record with SEX, BIRT (DATE and PLAC), REFN and FAMC, and each
+    couple with children has a FAM record with HUSB, WIFE and CHIL.
+    '''
+    ind = ped.ind.values
+    father = ped.father.values
+    mother = ped.mother.values
+
+    # Families are the distinct parent pairs of individuals with a known parent.
+    has_parents = (father > 0) | (mother > 0)
+    pairs = pd.DataFrame({'father': father[has_parents], 'mother': mother[has_parents]})
+    fams, famc = np.unique(pairs.values, axis=0, return_inverse=True)
+    famc = famc.ravel() + 1
+    fam_of = np.zeros(len(ind), dtype=np.int64)
+    fam_of[has_parents] = famc
+
+    # Children of each family, in order of RIN.
+    children = pd.Series(ind[has_parents]).groupby(famc).apply(list)
+
+    with open(path, 'w', encoding='utf-8') as fid:
+        fid.write('0 HEAD\n1 SOUR simulate.py\n1 GEDC\n2 VERS 5.5.1\n1 CHAR UTF-8\n')
+
+        lines = list()
+        for i, sx, date, place, refn, fam in zip(ind.tolist(), ped.sex.tolist(), ped.birth_date.tolist(),
+                ped.birth_place.tolist(), ped.refn.tolist(), fam_of.tolist()):
+            lines.append('0 @I%d@ INDI\n1 SEX %s\n' % (i, sx))
+            if date:
+                lines.append('1 BIRT\n2 DATE %s\n2 PLAC %s\n' % (date, place))
+            lines.append('1 REFN %s\n' % refn)
+            if fam:
+                lines.append('1 FAMC @F%d@\n' % fam)
+        fid.write(''.join(lines))
+
+        lines = list()
+        for fam, (husb, wife), kids in zip(range(1, len(fams) + 1), fams.tolist(), children.tolist()):
+            lines.append('0 @F%d@ FAM\n' % fam)
+            if husb:
+                lines.append('1 HUSB @I%d@\n' % husb)
+            if wife:
+                lines.append('1 WIFE @I%d@\n' % wife)
+            lines.append(''.join('1 CHIL @I%d@\n' % kid for kid in kids))
+        fid.write(''.join(lines))
+
+        fid.write('0 TRLR\n')
+
+
+def write_csv(ped, path):
+    '''Write a simulated pedigree (see `simulate`) to a genealogy CSV, as `ged2csv.py` does.'''
+    write_genealogy(GenStore.from_frame(ped), path)
+
+
+def parse_bottleneck(value):
+    '''Parse a bottleneck given as "first:last:factor", e.g. "1700:1710:0.5".'''
+    first, last, factor = value.split(':')
+    return int(first), int(last), float(factor)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+
+    # Arguments for parser.
+    parser.add_argument('--n', type=int, required=True, help='Number of individuals.')
+    parser.add_argument('--ged', type=str, help='Path to output GED file.')
+    parser.add_argument('--csv', type=str, help='Path to output CSV file.')
+    parser.add_argument('--founders', type=int, default=200, help='Number of founders.')
+    parser.add_argument('--start_year', type=int, default=1500, help='Birth year of the founders.')
+    parser.add_argument('--years', type=int, default=400, help='Number of years to simulate.')
+    parser.add_argument('--cousin_rate', type=float, default=0.05, help='Fraction of marriages between first cousins.')
+    parser.add_argument('--immigration', type=float, default=0.05, help='Fraction of marriages with an immigrant.')
+    parser.add_argument('--bottleneck', type=parse_bottleneck, action='append', default=list(),
+            help='Period with fewer births, as "first year:last year:factor". Can be given several times.')
+    parser.add_argument('--seed', type=int, help='Seed of random number generator.')
+
+    # Parse input arguments.
+    args = parser.parse_args()
+
+    assert args.ged is not None or args.csv is not None, 'At least one of --ged and --csv is required.'
+
+    ped = simulate(args.n, founders=args.founders, start_year=args.start_year, years=args.years,
+            cousin_rate=args.cousin_rate, immigration=args.immigration, bottlenecks=args.bottleneck,
+            seed=args.seed)
+
+    if args.ged is not None:
+        write_ged(ped, args.ged)
+    if args.csv is not None:
+        write_csv(ped, args.csv)
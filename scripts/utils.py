@@ -3,43 +3,731 @@
 Functions for working with genealogies (dictionaries or Gen objects).
 '''
 
+import numpy as np
+import weakref
+
 
 def calc_depth(ind, gen, d=0, depth=0):
     '''
     Calculate the total generational depth of the lineage of a single individual.
 
+    For a `GenStore` or `Gen` object, the depths of all individuals in the genealogy are
+    computed once with `calc_depths`, and kept for subsequent calls with the same object, so
+    that each call is a lookup. For a dictionary, which cannot be kept, only the ancestors of
+    the individual are visited (see `_lineage_depth`).
+
     Example:
         depth = calc_depth(1, gen)
 
     Input:
         ind:        Integer, ID of individual.
-        gen:        Dictionary, genealogy object.
+        gen:        `GenStore`, `Gen` or dictionary, genealogy object.
         d:          Integer, current generational depth, do not change [0].
         depth:      Integer, total generational depth, do not change [0].
 
     Returns:
+    Integer, the length of the longest path from the individual to a founder in its lineage.
+
+    Raises:
+    ValueError if the individual is its own ancestor, or descends from such an individual.
+    '''
+
+    if isinstance(gen, dict):
+        assert ind in gen, 'Individual %d does not exist in genealogy.' % ind
+        return max(depth, d + _lineage_depth(ind, gen))
+
+    inds, depths = _depth_table(gen)
+
+    pos = np.searchsorted(inds, ind)
+    assert pos < len(inds) and inds[pos] == ind, 'Individual %d does not exist in genealogy.' % ind
+    if depths[pos] < 0:
+        raise ValueError('Individual %d is its own ancestor, or descends from one.' % ind)
+
+    return max(depth, d + int(depths[pos]))
+
+
+def _lineage_depth(ind, gen):
+    '''
+    Calculate the depth of an individual in a dictionary of `Record` objects, visiting each of
+    its ancestors once (depth-first, without recursion). See `calc_depth`.
+    '''
+    depths = dict()
+    # Individuals whose parents are being visited, i.e. the current path.
+    visiting = set()
+    stack = [ind]
+    while stack:
+        node = stack[-1]
+        if node in depths:
+            stack.pop()
+            continue
+
+        rec = gen[node]
+        parents = [p for p in (rec.fa, rec.mo) if p != 0 and p in gen]
+        if node not in visiting:
+            # First visit, visit the parents before the individual.
+            visiting.add(node)
+            for p in parents:
+                if p in visiting:
+                    raise ValueError('Individual %d is its own ancestor, or descends from one.' % ind)
+            stack.extend(p for p in parents if p not in depths)
+        else:
+            # All parents have been visited.
+            visiting.discard(node)
+            depths[node] = 1 + max(depths[p] for p in parents) if parents else 0
+            stack.pop()
+
+    return depths[ind]
+
+
+def calc_depths(gen):
+    '''
+    Calculate the total generational depth of the lineages of all individuals in a genealogy.
+
+    The depth of an individual is the length of the longest path from it to a founder (an
+    individual with no parents in the genealogy), which is also its generation counted from the
+    founders (founders are generation 0). It is computed one generation at a time, as one more
+    than the depth of the deepest parent (see `topological_order`), so each individual is
+    visited once, no matter how many paths lead to it. Individuals that are their own ancestor,
+    or descend from one, have no depth, and get -1; the depths of all other individuals are
+    computed as usual.
+
+    Example:
+        inds, depths = calc_depths(gen)
+
+    Input:
+        gen:        `GenStore`, `Gen` or dictionary, genealogy object.
+
+    Returns:
+    Tuple (inds, depths) of arrays of integer, RIN of individuals and their depths.
+    '''
+    inds, fa, mo = parent_arrays(gen)
+    _, generation = _generations(fa, mo)
+
+    return inds, generation
+
+
+# Depths computed by `calc_depth`, sorted by RIN, for each genealogy object.
+_depth_tables = weakref.WeakKeyDictionary()
+
+
+def _depth_table(gen):
+    '''Get the RINs (sorted) and depths of all individuals in a `GenStore` or `Gen` object, see `calc_depth`.'''
+    try:
+        return _depth_tables[gen]
+    except KeyError:
+        pass
+
+    inds, depths = calc_depths(gen)
+    order = np.argsort(inds, kind='stable')
+    table = (inds[order], depths[order])
+    _depth_tables[gen] = table
+
+    return table
+
+
+def parent_arrays(gen):
+    '''
+    Get the rows of the parents of all individuals in a genealogy.
+
+    The genealogy can be a `GenStore`, a `Gen` object, or a dictionary of `Record` objects. A
+    parent that is 0, or that is not in the genealogy (e.g. because the lineage was cut off by
+    the depth or birth year thresholds), gets row -1.
+
+    Example:
+        inds, fa, mo = parent_arrays(gen)
+        father_of_first = inds[fa[0]] if fa[0] >= 0 else 0
+
+    Input:
+        gen:        `GenStore`, `Gen` or dictionary, genealogy object.
+
+    Returns:
+    Tuple of three arrays of integer:
+        inds:       RIN of individuals, in the order of the genealogy.
+        fa:         Rows of the fathers in `inds`.
+        mo:         Rows of the mothers in `inds`.
+    '''
+
+    # GenStore already has parent rows.
+    if hasattr(gen, 'fa_idx'):
+        return gen.ind, gen.fa_idx, gen.mo_idx
+
+    # Gen object.
+    if hasattr(gen, 'gen'):
+        gen = gen.gen
+
+    n = len(gen)
+    inds = np.fromiter(gen.keys(), dtype=np.int64, count=n)
+    if n == 0:
+        return inds, inds.copy(), inds.copy()
+
+    recs = [gen.get(ind) for ind in inds.tolist()]
+    father = np.fromiter((rec.fa for rec in recs), dtype=np.int64, count=n)
+    mother = np.fromiter((rec.mo for rec in recs), dtype=np.int64, count=n)
+
+    # Find rows of parents by searching in the sorted RINs.
+    order = np.argsort(inds, kind='stable')
+    sorted_inds = inds[order]
+
+    def rows(parents):
+        pos = np.minimum(np.searchsorted(sorted_inds, parents), n - 1)
+        found = (parents != 0) & (sorted_inds[pos] == parents)
+        return np.where(found, order[pos], -1)
+
+    return inds, rows(father), rows(mother)
+
+
+def child_index(fa, mo):
+    '''
+    Construct a compressed (CSR) index from parents to children.
+
+    The children of the individual in row `i` are `children[indptr[i]:indptr[i+1]]`, in
+    increasing order.
+
+    Input:
+        fa:         Array of integer, rows of fathers (-1 if none).
+        mo:         Array of integer, rows of mothers (-1 if none).
+
+    Returns:
+    Tuple (indptr, children) of arrays of integer.
     '''
+    n = len(fa)
+    parents = np.concatenate((fa, mo))
+    kids = np.concatenate((np.arange(n), np.arange(n)))
+
+    # Only keep existing parents, and sort the edges by parent (then child).
+    keep = parents >= 0
+    parents = parents[keep]
+    kids = kids[keep]
+    order = np.lexsort((kids, parents))
+
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(parents, minlength=n), out=indptr[1:])
 
-    # Get the record corresponding to the individual.
-    rec = gen.get(ind)
+    return indptr, kids[order].astype(np.int64)
 
-    assert rec is not None, 'Individual %d does not exist in genealogy.' % ind
 
-    # If current depth is larger than the total, update depth.
-    if d > depth:
-        depth = d
+def gather_children(indptr, children, rows):
+    '''Concatenate the children (see `child_index`) of all individuals in the array `rows`.'''
+    starts = indptr[rows]
+    counts = indptr[rows + 1] - starts
+    offsets = np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+    return children[offsets]
 
-    # Get IDs of parents.
-    fa = rec.fa
-    mo = rec.mo
 
-    # If the parent exists (ID different from 0), make a recursive call.
-    # Pass all parameters on in the recursive call, and increment the depth.
-    # The recursive call will return the resulting generational depth.
-    if fa != 0 and gen.get(fa) is not None:
-        depth = calc_depth(fa, gen, d+1, depth)
-    if mo != 0 and gen.get(mo) is not None:
-        depth = calc_depth(mo, gen, d+1, depth)
+def _generations(fa, mo):
+    '''
+    Place individuals in generations, one generation at a time, see `topological_order`.
+
+    Returns:
+    Tuple (levels, generation): list of arrays of rows in each generation, and array of the
+    generation of each row (-1 for individuals in or descending from a cycle).
+    '''
+    fa = np.asarray(fa)
+    mo = np.asarray(mo)
+    n = len(fa)
+
+    indptr, children = child_index(fa, mo)
+
+    # Number of parents not yet placed in the order.
+    n_parents = (fa >= 0).astype(np.int64) + (mo >= 0)
+
+    generation = np.full(n, -1, dtype=np.int64)
+    levels = list()
+    frontier = np.flatnonzero(n_parents == 0)
+    g = 0
+    while len(frontier) > 0:
+        generation[frontier] = g
+        levels.append(frontier)
+
+        # Remove the frontier from the parent counts of their children. The children with
+        # no remaining parents are the next generation.
+        kids, counts = np.unique(gather_children(indptr, children, frontier), return_counts=True)
+        n_parents[kids] -= counts
+        frontier = kids[n_parents[kids] == 0]
+        g += 1
+
+    return levels, generation
+
+
+def cycle_members(fa, mo, generation=None):
+    '''
+    Find the individuals that are their own ancestor, i.e. that are in a cycle of parent links.
+
+    The individuals that cannot be placed in a generation (see `topological_order`) are in a
+    cycle or descend from one. Of these, the ones with no children left among them are removed
+    repeatedly, as they cannot be in a cycle. The cycles among the remaining individuals are
+    the strongly connected components of their parent links with more than one individual, or
+    an individual that is its own parent, found with Tarjan's algorithm. Individuals that
+    descend from a cycle, or are on a path between two cycles, are not in a cycle. Each step
+    takes linear time.
+
+    Input:
+        fa:         Array of integer, rows of fathers (-1 if none).
+        mo:         Array of integer, rows of mothers (-1 if none).
+        generation: Array of integer, generation of each row if already computed, see
+                    `calc_depths` [None].
+
+    Returns:
+    Array of boolean, True for individuals in a cycle.
+    '''
+    fa = np.asarray(fa)
+    mo = np.asarray(mo)
+
+    if generation is None:
+        _, generation = _generations(fa, mo)
+    left = generation < 0
+    if not left.any():
+        return left
+
+    # Number of children of each individual among the individuals left.
+    n_kids = np.zeros(len(fa), dtype=np.int64)
+    for parent in (fa, mo):
+        n_kids += np.bincount(parent[left & (parent >= 0)], minlength=len(fa))
+
+    frontier = np.flatnonzero(left & (n_kids == 0))
+    while len(frontier) > 0:
+        left[frontier] = False
+        parents = np.concatenate((fa[frontier], mo[frontier]))
+        parents, counts = np.unique(parents[parents >= 0], return_counts=True)
+        n_kids[parents] -= counts
+        frontier = parents[left[parents] & (n_kids[parents] == 0)]
+
+    cycle = np.zeros(len(fa), dtype=bool)
+    for component in _strong_components(np.flatnonzero(left), fa, mo, left):
+        if len(component) > 1 or fa[component[0]] == component[0] or mo[component[0]] == component[0]:
+            cycle[component] = True
+
+    return cycle
+
+
+def _strong_components(nodes, fa, mo, keep):
+    '''
+    Strongly connected components of the parent links between the individuals in `keep`, with
+    an iterative version of Tarjan's algorithm, see `cycle_members`.
+
+    Returns:
+    List of lists of rows, one per component.
+    '''
+    index = dict()
+    low = dict()
+    on_stack = set()
+    stack = list()
+    components = list()
+    count = 0
+
+    for root in nodes.tolist():
+        if root in index:
+            continue
+        # Each entry is an individual and the parents that are not yet visited from it.
+        work = [(root, iter([p for p in (fa[root], mo[root]) if p >= 0 and keep[p]]))]
+        index[root] = low[root] = count
+        count += 1
+        stack.append(root)
+        on_stack.add(root)
+        while work:
+            node, parents = work[-1]
+            for p in parents:
+                p = int(p)
+                if p not in index:
+                    index[p] = low[p] = count
+                    count += 1
+                    stack.append(p)
+                    on_stack.add(p)
+                    work.append((p, iter([q for q in (fa[p], mo[p]) if q >= 0 and keep[q]])))
+                    break
+                elif p in on_stack:
+                    low[node] = min(low[node], index[p])
+            else:
+                # All parents are visited.
+                work.pop()
+                if work:
+                    low[work[-1][0]] = min(low[work[-1][0]], low[node])
+                if low[node] == index[node]:
+                    component = list()
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        component.append(member)
+                        if member == node:
+                            break
+                    components.append(component)
+
+    return components
+
+
+def topological_order(fa, mo):
+    '''
+    Order individuals such that parents always come before their children.
+
+    The individuals are sorted by generation, where founders are generation 0, and every other
+    individual is one generation later than its latest parent (i.e. the longest path to a
+    founder). Within a generation, individuals are in the order of their rows, so the order is
+    stable. This is computed in linear time, one generation at a time (Kahn's algorithm).
+
+    Example:
+        inds, fa, mo = parent_arrays(gen)
+        order, generation = topological_order(fa, mo)
+
+    Input:
+        fa:         Array of integer, rows of fathers (-1 if none).
+        mo:         Array of integer, rows of mothers (-1 if none).
+
+    Returns:
+    Tuple (order, generation) of arrays of integer, rows in topological order and the generation
+    of each row.
+
+    Raises:
+    ValueError if the genealogy contains a cycle (an individual is its own ancestor).
+    '''
+    levels, generation = _generations(fa, mo)
+
+    if np.any(generation < 0):
+        raise ValueError('Genealogy contains a cycle: %d individuals are their own ancestor or descend from one.'
+                % np.sum(generation < 0))
+
+    order = np.concatenate(levels) if len(levels) > 0 else np.zeros(0, dtype=np.int64)
+
+    return order, generation
+
+
+def connecting_pedigree(fa, mo, probands):
+    '''
+    Find the individuals on paths linking two or more probands, i.e. the minimal pedigree that
+    connects the probands.
+
+    An individual that is an ancestor (or self) of two or more probands connects them. All
+    connecting individuals, their descendants that are ancestors of a proband, and the probands
+    are kept. This removes the branches that are ancestors of only one proband. Then, founders
+    of the kept pedigree that are not probands and have only one kept child are removed, one
+    generation at a time, as they are not on any path between two probands either.
+
+    Whether an individual is an ancestor of two or more probands is found by propagating the
+    smallest and the largest proband (as row numbers) from children to parents, in reverse
+    topological order (see `topological_order`), so each parent link is only followed once.
+
+    Example:
+        inds, fa, mo = parent_arrays(gen)
+        keep = connecting_pedigree(fa, mo, probands_rows)
+        kept_inds = inds[keep]
+
+    Input:
+        fa:         Array of integer, rows of fathers (-1 if none).
+        mo:         Array of integer, rows of mothers (-1 if none).
+        probands:   Array of integer, rows of probands.
+
+    Returns:
+    Array of boolean, True for individuals in the connecting pedigree.
+    '''
+    fa = np.asarray(fa)
+    mo = np.asarray(mo)
+    n = len(fa)
+
+    order, generation = topological_order(fa, mo)
+    bounds = np.searchsorted(generation[order], np.arange(generation.max() + 2 if n > 0 else 1))
+    levels = [order[start:end] for start, end in zip(bounds[:-1], bounds[1:])]
+
+    is_proband = np.zeros(n, dtype=bool)
+    is_proband[np.asarray(probands, dtype=np.int64)] = True
+
+    # Smallest and largest proband each individual is an ancestor (or self) of, from the latest
+    # generation to the founders.
+    rows = np.arange(n)
+    low = np.where(is_proband, rows, n)
+    high = np.where(is_proband, rows, -1)
+    for level in reversed(levels):
+        for parent in (fa, mo):
+            p = parent[level]
+            has = p >= 0
+            np.minimum.at(low, p[has], low[level[has]])
+            np.maximum.at(high, p[has], high[level[has]])
+
+    # Individuals that connect probands, and their descendants, from the founders down.
+    linked = low < high
+    for level in levels:
+        for parent in (fa, mo):
+            p = parent[level]
+            has = p >= 0
+            linked[level[has]] |= linked[p[has]]
+
+    keep = is_proband | (linked & (high >= 0))
+
+    # Number of kept children of each individual.
+    n_kids = np.zeros(n, dtype=np.int64)
+    for parent in (fa, mo):
+        p = parent[keep & (parent >= 0)]
+        n_kids += np.bincount(p, minlength=n)
+
+    # Remove founders of the kept pedigree with at most one kept child, from the founders down,
+    # so that their child can be removed in turn.
+    for level in levels:
+        kept_parent = np.zeros(len(level), dtype=bool)
+        for parent in (fa, mo):
+            p = parent[level]
+            kept_parent |= (p >= 0) & keep[np.maximum(p, 0)]
+        remove = keep[level] & ~is_proband[level] & ~kept_parent & (n_kids[level] <= 1)
+        keep[level[remove]] = False
+
+    return keep
+
+
+class AncestorIndex(object):
+    ARRAYS = ('inds', 'rin_order', 'pos', 'order', 'label', 'by_label', 'ptr', 'lo', 'hi', 'child_ptr', 'children')
+
+    def __init__(self, inds, rin_order, pos, order, label, by_label, ptr, lo, hi, child_ptr, children):
+        '''
+        Index of the ancestors of every individual in a genealogy, for fast ancestry queries.
+
+        The index is stored as interval labels. The individuals are numbered in postorder of a
+        spanning forest, in which each individual with children is placed below its first
+        child, so that the ancestors reached through these links have consecutive numbers. The
+        ancestors of each individual, together with the individual itself, are then stored as a
+        sorted list of disjoint intervals of these numbers, which are much fewer than the
+        ancestors when the lineages of the parents overlap little (about 8 bytes per interval,
+        instead of a bitset of all individuals). The lists are stored in compressed (CSR) form,
+        in topological order (see `topological_order`), and computed once, one generation at a
+        time, by merging the intervals of the parents with the individual's own (see `build`).
+
+        Ancestor tests are a binary search in the intervals of an individual, common ancestors
+        are the intersection of the intervals of two individuals, and the most recent common
+        ancestors are the common ancestors with none of their children among them.
+
+        The index can be stored as one array per field (see `ARRAYS`), e.g. in the binary cache
+        of a genealogy (see `lineages.load_ancestor_index`), and constructed from these arrays.
+
+        Example:
+            index = AncestorIndex.build(gen)
+            index.is_ancestor(2, 1)         # True if 2 is an ancestor of 1.
+            index.common_ancestors(1, 10)   # RIN of shared ancestors of 1 and 10.
+            index.mrca(1, 10)               # RIN of most recent common ancestors of 1 and 10.
+
+        Input:
+            inds:       Array of integer, RIN of individuals, by row.
+            rin_order:  Array of integer, rows in order of RIN.
+            pos:        Array of integer, position of each row in topological order.
+            order:      Array of integer, row at each position in topological order.
+            label:      Array of integer, number of each row in the spanning forest.
+            by_label:   Array of integer, row with each number.
+            ptr:        Array of integer, the intervals of the individual at position `p` are
+                        `lo[ptr[p]:ptr[p+1]]` to `hi[ptr[p]:ptr[p+1]]` (inclusive).
+            lo:         Array of integer, first number of each interval.
+            hi:         Array of integer, last number of each interval.
+            child_ptr:  Array of integer, index from rows to children, see `child_index`.
+            children:   Array of integer, rows of children, see `child_index`.
+        '''
+        self.inds = inds
+        self.rin_order = rin_order
+        self.pos = pos
+        self.order = order
+        self.label = label
+        self.by_label = by_label
+        self.ptr = ptr
+        self.lo = lo
+        self.hi = hi
+        self.child_ptr = child_ptr
+        self.children = children
+
+    @classmethod
+    def build(cls, gen):
+        '''
+        Construct the index of a genealogy, see `AncestorIndex`.
+
+        Input:
+            gen:        `GenStore`, `Gen` or dictionary, genealogy object.
+
+        Returns:
+        `AncestorIndex`.
+
+        Raises:
+        ValueError if the genealogy contains a cycle, see `topological_order`.
+        '''
+        inds, fa, mo = parent_arrays(gen)
+        n = len(inds)
+        order, generation = topological_order(fa, mo)
+        pos = np.empty(n, dtype=np.int64)
+        pos[order] = np.arange(n)
+        child_ptr, children = child_index(fa, mo)
+
+        # Generations, as slices of the topological order.
+        bounds = np.r_[0, np.flatnonzero(np.diff(generation[order])) + 1, n] if n > 0 else np.zeros(1, dtype=np.int64)
+        slices = list(zip(bounds[:-1], bounds[1:]))
+
+        # Spanning forest: each individual with children is placed below its first child, which
+        # is in a later generation.
+        has_children = child_ptr[1:] > child_ptr[:-1]
+        below = np.full(n, -1, dtype=np.int64)
+        below[has_children] = children[child_ptr[:-1][has_children]]
+
+        # Sizes of the subtrees, from the founders to the youngest generation.
+        size = np.ones(n, dtype=np.int64)
+        for first, last in slices:
+            level = order[first:last]
+            level = level[below[level] >= 0]
+            np.add.at(size, below[level], size[level])
+
+        # The subtrees of the roots are numbered one after the other, and the subtrees placed
+        # below an individual one after the other within its own, from the youngest generation.
+        # Offset of each subtree within the subtree it is placed below:
+        placed = np.flatnonzero(below >= 0)
+        placed = placed[np.argsort(below[placed], kind='stable')]
+        offset = np.cumsum(size[placed]) - size[placed]
+        group_first = np.r_[True, below[placed][1:] != below[placed][:-1]][:len(placed)]
+        offset -= np.maximum.accumulate(np.where(group_first, offset, 0))
+
+        start = np.zeros(n, dtype=np.int64)
+        roots = np.flatnonzero(below < 0)
+        start[roots] = np.cumsum(size[roots]) - size[roots]
+        start[placed] = offset
+        for first, last in slices[::-1]:
+            level = order[first:last]
+            level = level[below[level] >= 0]
+            start[level] += start[below[level]]
+
+        # An individual is numbered after its subtree (postorder).
+        label = start + size - 1
+        by_label = np.empty(n, dtype=np.int64)
+        by_label[label] = np.arange(n)
+
+        # Intervals of each individual, one generation at a time from the founders: its own
+        # subtree, merged with the intervals of its parents.
+        ptr = np.zeros(n + 1, dtype=np.int64)
+        lo = np.zeros(0, dtype=np.int64)
+        hi = np.zeros(0, dtype=np.int64)
+        for first, last in slices:
+            level = order[first:last]
+            owners = [np.arange(len(level))]
+            los = [start[level]]
+            his = [label[level]]
+            for parents in (fa[level], mo[level]):
+                known = np.flatnonzero(parents >= 0)
+                p = pos[parents[known]]
+                owners.append(np.repeat(known, ptr[p + 1] - ptr[p]))
+                los.append(gather_children(ptr, lo, p))
+                his.append(gather_children(ptr, hi, p))
+            level_lo, level_hi, counts = _merge_intervals(np.concatenate(owners), np.concatenate(los),
+                    np.concatenate(his), len(level), n)
+            ptr[first + 1:last + 1] = len(lo) + np.cumsum(counts)
+            lo = np.concatenate((lo, level_lo))
+            hi = np.concatenate((hi, level_hi))
+
+        dtype = np.int32 if n < 2 ** 31 else np.int64
+
+        return cls(inds, np.argsort(inds, kind='stable'), pos, order, label, by_label, ptr, lo.astype(dtype),
+                hi.astype(dtype), child_ptr, children)
+
+    def arrays(self):
+        '''Dictionary of the arrays of the index, see `ARRAYS`.'''
+        return {name: getattr(self, name) for name in self.ARRAYS}
+
+    def row(self, ind):
+        '''Row of individual `ind`.'''
+        i = np.searchsorted(self.inds, ind, sorter=self.rin_order)
+        assert i < len(self.inds) and self.inds[self.rin_order[i]] == ind, \
+                'Individual %d does not exist in genealogy.' % ind
+        return int(self.rin_order[i])
+
+    def _intervals(self, row):
+        '''Intervals of the individual in `row` and its ancestors.'''
+        p = self.pos[row]
+        return self.lo[self.ptr[p]:self.ptr[p + 1]], self.hi[self.ptr[p]:self.ptr[p + 1]]
+
+    def _labels(self, row):
+        '''Numbers of the individual in `row` and its ancestors, sorted.'''
+        lo, hi = self._intervals(row)
+        counts = (hi - lo + 1).astype(np.int64)
+        return np.repeat(lo - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+
+    def _rows(self, labels, exclude=()):
+        '''Rows of individuals with numbers `labels`, except rows `exclude`, in topological order.'''
+        rows = self.by_label[labels]
+        rows = rows[~np.isin(rows, exclude)]
+        return rows[np.argsort(self.pos[rows], kind='stable')]
+
+    def ancestors(self, ind):
+        '''
+        Get the ancestors of an individual.
+
+        Returns:
+        List of integer, RIN of ancestors, in topological order (oldest generations first).
+        '''
+        row = self.row(ind)
+        return self.inds[self._rows(self._labels(row), [row])].tolist()
+
+    def is_ancestor(self, anc, ind):
+        '''Check whether `anc` is an ancestor of `ind` (an individual is not its own ancestor).'''
+        a = self.row(anc)
+        b = self.row(ind)
+        if a == b:
+            return False
+        x = self.label[a]
+        lo, hi = self._intervals(b)
+        i = np.searchsorted(lo, x, side='right') - 1
+        return bool(i >= 0 and hi[i] >= x)
+
+    def _common(self, ind1, ind2):
+        '''Rows of the common ancestors of two individuals, in topological order.'''
+        row1 = self.row(ind1)
+        row2 = self.row(ind2)
+        labels = np.intersect1d(self._labels(row1), self._labels(row2), assume_unique=True)
+        return self._rows(labels, [row1, row2])
+
+    def common_ancestors(self, ind1, ind2):
+        '''
+        Get the ancestors that two individuals share.
+
+        Returns:
+        List of integer, RIN of common ancestors, in topological order.
+        '''
+        return self.inds[self._common(ind1, ind2)].tolist()
+
+    def mrca(self, ind1, ind2):
+        '''
+        Get the most recent common ancestors of two individuals.
+
+        A common ancestor is a most recent common ancestor if it is not an ancestor of another
+        common ancestor. For example, full siblings have two most recent common ancestors, their
+        parents. A common ancestor of another common ancestor has a child that is also a common
+        ancestor (on the path between them), so the most recent are the ones with no children
+        among the common ancestors.
+
+        Returns:
+        List of integer, RIN of most recent common ancestors, in topological order.
+        '''
+        rows = self._common(ind1, ind2)
+
+        counts = self.child_ptr[rows + 1] - self.child_ptr[rows]
+        kids = gather_children(self.child_ptr, self.children, rows)
+        owners = np.repeat(np.arange(len(rows)), counts)
+        older = np.zeros(len(rows), dtype=bool)
+        older[owners[np.isin(kids, rows)]] = True
+
+        return self.inds[rows[~older]].tolist()
+
+
+def _merge_intervals(owners, lo, hi, m, n):
+    '''
+    Merge overlapping and adjacent intervals of `m` individuals, see `AncestorIndex.build`.
+
+    Input:
+        owners:     Array of integer, individual (0 to m-1) of each interval.
+        lo, hi:     Arrays of integer, first and last number of each interval, below `n`.
+
+    Returns:
+    Tuple (lo, hi, counts), merged intervals sorted by individual and number, and the number of
+    intervals of each individual.
+    '''
+    # Shift the intervals of each individual past those of the previous ones, so that they can
+    # be sorted and merged together, without merging intervals of different individuals.
+    shift = owners.astype(np.int64) * (n + 1)
+    lo = lo + shift
+    hi = hi + shift
+    order = np.argsort(lo, kind='stable')
+    lo = lo[order]
+    hi = np.maximum.accumulate(hi[order])
 
-    return depth
+    # An interval starts a new merged interval if it starts after the end of all earlier ones.
+    new = np.r_[True, lo[1:] > hi[:-1] + 1]
+    starts = np.flatnonzero(new)
+    ends = np.r_[starts[1:] - 1, len(lo) - 1]
+    owners = owners[order][starts]
 
+    return lo[starts] - owners * (n + 1), hi[ends] - owners * (n + 1), np.bincount(owners, minlength=m)
@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+'''
+Check a genealogy CSV (produced by `ged2csv.py`) for errors, and report all of them.
+
+The checks are: parents that are not in the CSV, fathers with sex F, mothers with sex M,
+parents born after their children, individuals that are their own ancestor (cycles), and
+individuals that descend from a cycle, see `GenStore.validate` in `lineages.py`. A summary is printed, and the individual problems are
+written to a CSV with the columns ind, problem and parent, or printed if no output is given.
+The exit status is 1 if there are problems.
+
+Usage:
+    python validate.py --csv [CSV]
+    python validate.py --csv [CSV] --out [problems CSV]
+'''
+
+from lineages import csv2dict
+import argparse, sys
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+
+    # Arguments for parser.
+    parser.add_argument('--csv', type=str, required=True, help='Path to genealogy CSV.')
+    parser.add_argument('--out', type=str, help='Path to write CSV with all problems to.')
+    parser.add_argument('--no_cache', action='store_true', help='Do not use a binary cache of the CSV.')
+
+    # Parse input arguments.
+    args = parser.parse_args()
+
+    problems = csv2dict(args.csv, cache=not args.no_cache).validate()
+
+    if len(problems) == 0:
+        print('No problems found in %s.' % args.csv)
+        sys.exit()
+
+    print('%d problems found in %s:' % (len(problems), args.csv))
+    for problem, count in problems.problem.value_counts().items():
+        print('    %s: %d' % (problem, count))
+
+    if args.out is not None:
+        problems.to_csv(args.out, index=None)
+        print('All problems are written to %s.' % args.out)
+    else:
+        print(problems.to_csv(index=None), end='')
+
+    sys.exit(1)
@@ -1,7 +1,8 @@
 #!/usr/bin/env python
 
-import subprocess
-from lineages.lineages import csv2dict, Gen
+import subprocess, json, os, socket, time
+from lineages.lineages import csv2dict, Gen, Record
+from lineages.utils import calc_depth
 
 def compare_records(rec1, rec2):
     '''Check that all fields in the two input records match.'''
@@ -81,6 +82,426 @@ def check_gen_records(csv, csv_correct):
 
     return result
 
+def check_batch_ids(csv):
+    '''Compare RIN IDs in Gen objects constructed with and without batch mode.'''
+    gen1 = Gen(csv, [1])
+    gen2 = Gen(csv, [1], batch=True)
+
+    # Check that the ID sets are identical.
+    result = set(gen1.individuals) == set(gen2.individuals)
+
+    return result
+
+def check_cache_records(csv):
+    '''Compare records read from the binary cache of a CSV file to those read from the CSV.'''
+    dd1 = csv2dict(csv)
+    dd2 = csv2dict(csv, cache=True)  # Builds the cache, if it does not exist.
+    dd3 = csv2dict(csv, cache=True)  # Reads the cache.
+
+    result = set(dd1.keys()) == set(dd3.keys())
+    for i in dd1.keys():
+        if compare_records(dd1[i], dd3[i]) is False:
+            result = False
+
+    return result
+
+def check_refn(refn_csv):
+    '''Check REFN written by ged2csv.py along with the genealogy CSV.'''
+    # In the test tree, the REFN of each individual is the same as its RIN.
+    expected = {str(ind): str(ind) for ind in range(1, 8)}
+
+    refn = dict()
+    with open(refn_csv) as fid:
+        result = fid.readline().strip() == 'RIN,REFN'
+        for line in fid:
+            rin, ref = line.strip().split(',')
+            refn[rin] = ref
+
+    result = result and refn == expected
+
+    return result
+
+
+def check_match_ids(progeny, refn, match_out, txt_out, rejects_out):
+    '''Check samples matched with AEBS records by match_ids.py.'''
+    subprocess.check_output('match_ids.py --rejects %s %s %s %s %s' %(rejects_out, progeny, refn, match_out, txt_out), shell=True)
+
+    with open(match_out) as fid:
+        result = fid.read() == 'rin,sample\n1,sample1\n2,sample2\n6,sample3\n'
+    with open(txt_out) as fid:
+        result = result and fid.read() == '1\n2\n6\n'
+    with open(rejects_out) as fid:
+        result = result and fid.read() == 'sample,pnum,reason\nsample4,040435788,no matching REFN\n' \
+                'sample5,040435,invalid P-number\n'
+
+    return result
+
+
+def check_incremental(ged, csv, csv_incremental, changelog):
+    '''Check that incremental updates of a CSV match the CSV converted from scratch.'''
+    with open(csv) as fid:
+        expected = fid.read()
+
+    # First update parses everything, and adds all individuals.
+    subprocess.check_call('ged2csv.py --incremental --changelog %s %s %s' %(changelog, ged, csv_incremental), shell=True)
+    with open(csv_incremental) as fid:
+        result = fid.read() == expected
+    with open(changelog) as fid:
+        result = result and len([line for line in fid if line.strip().endswith(',added')]) == 7
+
+    # Second update parses nothing, and changes nothing.
+    subprocess.check_call('ged2csv.py --incremental --changelog %s %s %s' %(changelog, ged, csv_incremental), shell=True)
+    with open(csv_incremental) as fid:
+        result = result and fid.read() == expected
+    with open(changelog) as fid:
+        result = result and fid.read().strip() == 'ind,change'
+
+    return result
+
+
+def check_incremental_duplicate(ged, duplicate_ged, duplicate_csv, duplicate_incremental):
+    '''Check that an incremental update of a Gedcom file with a duplicated record matches the CSV converted from scratch.'''
+    with open(ged) as fid:
+        lines = fid.readlines()
+
+    # Insert a copy of the record of individual 4 after it.
+    start = [i for i, line in enumerate(lines) if line.startswith('0 @I4@ INDI')][0]
+    end = [i for i, line in enumerate(lines) if i > start and line.startswith('0 ')][0]
+    with open(duplicate_ged, 'w') as fid:
+        fid.writelines(lines[:end] + lines[start:end] + lines[end:])
+
+    subprocess.check_call('ged2csv.py %s %s' %(duplicate_ged, duplicate_csv), shell=True)
+    subprocess.check_call('ged2csv.py --incremental %s %s' %(duplicate_ged, duplicate_incremental), shell=True)
+    with open(duplicate_csv) as fid:
+        expected = fid.read()
+    with open(duplicate_incremental) as fid:
+        result = fid.read() == expected
+
+    return result
+
+
+def check_write_read(csv, gen_out):
+    '''Check that a genealogy written by Gen (compressed) is read back into Gen without loss.'''
+    gen1 = Gen(csv, [1])
+    gen1.write_csv(gen_out)
+    gen2 = Gen(gen_out, [1], cache=False)
+
+    result = gen1.individuals == gen2.individuals
+    result = result and all(compare_records(gen1.get(ind), gen2.get(ind)) for ind in gen1.individuals)
+
+    return result
+
+
+def check_ancestor_index(csv):
+    '''Check ancestry queries of Gen object on the test tree.'''
+    gen = Gen(csv, [1])
+
+    # 1 is the child of 2 and 3, 2 is the child of 4 and 5, and 3 is the child of 6 and 7.
+    result = gen.is_ancestor(4, 1) and gen.is_ancestor(2, 1) and not gen.is_ancestor(1, 4) \
+            and not gen.is_ancestor(6, 2) and not gen.is_ancestor(1, 1)
+    result = result and set(gen.common_ancestors(1, 2)) == {4, 5} and gen.common_ancestors(2, 3) == []
+    result = result and set(gen.mrca(1, 2)) == {4, 5}
+
+    # The index of the whole genealogy is stored in the binary cache, and read by later Gen objects.
+    result = result and os.path.isfile(os.path.join(csv + '.cache', 'ancestors', 'meta.json'))
+    result = result and set(Gen(csv, [1, 3]).common_ancestors(1, 2)) == {4, 5}
+
+    # With a cut-off, the index of the reconstructed genealogy is used.
+    gen = Gen(csv, [1], depth=1)
+    result = result and gen.is_ancestor(2, 1) and gen.common_ancestors(1, 2) == [] and gen.mrca(1, 2) == []
+
+    return result
+
+
+def check_descendants(csv):
+    '''Check descendants in Gen objects constructed with direction down, with and without cut-offs.'''
+    # 1 is the child of 2 and 3, 2 is the child of 4 and 5, and 3 is the child of 6 and 7.
+    result = set(Gen(csv, [4], direction='down').individuals) == {4, 2, 1}
+    result = result and set(Gen(csv, [6, 7], direction='down').individuals) == {6, 7, 3, 1}
+    result = result and set(Gen(csv, [4], depth=1, direction='down').individuals) == {4, 2}
+    # 1 is born in 1990, after the cut-off.
+    result = result and set(Gen(csv, [5], by=1980, direction='down').individuals) == {5, 2}
+    result = result and Gen(csv, [1], direction='down').individuals == [1]
+
+    return result
+
+
+def check_prune(csv, pruned_out):
+    '''Check the pedigree connecting probands on the test tree, and that it is written without loss.'''
+    # 2 is an ancestor of 1, and their common ancestors 4 and 5 are removed as founders with one child.
+    pruned = Gen(csv, [1, 2]).prune()
+    result = sorted(pruned.individuals) == [1, 2]
+    result = result and pruned.get(2).fa == 0 and pruned.get(2).mo == 0 and pruned.get(1).fa == 2
+    result = result and sorted(Gen(csv, [1, 2, 3]).prune().individuals) == [1, 2, 3]
+    result = result and Gen(csv, [1]).prune().individuals == [1]
+
+    pruned.write_csv(pruned_out)
+    result = result and Gen(pruned_out, [1], cache=False).individuals == [1, 2]
+
+    return result
+
+
+def check_topological(csv, inds, topological_out):
+    '''Check that a genealogy written in topological order has founders first and parents before children.'''
+    gen = Gen(csv, [1, 2, 3])
+    gen.write_csv(topological_out, order='topological')
+    dd = csv2dict(topological_out)
+
+    # Founders in the order they were reconstructed, then their children, then the proband.
+    result = list(dd.keys()) == [4, 5, 6, 7, 2, 3, 1]
+    result = result and all(compare_records(dd[ind], gen.get(ind)) for ind in gen.individuals)
+
+    # Also when executing lineages.py directly.
+    subprocess.check_call('lineages.py --csv %s --ind %s --out %s --order topological'
+            %(csv, inds, topological_out), shell=True)
+    result = result and list(csv2dict(topological_out).keys()) == [4, 5, 6, 7, 2, 3, 1]
+
+    return result
+
+
+def check_validate(csv, invalid_csv, problems_out):
+    '''Check that all errors in a genealogy are found, by validate.py and when Gen reads the CSV.'''
+    result = len(csv2dict(csv).validate()) == 0
+
+    # Make 1 the father of 4 (a cycle: 1, 2, 4), make 7 male (a mother with sex M), let 2 be born
+    # after 1, and give 5 a father that does not exist.
+    with open(csv) as fid:
+        lines = fid.read().splitlines()
+    replace = {'4,0,0,': '4,1,0,', '7,0,0,F': '7,0,0,M', '2,4,5,M,1950': '2,4,5,M,1995', '5,0,0,': '5,99,0,'}
+    for i, line in enumerate(lines):
+        for old, new in replace.items():
+            if line.startswith(old):
+                lines[i] = new + line[len(old):]
+    with open(invalid_csv, 'w') as fid:
+        fid.write('\n'.join(lines) + '\n')
+
+    result = result and subprocess.call('validate.py --no_cache --csv %s --out %s' %(invalid_csv, problems_out),
+            shell=True, stdout=subprocess.DEVNULL) == 1
+    with open(problems_out) as fid:
+        problems = set(line.strip() for line in fid.readlines()[1:])
+    expected = {'1,ancestor of itself,0', '2,ancestor of itself,0', '4,ancestor of itself,0',
+            '3,mother has sex M,7', '1,father born after child,2', '4,father born after child,1', '5,missing father,99'}
+    result = result and problems == expected
+
+    try:
+        Gen(invalid_csv, [1], cache=False, validate=True)
+        result = False
+    except ValueError as err:
+        result = result and len(err.problems) == len(expected)
+
+    # A genealogy store that has already been read is also validated.
+    try:
+        Gen(csv2dict(invalid_csv), [1], validate=True)
+        result = False
+    except ValueError as err:
+        result = result and len(err.problems) == len(expected)
+
+    return result
+
+
+def check_linked_cycles(cycles_csv):
+    '''Check that only individuals in a cycle are reported as their own ancestor, when two cycles are linked.'''
+    # 20 and 21 are a cycle, 24 is a child of 21 and the father of 22, and 22 and 23 are a cycle.
+    # 25 is a child of 23.
+    with open(cycles_csv, 'w') as fid:
+        fid.write('ind,father,mother,sex,birth_year,birth_place\n')
+        fid.write('20,21,0,U,NA,NA\n21,20,0,U,NA,NA\n22,24,23,U,NA,NA\n23,22,0,U,NA,NA\n24,21,0,U,NA,NA\n'
+                '25,23,0,U,NA,NA\n')
+
+    problems = csv2dict(cycles_csv).validate()
+    problems = set(zip(problems.ind.tolist(), problems.problem.tolist()))
+    expected = {(20, 'ancestor of itself'), (21, 'ancestor of itself'), (22, 'ancestor of itself'),
+            (23, 'ancestor of itself'), (24, 'descends from a cycle'), (25, 'descends from a cycle')}
+
+    return problems == expected
+
+
+def check_depth(csv, invalid_csv):
+    '''Check generational depths of individuals in Gen object, dictionary and genealogy with a cycle.'''
+    gen = Gen(csv, [1])
+
+    # Grandparents of 1 are founders.
+    expected = {1: 2, 2: 1, 3: 1, 4: 0, 5: 0, 6: 0, 7: 0}
+    result = all(calc_depth(ind, gen) == depth for ind, depth in expected.items())
+
+    # A cycle between 10 and 11 does not affect the depths of the other individuals.
+    dd = dict(gen.gen)
+    dd[10] = Record(11, 0, 'M', None, None)
+    dd[11] = Record(10, 0, 'M', None, None)
+    result = result and all(calc_depth(ind, dd) == depth for ind, depth in expected.items())
+
+    # In the invalid genealogy (see `check_validate`), 1, 2 and 4 are in a cycle.
+    store = csv2dict(invalid_csv)
+    result = result and calc_depth(3, store) == 1 and calc_depth(7, store) == 0
+    for ind, gen in ((10, dd), (1, store)):
+        try:
+            calc_depth(ind, gen)
+            result = False
+        except ValueError:
+            pass
+
+    return result
+
+
+def check_kinship(kinship_csv):
+    '''Compare kinship coefficients produced by kinship.py to the expected.'''
+    # Individual 1 is the child of 2 and 3, who are unrelated and not inbred.
+    expected = {(1, 1): 0.5, (2, 2): 0.5, (3, 3): 0.5, (1, 2): 0.25, (1, 3): 0.25}
+
+    kinship = dict()
+    with open(kinship_csv) as fid:
+        fid.readline()  # Discard header.
+        for line in fid:
+            ind1, ind2, phi = line.strip().split(',')
+            kinship[(int(ind1), int(ind2))] = float(phi)
+
+    result = kinship == expected
+
+    return result
+
+
+def check_genedrop(genedrop_csv, genedrop_csv2):
+    '''Compare carrier probabilities produced by genedrop.py, with founders 4 and 5 as carriers, to the expected.'''
+    # 2 is the child of two carriers, and 1 is the child of 2 and 3, who is not related to the carriers.
+    expected = {1: (0.5, 0.0), 2: (0.75, 0.25), 3: (0.0, 0.0)}
+
+    with open(genedrop_csv) as fid:
+        lines = fid.readlines()
+    result = lines[0].strip() == 'ind,carrier,homozygous'
+    for line in lines[1:]:
+        ind, carrier, homozygous = line.strip().split(',')
+        exp_carrier, exp_homozygous = expected[int(ind)]
+        # 20000 replicates give a standard error below 0.004.
+        result = result and abs(float(carrier) - exp_carrier) < 0.02 and abs(float(homozygous) - exp_homozygous) < 0.02
+
+    # The same seed gives the same result, with blocks simulated in several processes.
+    with open(genedrop_csv2) as fid:
+        result = result and fid.readlines() == lines
+
+    return result
+
+
+def check_inbreeding(csv, inbreeding_csv):
+    '''Check that kinship.py --inbreeding adds an inbreeding column to the CSV, without changing it.'''
+    with open(csv) as fid:
+        lines = [line.strip() for line in fid]
+    with open(inbreeding_csv) as fid:
+        lines_inbreeding = [line.strip().rsplit(',', 1) for line in fid]
+
+    # Header and records should be unchanged, and no one in the test tree is inbred.
+    result = lines_inbreeding[0] == [lines[0], 'inbreeding']
+    result = result and [line for line, F in lines_inbreeding[1:]] == lines[1:]
+    result = result and all(float(F) == 0 for line, F in lines_inbreeding[1:])
+
+    return result
+
+
+def check_profile(csv, inds, exec_out, profile_out):
+    '''Check that lineages.py --profile_json writes the stages of the run, with traversal counters.'''
+    subprocess.check_call('lineages.py --csv %s --ind %s --out %s --profile_json %s' %(csv, inds, exec_out, profile_out),
+            shell=True, stderr=subprocess.DEVNULL)
+    with open(profile_out) as fid:
+        stages = {stage['name']: stage for stage in json.load(fid)['stages']}
+
+    result = {'gen', 'gen/csv2dict', 'gen/genealogy', 'write_csv'} <= set(stages)
+    result = result and stages['gen/genealogy']['counts']['individuals'] == 7
+    # 2 and 3 are expanded again as probands, as they are reached at a smaller depth.
+    result = result and stages['gen/genealogy']['counts']['nodes_visited'] == 13
+    result = result and all(stage['wall'] >= 0 and stage['peak_rss_mb'] > 0 for stage in stages.values())
+
+    return result
+
+
+def check_server(csv, inds, exec_out, server_csv, server_socket, client_out):
+    '''
+    Check that lineages_client.py gets the same genealogy from lineages_server.py as lineages.py
+    writes, and that the server reloads the CSV when it changes.
+    '''
+    subprocess.check_call('cp %s %s' %(csv, server_csv), shell=True)
+    server = subprocess.Popen('exec lineages_server.py --csv %s --socket %s --poll 0.1' %(server_csv, server_socket),
+            shell=True, stderr=subprocess.DEVNULL)
+    try:
+        for _ in range(300):
+            if os.path.exists(server_socket):
+                break
+            time.sleep(0.1)
+
+        subprocess.check_call('lineages_client.py --socket %s --ind %s --out %s' %(server_socket, inds, client_out), shell=True)
+        with open(client_out) as fid:
+            result = fid.read()
+        with open(exec_out) as fid:
+            result = result == fid.read()
+
+        # A malformed Content-Length is a bad request.
+        for length in ('abc', '-1'):
+            with socket.socket(socket.AF_UNIX) as sock:
+                sock.connect(server_socket)
+                sock.sendall(('POST /genealogy HTTP/1.1\r\nContent-Length: %s\r\n\r\n' % length).encode('latin-1'))
+                result = result and sock.makefile('rb').readline().split()[1] == b'400'
+
+        # Descendants of 4 are 4, 2 and 1.
+        with open(client_out, 'w') as fid:
+            fid.write('4\n')
+        subprocess.check_call('lineages_client.py --socket %s --ind %s --out %s --direction down' %(server_socket, client_out, client_out),
+                shell=True)
+        with open(client_out) as fid:
+            result = result and sorted(line.split(',')[0] for line in fid.readlines()[1:]) == ['1', '2', '4']
+
+        # Remove individual 1 from the CSV, and wait for the server to reload it.
+        with open(server_csv) as fid:
+            lines = [line for line in fid if not line.startswith('1,')]
+        time.sleep(0.1)
+        with open(server_csv, 'w') as fid:
+            fid.write(''.join(lines))
+        with open(client_out, 'w') as fid:
+            fid.write('1\n')
+        for _ in range(300):
+            time.sleep(0.1)
+            if subprocess.call('lineages_client.py --socket %s --ind %s --out %s' %(server_socket, client_out, client_out),
+                    shell=True, stderr=subprocess.DEVNULL) != 0:
+                break
+        else:
+            result = False
+    finally:
+        server.terminate()
+        server.wait()
+
+    return result and not os.path.exists(server_socket)
+
+
+def check_manifest(csv, inds, exec_out, manifest, manifest_outs):
+    '''Check that lineages.py --manifest writes the genealogy of each cohort, as lineages.py does for one.'''
+    with open(manifest, 'w') as fid:
+        fid.write('ind,out,d_thres,by_thres\n')
+        fid.write('%s,%s,,\n' %(inds, manifest_outs[0]))
+        fid.write('%s,%s,0,\n' %(inds, manifest_outs[1]))
+    subprocess.check_call('lineages.py --csv %s --manifest %s --workers 2' %(csv, manifest), shell=True,
+            stdout=subprocess.DEVNULL)
+
+    with open(manifest_outs[0]) as fid:
+        result = fid.read()
+    with open(exec_out) as fid:
+        result = result == fid.read()
+
+    # With depth 0, only the individuals themselves.
+    with open(manifest_outs[1]) as fid:
+        result = result and sorted(line.split(',')[0] for line in fid.readlines()[1:]) == ['1', '2', '3']
+
+    return result
+
+
+def check_simulate(sim_ged, sim_csv, sim_converted):
+    '''Check that the CSV written by simulate.py matches the CSV ged2csv.py converts from its Gedcom file.'''
+    subprocess.check_call('simulate.py --n 2000 --seed 1 --ged %s --csv %s' %(sim_ged, sim_csv), shell=True)
+    subprocess.check_call('ged2csv.py %s %s' %(sim_ged, sim_converted), shell=True)
+
+    with open(sim_csv) as fid:
+        expected = fid.read()
+    with open(sim_converted) as fid:
+        result = fid.read() == expected
+
+    return result and len(expected.splitlines()) == 2001
+
 
 if __name__ == '__main__':
     data_dir = 'test_data'
@@ -89,27 +510,82 @@ if __name__ == '__main__':
     ged = data_dir + '/small_test_tree.ged'
     csv_correct = data_dir + '/correct_results.csv'
     inds = data_dir + '/test_individuals.txt'
+    progeny = data_dir + '/test_progeny.csv'
+    refn = data_dir + '/test_refn.csv'
 
     # Output data.
     csv = data_dir + '/small_test_tree.csv'
     ged_cleaned = data_dir + '/small_test_tree_cleaned.ged'
     exec_out = data_dir + '/small_test_tree_lineages_exec.csv'
+    kinship_out = data_dir + '/small_test_tree_kinship.csv'
+    inbreeding_out = data_dir + '/small_test_tree_inbreeding.csv'
+    genedrop_outs = [data_dir + '/small_test_tree_genedrop1.csv', data_dir + '/small_test_tree_genedrop2.csv']
+    csv_incremental = data_dir + '/small_test_tree_incremental.csv'
+    changelog = data_dir + '/small_test_tree_changelog.csv'
+    duplicate_ged = data_dir + '/small_test_tree_duplicate.ged'
+    duplicate_csv = data_dir + '/small_test_tree_duplicate.csv'
+    duplicate_incremental = data_dir + '/small_test_tree_duplicate_incremental.csv'
+    refn_out = data_dir + '/small_test_tree_refn.csv'
+    match_out = data_dir + '/test_match.csv'
+    match_txt = data_dir + '/test_match.txt'
+    rejects_out = data_dir + '/test_match_rejects.csv'
+    gen_out = data_dir + '/small_test_tree_gen.csv.gz'
+    profile_out = data_dir + '/small_test_tree_profile.json'
+    pruned_out = data_dir + '/small_test_tree_pruned.csv'
+    topological_out = data_dir + '/small_test_tree_topological.csv'
+    invalid_csv = data_dir + '/small_test_tree_invalid.csv'
+    problems_out = data_dir + '/small_test_tree_problems.csv'
+    cycles_csv = data_dir + '/test_cycles.csv'
+    manifest = data_dir + '/test_manifest.csv'
+    manifest_outs = [data_dir + '/small_test_tree_cohort1.csv', data_dir + '/small_test_tree_cohort2.csv']
+    server_csv = data_dir + '/small_test_tree_server.csv'
+    server_socket = data_dir + '/small_test_tree_server.sock'
+    client_out = data_dir + '/small_test_tree_client.csv'
+    sim_ged = data_dir + '/simulated.ged'
+    sim_csv = data_dir + '/simulated.csv'
+    sim_converted = data_dir + '/simulated_converted.csv'
 
     print('Cleaning up GED data.')
     subprocess.check_output('ged_cleanup.sh %s %s' %(ged, ged_cleaned), shell=True)
 
     print('Converting from GED to CSV.')
-    subprocess.check_output('ged2csv.py %s %s' %(ged_cleaned, csv), shell=True)
+    subprocess.check_output('ged2csv.py --refn-csv %s %s %s' %(refn_out, ged_cleaned, csv), shell=True)
 
     print('Checking data in CSV.')
     result = check_ids(csv, csv_correct)
     assert result, "RIN IDs in CSV file don't match the expected."
     result = check_records(csv, csv_correct)
     assert result, 'Information in at least one record in CSV file does not match the expected.'
+    result = check_refn(refn_out)
+    assert result, 'RIN and REFN in CSV file written by ged2csv.py do not match the expected.'
+    result = check_incremental(ged_cleaned, csv, csv_incremental, changelog)
+    assert result, 'CSV produced by incremental update does not match the CSV converted from scratch.'
+    result = check_incremental_duplicate(ged_cleaned, duplicate_ged, duplicate_csv, duplicate_incremental)
+    assert result, 'CSV produced by incremental update of a GED file with a duplicated record does not match the expected.'
     result = check_gen_ids(csv, csv_correct)
     assert result, "RIN IDs in Gen object don't match the expected."
     result = check_gen_records(csv, csv_correct)
     assert result, 'Information in at least one record in Gen object does not match the expected.'
+    result = check_batch_ids(csv)
+    assert result, "RIN IDs in Gen object constructed in batch mode don't match those in normal mode."
+    result = check_cache_records(csv)
+    assert result, 'Information in at least one record in binary cache does not match the CSV file.'
+    result = check_write_read(csv, gen_out)
+    assert result, 'Genealogy written by Gen does not match the genealogy read back from the file.'
+    result = check_ancestor_index(csv)
+    assert result, 'Ancestry queries of Gen object do not match the expected.'
+    result = check_descendants(csv)
+    assert result, 'Descendants in Gen object do not match the expected.'
+    result = check_prune(csv, pruned_out)
+    assert result, 'Pruned genealogy does not match the expected.'
+    result = check_topological(csv, inds, topological_out)
+    assert result, 'Genealogy written in topological order does not match the expected.'
+    result = check_validate(csv, invalid_csv, problems_out)
+    assert result, 'Problems found by validation do not match the expected.'
+    result = check_linked_cycles(cycles_csv)
+    assert result, 'Individuals in cycles found by validation do not match the expected.'
+    result = check_depth(csv, invalid_csv)
+    assert result, 'Generational depths of individuals in Gen object do not match the expected.'
 
     # Check records when executing lineages.py directly.
     subprocess.call('lineages.py --csv %s --ind %s --out %s' %(csv, inds, exec_out), shell=True)
@@ -118,10 +594,53 @@ if __name__ == '__main__':
     result = check_records(exec_out, csv_correct)
     assert result, 'Information in at least one record in CSV from executing lineages.py directly does not match the expected.'
 
+    # Check profiling of lineages.py.
+    result = check_profile(csv, inds, exec_out, profile_out)
+    assert result, 'Profile written by lineages.py does not match the expected.'
+
+    # Check reconstruction of several cohorts from a manifest.
+    result = check_manifest(csv, inds, exec_out, manifest, manifest_outs)
+    assert result, 'Genealogies written by lineages.py --manifest do not match the expected.'
+
+    # Check queries to the genealogy server.
+    result = check_server(csv, inds, exec_out, server_csv, server_socket, client_out)
+    assert result, 'Genealogy from lineages_client.py does not match the genealogy from lineages.py.'
+
+    # Check kinship coefficients.
+    subprocess.call('kinship.py --csv %s --ind %s --out %s' %(csv, inds, kinship_out), shell=True)
+    result = check_kinship(kinship_out)
+    assert result, 'Kinship coefficients produced by kinship.py do not match the expected.'
+
+    # Check carrier probabilities from gene dropping.
+    genedrop_cmd = 'genedrop.py --csv %s --ind %s --carriers 4 5 --replicates 20000 --block_size 1000 --seed 1 --out %s'
+    subprocess.call(genedrop_cmd %(csv, inds, genedrop_outs[0]), shell=True)
+    subprocess.call((genedrop_cmd + ' --processes 2') %(csv, inds, genedrop_outs[1]), shell=True)
+    result = check_genedrop(*genedrop_outs)
+    assert result, 'Carrier probabilities produced by genedrop.py do not match the expected.'
+
+    # Check inbreeding coefficients of the whole CSV.
+    subprocess.call('kinship.py --csv %s --inbreeding --out %s' %(csv, inbreeding_out), shell=True)
+    result = check_inbreeding(csv, inbreeding_out)
+    assert result, 'CSV with inbreeding coefficients produced by kinship.py does not match the expected.'
+
+    # Check matching of samples with AEBS records.
+    result = check_match_ids(progeny, refn, match_out, match_txt, rejects_out)
+    assert result, 'Samples matched by match_ids.py do not match the expected.'
+
+    # Check that simulated pedigrees are converted consistently.
+    result = check_simulate(sim_ged, sim_csv, sim_converted)
+    assert result, 'CSV written by simulate.py does not match the CSV converted from its Gedcom file.'
+
     print('All tests have succeeded.')
 
     print('Removing temporary files.')
 
-    subprocess.check_call('rm %s %s %s' %(ged_cleaned, csv, exec_out), shell=True)
+    tmp_files = [ged_cleaned, csv, csv + '.cache', exec_out, kinship_out, inbreeding_out, csv_incremental,
+            csv_incremental + '.fingerprints.json', changelog, refn_out, match_out, match_txt, rejects_out,
+            refn + '.index', gen_out, sim_ged, sim_csv, sim_converted, profile_out,
+            server_csv, server_csv + '.cache', client_out, pruned_out, topological_out,
+            manifest, invalid_csv, problems_out, cycles_csv, duplicate_ged, duplicate_csv, duplicate_incremental,
+            duplicate_incremental + '.fingerprints.json'] + manifest_outs + genedrop_outs
+    subprocess.check_call('rm -r %s' % ' '.join(tmp_files), shell=True)
 
 